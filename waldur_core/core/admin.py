@@ -270,15 +270,19 @@ class ExecutorAdminAction(object):
 
     def __call__(self, admin_class, request, queryset):
         errors = defaultdict(list)
-        successfully_executed = []
+        valid_instances = []
         for instance in queryset:
             try:
                 self.validate(instance)
             except ValidationError as e:
                 errors[six.text_type(e)].append(instance)
             else:
-                self.executor.execute(instance)
-                successfully_executed.append(instance)
+                valid_instances.append(instance)
+
+        failures = self.executor.execute_many(valid_instances) if valid_instances else {}
+        for instance, error in failures.items():
+            errors[six.text_type(error)].append(instance)
+        successfully_executed = [instance for instance in valid_instances if instance not in failures]
 
         if successfully_executed:
             message = _('Operation was successfully scheduled for %(count)d instances: %(names)s') % dict(
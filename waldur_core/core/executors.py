@@ -1,5 +1,17 @@
+from collections import OrderedDict
+import json
+import logging
+
+from celery import group
+from django.db.models import signals
+from django_fsm import ConcurrentTransition, TransitionNotAllowed
+from django_fsm.signals import post_transition
+import six
+
 from waldur_core.core import utils, tasks
 
+logger = logging.getLogger(__name__)
+
 
 class BaseExecutor(object):
     """ Base class for describing logical operation with backend.
@@ -45,11 +57,87 @@ class BaseExecutor(object):
         cls.post_apply(instance, async=async, **kwargs)
         return result
 
+    @classmethod
+    def execute_many(cls, instances, countdown=2, is_heavy_task=False, chunk_size=100, **kwargs):
+        """ Execute high-level operation for many instances asynchronously.
+
+        Instances are prepared with `pre_apply_many`, their signatures are
+        published as Celery groups of at most `chunk_size` signatures.
+        If executor defines its own `execute`, it is called for each instance instead.
+        Returns dictionary that maps instances that were not scheduled to errors.
+        """
+        if cls._is_execute_overridden(BaseExecutor):
+            return cls._execute_each(instances, countdown=countdown, is_heavy_task=is_heavy_task, **kwargs)
+        return cls._execute_in_bulk(
+            instances, countdown=countdown, is_heavy_task=is_heavy_task, chunk_size=chunk_size, **kwargs)
+
+    @classmethod
+    def _execute_in_bulk(cls, instances, countdown=2, is_heavy_task=False, chunk_size=100, **kwargs):
+        instances, errors = cls.pre_apply_many(instances, async=True, **kwargs)
+
+        signatures = []
+        for instance in instances:
+            serialized_instance = utils.serialize_instance(instance)
+            signature = cls.get_task_signature(instance, serialized_instance, **kwargs)
+            signature.set(
+                link=cls.get_success_signature(instance, serialized_instance, **kwargs),
+                link_error=cls.get_failure_signature(instance, serialized_instance, **kwargs),
+            )
+            signatures.append(signature)
+
+        for index in range(0, len(signatures), chunk_size):
+            group(signatures[index:index + chunk_size]).apply_async(
+                countdown=countdown, queue=is_heavy_task and 'heavy' or None)
+
+        for instance in instances:
+            cls.post_apply(instance, async=True, **kwargs)
+        return errors
+
+    @classmethod
+    def _execute_each(cls, instances, **kwargs):
+        errors = {}
+        for instance in instances:
+            try:
+                cls.execute(instance, async=True, **kwargs)
+            except Exception as e:
+                logger.warning('Failed to execute executor %s for instance %s. Error: %s',
+                               cls.__name__, instance, e)
+                errors[instance] = e
+        return errors
+
+    @classmethod
+    def _is_execute_overridden(cls, base):
+        """ Return True if subclass of base executor defines its own `execute` """
+        return cls.execute.__func__ is not base.execute.__func__
+
     @classmethod
     def pre_apply(cls, instance, **kwargs):
         """ Perform synchronous actions before signature apply """
         pass
 
+    @classmethod
+    def pre_apply_many(cls, instances, **kwargs):
+        """ Perform synchronous actions before signatures apply for many instances.
+
+        Returns list of prepared instances and dictionary that maps failed instances to errors.
+        """
+        prepared, errors = [], {}
+        for instance in instances:
+            try:
+                cls.pre_apply(instance, **kwargs)
+            except Exception as e:
+                logger.warning('Failed to prepare instance %s for executor %s. Error: %s',
+                               instance, cls.__name__, e)
+                errors[instance] = e
+            else:
+                prepared.append(instance)
+        return prepared, errors
+
+    @classmethod
+    def _is_pre_apply_overridden(cls, base):
+        """ Return True if subclass of base executor defines its own `pre_apply` """
+        return cls.pre_apply.__func__ is not base.pre_apply.__func__
+
     @classmethod
     def post_apply(cls, instance, **kwargs):
         """ Perform synchronous actions after signature apply """
@@ -87,6 +175,72 @@ class ExecutorException(Exception):
     pass
 
 
+def transition_many(instances, transition_method, get_fields=None):
+    """ Apply FSM transition to instances and save them in bulk.
+
+    Instances are grouped by model, source state and updated fields,
+    each group is saved using single UPDATE query that is filtered by source state.
+    Instances that were modified concurrently are not transited and are restored in order to match database.
+    As for transition of single instance, post_save signal with updated fields
+    and post_transition signal are sent for each transited instance, so that
+    denormalized data, such as resource index, is kept in sync and slots are released.
+    Returns list of transited instances and dictionary that maps failed instances to errors.
+    """
+    groups = OrderedDict()
+    errors = {}
+    previous_values = {}
+    for instance in instances:
+        source_state = instance.state
+        fields = get_fields(instance) if get_fields else {}
+        try:
+            getattr(instance, transition_method)()
+        except TransitionNotAllowed as e:
+            errors[instance] = e
+            continue
+        concrete_fields = [f.name for f in instance._meta.concrete_fields]
+        previous_values[instance] = {name: getattr(instance, name, None) for name in fields}
+        for name, value in fields.items():
+            setattr(instance, name, value)
+        fields = {name: value for name, value in fields.items() if name in concrete_fields}
+        key = (instance._meta.model, source_state, instance.state,
+               json.dumps(fields, sort_keys=True, default=six.text_type))
+        groups.setdefault(key, (fields, []))[1].append(instance)
+
+    transited = []
+    for (model, source_state, target_state, _), (fields, group_instances) in groups.items():
+        pks = [instance.pk for instance in group_instances]
+        manager = model._default_manager
+        updated = manager.filter(pk__in=pks, state=source_state).update(state=target_state, **fields)
+        if updated == len(pks):
+            group_transited = group_instances
+        else:
+            states = dict(manager.filter(pk__in=pks).values_list('pk', 'state'))
+            group_transited = []
+            for instance in group_instances:
+                if states.get(instance.pk) == target_state:
+                    group_transited.append(instance)
+                    continue
+                errors[instance] = ConcurrentTransition(
+                    'Cannot save object! The state has been changed since fetched from the database!')
+                instance.state = source_state
+                for name, value in previous_values[instance].items():
+                    setattr(instance, name, value)
+
+        update_fields = frozenset(['state'] + list(fields))
+        for instance in group_transited:
+            signals.post_save.send(sender=model, instance=instance, created=False,
+                                   update_fields=update_fields, raw=False, using=manager.db)
+            # Tracker is reset as after save, otherwise updated fields are reported as changed by next save.
+            tracker = getattr(instance, 'tracker', None)
+            tracked_fields = [name for name in update_fields if name in getattr(tracker, 'fields', ())]
+            if tracked_fields:
+                tracker.set_saved_fields(fields=tracked_fields)
+            post_transition.send(sender=model, instance=instance, name=transition_method,
+                                 source=source_state, target=target_state)
+        transited.extend(group_transited)
+    return transited, errors
+
+
 class ErrorExecutorMixin(object):
     """ Set object as erred on fail. """
 
@@ -145,8 +299,13 @@ class UpdateExecutor(SuccessExecutorMixin, ErrorExecutorMixin, BaseExecutor):
 
     @classmethod
     def pre_apply(cls, instance, **kwargs):
-        instance.schedule_updating()
-        instance.save(update_fields=['state'])
+        instance.atomic_transition('schedule_updating')
+
+    @classmethod
+    def pre_apply_many(cls, instances, **kwargs):
+        if cls._is_pre_apply_overridden(UpdateExecutor):
+            return super(UpdateExecutor, cls).pre_apply_many(instances, **kwargs)
+        return transition_many(instances, 'schedule_updating')
 
     @classmethod
     def execute(cls, instance, async=True, **kwargs):
@@ -154,6 +313,14 @@ class UpdateExecutor(SuccessExecutorMixin, ErrorExecutorMixin, BaseExecutor):
             raise ExecutorException('updated_fields keyword argument should be defined for UpdateExecutor.')
         super(UpdateExecutor, cls).execute(instance, async=async, **kwargs)
 
+    @classmethod
+    def execute_many(cls, instances, chunk_size=100, **kwargs):
+        if 'updated_fields' not in kwargs:
+            raise ExecutorException('updated_fields keyword argument should be defined for UpdateExecutor.')
+        if cls._is_execute_overridden(UpdateExecutor):
+            return cls._execute_each(instances, **kwargs)
+        return cls._execute_in_bulk(instances, chunk_size=chunk_size, **kwargs)
+
 
 class DeleteExecutor(DeleteExecutorMixin, BaseExecutor):
     """ Default states transition for object deletion.
@@ -165,8 +332,13 @@ class DeleteExecutor(DeleteExecutorMixin, BaseExecutor):
 
     @classmethod
     def pre_apply(cls, instance, **kwargs):
-        instance.schedule_deleting()
-        instance.save(update_fields=['state'])
+        instance.atomic_transition('schedule_deleting')
+
+    @classmethod
+    def pre_apply_many(cls, instances, **kwargs):
+        if cls._is_pre_apply_overridden(DeleteExecutor):
+            return super(DeleteExecutor, cls).pre_apply_many(instances, **kwargs)
+        return transition_many(instances, 'schedule_deleting')
 
 
 class ActionExecutor(SuccessExecutorMixin, ErrorExecutorMixin, BaseExecutor):
@@ -186,7 +358,12 @@ class ActionExecutor(SuccessExecutorMixin, ErrorExecutorMixin, BaseExecutor):
 
     @classmethod
     def pre_apply(cls, instance, **kwargs):
-        instance.schedule_updating()
-        instance.action = cls.action
-        instance.action_details = cls.get_action_details(instance, **kwargs)
-        instance.save()
+        instance.atomic_transition(
+            'schedule_updating', action=cls.action, action_details=cls.get_action_details(instance, **kwargs))
+
+    @classmethod
+    def pre_apply_many(cls, instances, **kwargs):
+        if cls._is_pre_apply_overridden(ActionExecutor):
+            return super(ActionExecutor, cls).pre_apply_many(instances, **kwargs)
+        return transition_many(instances, 'schedule_updating', lambda instance: dict(
+            action=cls.action, action_details=cls.get_action_details(instance, **kwargs)))
@@ -1,10 +1,11 @@
+import collections
 import copy
-import functools
-import heapq
-import itertools
 
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import FieldDoesNotExist
 from django.db import models
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.functions import Lower
 import six
 
 
@@ -75,13 +76,51 @@ class GenericKeyMixin(object):
         return super(GenericKeyMixin, self).get_or_create(*args, **kwargs)
 
 
+class TimeSegmentIndex(models.Func):
+    """ Index of time segment that datetime expression belongs to.
+
+    Index is computed as floor((epoch - start_timestamp) / time_step), so it is
+    correct only for datetimes that are not earlier than start_timestamp.
+
+    Example:
+        queryset.filter(created__gte=start).annotate(
+            segment=TimeSegmentIndex('created', start_timestamp, time_step)).values('segment')
+    """
+    template = 'FLOOR((EXTRACT(EPOCH FROM %(expressions)s) - %(start)s) / %(step)s)'
+
+    def __init__(self, expression, start_timestamp, time_step, **extra):
+        super(TimeSegmentIndex, self).__init__(
+            expression, start=int(start_timestamp), step=float(time_step),
+            output_field=models.IntegerField(), **extra)
+
+    def as_sqlite(self, compiler, connection):
+        # Cast to integer truncates value, it is the same as floor for positive values.
+        template = "CAST((CAST(strftime('%%%%s', %(expressions)s) AS INTEGER) - %(start)s) / %(step)s AS INTEGER)"
+        return self.as_sql(compiler, connection, template=template)
+
+    def as_mysql(self, compiler, connection):
+        template = 'FLOOR((UNIX_TIMESTAMP(%(expressions)s) - %(start)s) / %(step)s)'
+        return self.as_sql(compiler, connection, template=template)
+
+
 class SummaryQuerySet(object):
-    """ Fake queryset that emulates union of different models querysets """
+    """ Fake queryset that emulates union of different models querysets.
+
+    Rows of all querysets are combined using UNION ALL of content type, primary key
+    and ordering columns, so ordering, offset and limit are applied by database.
+    Then only objects of requested page are fetched from each model queryset by primary key.
+    """
 
     def __init__(self, summary_models):
         self.querysets = [model.objects.all() for model in summary_models]
         self._order_by = None
 
+    def map(self, func):
+        """ Return new summary queryset with function applied to each queryset, this one is not changed """
+        clone = copy.copy(self)
+        clone.querysets = [func(qs) for qs in self.querysets]
+        return clone
+
     def filter(self, *args, **kwargs):
         self.querysets = [qs.filter(*copy.deepcopy(args), **copy.deepcopy(kwargs)) for qs in self.querysets]
         return self
@@ -100,7 +139,9 @@ class SummaryQuerySet(object):
         return self
 
     def count(self):
-        return sum([qs.count() for qs in self.querysets])
+        if not self.querysets:
+            return 0
+        return self._get_union_queryset().count()
 
     def all(self):
         return self
@@ -112,82 +153,123 @@ class SummaryQuerySet(object):
             return
 
     def __getitem__(self, val):
-        chained_querysets = self._get_chained_querysets()
         if isinstance(val, slice):
-            return list(itertools.islice(chained_querysets, val.start, val.stop))
+            return self._get_page(val.start, val.stop)
         else:
-            try:
-                return next(itertools.islice(chained_querysets, val, val + 1))
-            except StopIteration:
+            page = self._get_page(val, val + 1)
+            if not page:
                 raise IndexError
+            return page[0]
 
-    def __len__(self):
-        return sum([q.count() for q in self.querysets])
+    def __iter__(self):
+        return iter(self._get_page(None, None))
 
-    def _get_chained_querysets(self):
-        if self._order_by:
-            return self._merge([qs.iterator() for qs in self.querysets], compared_attr=self._order_by)
-        else:
-            return itertools.chain(*[qs.iterator() for qs in self.querysets])
-
-    def _merge(self, subsequences, compared_attr='pk'):
-
-        @functools.total_ordering
-        class Compared(object):
-            """ Order objects by their attributes, reverse ordering if <reverse> is True """
-
-            def __init__(self, obj, attr, reverse=False):
-                self.attr = functools.reduce(Compared.get_obj_attr, attr.split("__"), obj)
-                if isinstance(self.attr, six.string_types):
-                    self.attr = self.attr.lower()
-                self.reverse = reverse
-
-            @staticmethod
-            def get_obj_attr(obj, attr):
-                # for m2m relationship support - get first instance of manager.
-                # for example: get first project group if resource has to be ordered by project groups.
-                if isinstance(obj, models.Manager):
-                    obj = obj.first()
-                return getattr(obj, attr) if obj else None
-
-            def __eq__(self, other):
-                return self.attr == other.attr
-
-            def __le__(self, other):
-                # In MySQL NULL values come *first* with ascending sort order.
-                # We use the same behaviour.
-                if self.attr is None:
-                    return not self.reverse
-                elif other.attr is None:
-                    return self.reverse
+    def __len__(self):
+        return self.count()
+
+    def _get_queryset_ordering(self, queryset):
+        return [field for field in queryset.query.order_by
+                if isinstance(field, six.string_types) and field != '?']
+
+    def _get_ordering(self):
+        """ Return ordering fields of the first ordered queryset """
+        for qs in self.querysets:
+            ordering = self._get_queryset_ordering(qs)
+            if ordering:
+                return ordering
+        return []
+
+    def _get_ordering_field(self, model, lookup):
+        """ Return model field referred by ordering lookup or None if it could not be resolved """
+        field = None
+        for name in lookup.split(LOOKUP_SEP):
+            if model is None:
+                return None
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            model = field.related_model
+        if field.is_relation:
+            field = getattr(field, 'target_field', None)
+        return field
+
+    def _get_ordering_output_fields(self, ordering):
+        """ Return output field of each ordering column, character fields are compared in lower case """
+        ordered_qs = next(qs for qs in self.querysets if self._get_queryset_ordering(qs))
+        output_fields = []
+        for lookup in ordering:
+            field = self._get_ordering_field(ordered_qs.model, lookup.lstrip('-'))
+            if isinstance(field, (models.CharField, models.TextField)):
+                field = models.CharField()
+            output_fields.append(field)
+        return output_fields
+
+    def _get_union_parts(self):
+        """ Return querysets of content type, primary key and ordering values for each model.
+
+        Each ordering column is preceded by column that is 0 for NULL values and 1 otherwise,
+        so that NULL values go first in ascending order and last in descending order
+        regardless of database, as objects were ordered before.
+        """
+        ordering = self._get_ordering()
+        output_fields = self._get_ordering_output_fields(ordering) if ordering else []
+        parts = []
+        for qs in self.querysets:
+            content_type = ContentType.objects.get_for_model(qs.model)
+            # Annotations are added one by one, so that columns of all parts have the same order.
+            annotations = collections.OrderedDict()
+            annotations['_summary_content_type'] = models.Value(content_type.id, output_field=models.IntegerField())
+            qs_ordering = self._get_queryset_ordering(qs)
+            for index, output_field in enumerate(output_fields):
+                if index < len(qs_ordering):
+                    lookup = qs_ordering[index].lstrip('-')
+                    value = models.F(lookup)
+                    if isinstance(output_field, models.CharField):
+                        value = Lower(value)
+                    not_null = models.Case(
+                        models.When(**{lookup + '__isnull': True, 'then': models.Value(0)}),
+                        default=models.Value(1),
+                        output_field=models.IntegerField())
                 else:
-                    return self.attr < other.attr if not self.reverse else self.attr >= other.attr
-
-        reverse = compared_attr.startswith('-')
-        if reverse:
-            compared_attr = compared_attr[1:]
-
-        # prepare a heap whose items are
-        # (compared, current-value, iterator), one each per (non-empty) subsequence
-        # <compared> is used for model instances comparison based on given attribute
-        heap = []
-        for subseq in subsequences:
-            iterator = iter(subseq)
-            for current_value in iterator:
-                # subseq is not empty, therefore add this subseq's item to the list
-                heapq.heappush(
-                    heap, (Compared(current_value, compared_attr, reverse=reverse), current_value, iterator))
-                break
-
-        while heap:
-            # get and yield lowest current value (and corresponding iterator)
-            _, current_value, iterator = heap[0]
-            yield current_value
-            for current_value in iterator:
-                # subseq is not finished, therefore add this subseq's item back into the priority queue
-                heapq.heapreplace(
-                    heap, (Compared(current_value, compared_attr, reverse=reverse), current_value, iterator))
-                break
-            else:
-                # subseq has been exhausted, therefore remove it from the queue
-                heapq.heappop(heap)
+                    value = models.Value(None, output_field=output_field)
+                    not_null = models.Value(0, output_field=models.IntegerField())
+                annotations['_summary_not_null_%s' % index] = not_null
+                annotations['_summary_order_%s' % index] = value
+            fields = ['_summary_content_type', 'pk']
+            for index in range(len(output_fields)):
+                fields += ['_summary_not_null_%s' % index, '_summary_order_%s' % index]
+            for name, value in annotations.items():
+                qs = qs.annotate(**{name: value})
+            parts.append(qs.order_by().values_list(*fields))
+        return parts
+
+    def _get_union_queryset(self):
+        parts = self._get_union_parts()
+        if len(parts) == 1:
+            return parts[0]
+        return parts[0].union(*parts[1:], all=True)
+
+    def _get_page(self, start, stop):
+        if not self.querysets:
+            return []
+
+        ordering = []
+        for index, field in enumerate(self._get_ordering()):
+            prefix = '-' if field.startswith('-') else ''
+            ordering += [prefix + '_summary_not_null_%s' % index, prefix + '_summary_order_%s' % index]
+        ordering += ['_summary_content_type', 'pk']
+        rows = list(self._get_union_queryset().order_by(*ordering)[start:stop])
+
+        # Fetch objects of each model using single query
+        pks = collections.defaultdict(list)
+        for row in rows:
+            pks[row[0]].append(row[1])
+        objects = {}
+        for qs in self.querysets:
+            content_type_id = ContentType.objects.get_for_model(qs.model).id
+            if pks[content_type_id]:
+                for obj in qs.filter(pk__in=pks[content_type_id]):
+                    objects[(content_type_id, obj.pk)] = obj
+
+        return [objects[row[:2]] for row in rows if row[:2] in objects]
@@ -15,12 +15,12 @@ from django.contrib.auth.models import PermissionsMixin, UserManager
 from django.core import validators
 from django.core.exceptions import ValidationError
 from django.core.mail import send_mail
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone as django_timezone
 from django.utils.encoding import force_text, python_2_unicode_compatible
 from django.utils.lru_cache import lru_cache
 from django.utils.translation import ugettext_lazy as _
-from django_fsm import transition, FSMIntegerField
+from django_fsm import transition, ConcurrentTransition, FSMIntegerField
 from model_utils import FieldTracker
 import pytz
 from reversion import revisions as reversion
@@ -330,6 +330,53 @@ class StateMixin(ErrorMessageMixin):
     def human_readable_state(self):
         return force_text(dict(self.States.CHOICES)[self.state])
 
+    def atomic_transition(self, transition_method, **fields):
+        """
+        Apply FSM transition and save new state together with given fields using single query:
+        UPDATE ... SET state = <target>, <fields> WHERE pk = <pk> AND state = <source>.
+
+        Other fields are not written, so concurrent updates of them are not lost.
+        Raises TransitionNotAllowed if transition is not allowed from current state
+        and ConcurrentTransition if state has been changed concurrently,
+        in this case state and fields of instance are restored.
+        """
+        source_state = self.state
+        previous_values = {name: getattr(self, name, None) for name in fields}
+        getattr(self, transition_method)()
+
+        concrete_fields = [f.name for f in self._meta.concrete_fields]
+        update_fields = ['state']
+        for name, value in fields.items():
+            setattr(self, name, value)
+            if name in concrete_fields:
+                update_fields.append(name)
+
+        self._expected_state = source_state
+        try:
+            # Savepoint allows to rollback failed update without breaking outer transaction.
+            with transaction.atomic():
+                self.save(update_fields=update_fields)
+        except Exception:
+            # Row is not updated, so instance is restored in order to match database.
+            self.state = source_state
+            for name, value in previous_values.items():
+                setattr(self, name, value)
+            raise
+        finally:
+            del self._expected_state
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        expected_state = getattr(self, '_expected_state', None)
+        if expected_state is None:
+            return super(StateMixin, self)._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+
+        updated = super(StateMixin, self)._do_update(
+            base_qs.filter(state=expected_state), using, pk_val, values, update_fields, forced_update)
+        if not updated:
+            raise ConcurrentTransition('State of %s instance (PK: %s) has been changed concurrently.' % (
+                self.__class__.__name__, self.pk))
+        return updated
+
     @transition(field=state, source=States.CREATION_SCHEDULED, target=States.CREATING)
     def begin_creating(self):
         pass
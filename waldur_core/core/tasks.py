@@ -15,7 +15,7 @@ from celery.worker.request import Request
 from django.core.cache import cache
 from django.db import IntegrityError, models as django_models
 from django.db.models import ObjectDoesNotExist
-from django_fsm import TransitionNotAllowed
+from django_fsm import ConcurrentTransition, TransitionNotAllowed
 
 from waldur_core.core import models, utils
 from waldur_core.core.exceptions import RuntimeStateException
@@ -143,14 +143,14 @@ class StateTransitionTask(Task):
     def state_transition(self, instance, transition_method, action=None, action_details=None):
         instance_description = '%s instance `%s` (PK: %s)' % (instance.__class__.__name__, instance, instance.pk)
         old_state = instance.human_readable_state
+        fields = {}
+        if action is not None:
+            fields['action'] = action
+        if action_details is not None:
+            fields['action_details'] = action_details
         try:
-            getattr(instance, transition_method)()
-            if action is not None:
-                instance.action = action
-            if action_details is not None:
-                instance.action_details = action_details
-            instance.save()
-        except IntegrityError:
+            instance.atomic_transition(transition_method, **fields)
+        except (IntegrityError, ConcurrentTransition):
             message = (
                 'Could not change state of %s, using method `%s` due to concurrent update' %
                 (instance_description, transition_method))
@@ -2,6 +2,9 @@ from __future__ import unicode_literals
 
 import unittest
 
+from django.core.cache import cache
+from six.moves import mock
+
 from waldur_core.core import utils
 
 
@@ -37,3 +40,77 @@ class TestFormatTimeAndValueToSegmentList(unittest.TestCase):
         expected_second_segment_value = sum([value for _, value in second_segment_time_value_list])
         self.assertEqual(first_segment['value'], expected_first_segment_value)
         self.assertEqual(second_segment['value'], expected_second_segment_value)
+
+    def test_values_outside_of_time_range_are_skipped(self):
+        segment_list = utils.format_time_and_value_to_segment_list(
+            [(10, 1), (20, 2), (39, 3), (40, 4), (50, 5)], 2, 20, 40)
+
+        self.assertEqual([segment['value'] for segment in segment_list], [2, 3])
+
+    def test_grouped_values_are_formatted_to_segments(self):
+        segment_list = utils.format_segment_values_to_segment_list({1: 5}, 3, 0, 30)
+
+        self.assertEqual(segment_list, [
+            {'from': 0, 'to': 10, 'value': 0},
+            {'from': 10, 'to': 20, 'value': 5},
+            {'from': 20, 'to': 30, 'value': 0},
+        ])
+
+
+class CacheSemaphoreTest(unittest.TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def get_semaphore(self, **kwargs):
+        params = dict(key='test-semaphore', limit=2, ttl=60, wait_ttl=10)
+        params.update(kwargs)
+        return utils.CacheSemaphore(**params)
+
+    def test_slots_are_acquired_until_limit_is_reached(self):
+        semaphore = self.get_semaphore()
+        self.assertTrue(semaphore.acquire('first'))
+        self.assertTrue(semaphore.acquire('second'))
+        self.assertFalse(semaphore.acquire('third'))
+        self.assertTrue(semaphore.acquire('first'))
+
+    def test_released_slot_is_given_to_the_oldest_waiter(self):
+        semaphore = self.get_semaphore(limit=1)
+        semaphore.acquire('holder')
+        semaphore.acquire('old waiter')
+        semaphore.acquire('new waiter')
+
+        semaphore.release('holder')
+
+        self.assertFalse(semaphore.acquire('new waiter'))
+        self.assertTrue(semaphore.acquire('old waiter'))
+
+    def test_expired_slot_is_released(self):
+        semaphore = self.get_semaphore(limit=1)
+        with mock.patch('time.time', return_value=1000):
+            semaphore.acquire('holder')
+        with mock.patch('time.time', return_value=1100):
+            self.assertTrue(semaphore.acquire('waiter'))
+
+    def test_release_waits_until_lock_is_freed(self):
+        semaphore = self.get_semaphore(limit=1)
+        semaphore.acquire('holder')
+        lock_key = 'test-semaphore:lock'
+        cache.add(lock_key, True)
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) > semaphore.LOCK_ATTEMPTS:
+                cache.delete(lock_key)
+
+        with mock.patch('time.sleep', side_effect=sleep):
+            semaphore.release('holder')
+
+        self.assertTrue(semaphore.acquire('waiter'))
+
+    def test_semaphore_is_initialized_with_given_holders(self):
+        semaphore = self.get_semaphore(get_initial_holders=lambda: ['first', 'second'])
+        self.assertFalse(semaphore.acquire('third'))
+        semaphore.release('first')
+        self.assertTrue(semaphore.acquire('third'))
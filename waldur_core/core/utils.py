@@ -1,8 +1,10 @@
 import calendar
 from collections import OrderedDict
+from contextlib import contextmanager
 import datetime
 import importlib
 from itertools import chain
+import logging
 from operator import itemgetter
 import os
 import re
@@ -10,6 +12,7 @@ import time
 
 from django.apps import apps
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.management import call_command
 from django.http import QueryDict
 from django.urls import resolve
@@ -17,6 +20,8 @@ from django.utils import timezone
 from django.utils.crypto import get_random_string
 from django.utils.encoding import force_text
 
+logger = logging.getLogger(__name__)
+
 
 def flatten(*xs):
     return tuple(chain.from_iterable(xs))
@@ -33,15 +38,49 @@ def sort_dict(unsorted_dict):
     return sorted_dict
 
 
+def get_segment_bounds(segments_count, start_timestamp, end_timestamp):
+    """ Return list of (start, end) tuples of segments that split time range into equal parts """
+    time_step = (end_timestamp - start_timestamp) / segments_count
+    bounds = []
+    for i in range(segments_count):
+        segment_start_timestamp = start_timestamp + time_step * i
+        bounds.append((segment_start_timestamp, segment_start_timestamp + time_step))
+    return bounds
+
+
+def format_segment_values_to_segment_list(segment_values, segments_count, start_timestamp, end_timestamp):
+    """
+    Format values that are already grouped by segment index to time segments
+
+    Parameters
+    ^^^^^^^^^^
+    segment_values: dictionary
+        Maps segment index to its value. Missing segments have zero value.
+        Example: {0: value, 3: value ...}
+    segments_count: integer
+        How many segments will be in result
+    Returns
+    ^^^^^^^
+    List of dictionaries
+        Example:
+        [{'from': time1, 'to': time2, 'value': value_of_segment}, ...]
+    """
+    bounds = get_segment_bounds(segments_count, start_timestamp, end_timestamp)
+    return [{'from': segment_start, 'to': segment_end, 'value': segment_values.get(index, 0)}
+            for index, (segment_start, segment_end) in enumerate(bounds)]
+
+
 def format_time_and_value_to_segment_list(time_and_value_list, segments_count, start_timestamp,
                                           end_timestamp, average=False):
     """
     Format time_and_value_list to time segments
 
+    Each value is assigned to its segment by index computed from its time,
+    so list is scanned only once and does not have to be sorted.
+
     Parameters
     ^^^^^^^^^^
     time_and_value_list: list of tuples
-        Have to be sorted by time
         Example: [(time, value), (time, value) ...]
     segments_count: integer
         How many segments will be in result
@@ -51,24 +90,27 @@ def format_time_and_value_to_segment_list(time_and_value_list, segments_count, s
         Example:
         [{'from': time1, 'to': time2, 'value': sum_of_values_from_time1_to_time2}, ...]
     """
-    segment_list = []
+    bounds = get_segment_bounds(segments_count, start_timestamp, end_timestamp)
     time_step = (end_timestamp - start_timestamp) / segments_count
-    for i in range(segments_count):
-        segment_start_timestamp = start_timestamp + time_step * i
-        segment_end_timestamp = segment_start_timestamp + time_step
-        value_list = [
-            value for time, value in time_and_value_list
-            if time >= segment_start_timestamp and time < segment_end_timestamp]
-        segment_value = sum(value_list)
-        if average and len(value_list) != 0:
-            segment_value /= len(value_list)
-
-        segment_list.append({
-            'from': segment_start_timestamp,
-            'to': segment_end_timestamp,
-            'value': segment_value,
-        })
-    return segment_list
+    values = {}
+    counts = {}
+    if time_step > 0:
+        for timestamp, value in time_and_value_list:
+            index = int((timestamp - start_timestamp) // time_step)
+            # Fix rounding errors of float step, so value belongs to segment [start, end).
+            if 0 <= index < segments_count and timestamp < bounds[index][0]:
+                index -= 1
+            elif 0 <= index < segments_count and timestamp >= bounds[index][1]:
+                index += 1
+            if 0 <= index < segments_count:
+                values[index] = values.get(index, 0) + value
+                counts[index] = counts.get(index, 0) + 1
+
+    if average:
+        for index, count in counts.items():
+            values[index] /= count
+
+    return format_segment_values_to_segment_list(values, segments_count, start_timestamp, end_timestamp)
 
 
 def datetime_to_timestamp(datetime):
@@ -131,6 +173,22 @@ def deserialize_instance(serialized_instance):
     return model._default_manager.get(pk=pk)
 
 
+def deserialize_instances(serialized_instances):
+    """ Deserialize Django model instances using single query per model.
+        Instances that do not exist anymore are skipped.
+    """
+    pks_by_model = OrderedDict()
+    for serialized_instance in serialized_instances:
+        model_name, pk = serialized_instance.split(':')
+        pks_by_model.setdefault(model_name, []).append(pk)
+
+    instances = []
+    for model_name, pks in pks_by_model.items():
+        model = apps.get_model(model_name)
+        instances.extend(model._default_manager.filter(pk__in=pks).order_by('pk'))
+    return instances
+
+
 def serialize_class(cls):
     """ Serialize Python class """
     return '{}:{}'.format(cls.__module__, cls.__name__)
@@ -206,3 +264,84 @@ def camel_case_to_underscore(name):
 
 def silent_call(name, *args, **options):
     call_command(name, stdout=open(os.devnull, 'w'), *args, **options)
+
+
+class CacheSemaphore(object):
+    """ Counting semaphore with FIFO wait queue that is stored in the shared cache.
+
+    Slots are held by named holders. Slot and waiter are dropped when their TTL expires,
+    so slot is not leaked if holder has failed to release it.
+    If semaphore is not cached yet, it is initialized with holders returned by get_initial_holders.
+    """
+    LOCK_TIMEOUT = 10
+    LOCK_ATTEMPTS = 20
+    # Release waits longer than lock timeout, so that slot is not leaked if lock holder has died.
+    RELEASE_LOCK_ATTEMPTS = LOCK_TIMEOUT * 10 * 2
+
+    def __init__(self, key, limit, ttl, wait_ttl, get_initial_holders=None):
+        self.key = key
+        self.limit = limit
+        self.ttl = ttl
+        self.wait_ttl = wait_ttl
+        self.get_initial_holders = get_initial_holders
+
+    @contextmanager
+    def _lock(self, attempts=None):
+        lock_key = '%s:lock' % self.key
+        for _ in range(attempts or self.LOCK_ATTEMPTS):
+            if cache.add(lock_key, True, self.LOCK_TIMEOUT):
+                break
+            time.sleep(0.1)
+        else:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            cache.delete(lock_key)
+
+    def _get_state(self, now):
+        state = cache.get(self.key)
+        if state is None:
+            initial_holders = self.get_initial_holders() if self.get_initial_holders else []
+            state = {'holders': {holder: now + self.ttl for holder in initial_holders}, 'queue': []}
+        state['holders'] = {holder: expires for holder, expires in state['holders'].items() if expires > now}
+        state['queue'] = [(holder, expires) for holder, expires in state['queue'] if expires > now]
+        return state
+
+    def acquire(self, holder):
+        """ Return True if slot is acquired, otherwise put holder to the wait queue and return False. """
+        now = time.time()
+        with self._lock() as locked:
+            if not locked:
+                logger.warning('Unable to acquire lock of semaphore %s for holder %s.', self.key, holder)
+                return False
+            state = self._get_state(now)
+            holders = state['holders']
+            # Existing waiter keeps its position in the queue, its expiration is prolonged.
+            queue = OrderedDict(state['queue'])
+            queue[holder] = now + self.wait_ttl
+
+            free_slots = max(self.limit - len(holders), 0)
+            acquired = holder in holders or holder in list(queue.keys())[:free_slots]
+            if acquired:
+                holders[holder] = now + self.ttl
+                del queue[holder]
+
+            state['queue'] = list(queue.items())
+            cache.set(self.key, state, self.ttl)
+            return acquired
+
+    def release(self, holder):
+        """ Free slot of holder and remove it from the wait queue. """
+        if cache.get(self.key) is None:
+            return
+        with self._lock(self.RELEASE_LOCK_ATTEMPTS) as locked:
+            if not locked:
+                logger.error('Unable to release slot of semaphore %s held by %s, '
+                             'it will be released when its TTL expires.', self.key, holder)
+                return
+            state = self._get_state(time.time())
+            state['holders'].pop(holder, None)
+            state['queue'] = [(waiter, expires) for waiter, expires in state['queue'] if waiter != holder]
+            cache.set(self.key, state, self.ttl)
@@ -71,8 +71,8 @@ class Command(BaseCommand):
     # XXX: With current permissions structure it easier to handle customer quota separately.
     def recalculate_customers_user_count(self):
         self.stdout.write('Recalculating customers user count')
-        from waldur_core.structure.models import Customer
+        from waldur_core.structure.models import Customer, CustomerMembership
         for customer in Customer.objects.all():
-            usage = len(set(customer.get_users()))
+            usage = CustomerMembership.rebuild(customer)
             customer.set_quota_usage(Customer.Quotas.nc_user_count, usage)
         self.stdout.write('...done')
@@ -1,7 +1,75 @@
+from collections import defaultdict
+
 from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import F, signals
+import six
 
-from waldur_core.quotas import models
+from waldur_core.quotas import fields, models
 
 
 def get_models_with_quotas():
     return [m for m in apps.get_models() if issubclass(m, models.QuotaModelMixin)]
+
+
+def get_aggregated_quotas_names():
+    """ Return names of quotas that are aggregated by ancestors quotas """
+    return {field.get_child_quota_name()
+            for model in get_models_with_quotas()
+            for field in model.get_quotas_fields(field_class=fields.AggregatorQuotaField)}
+
+
+def init_quotas_in_bulk(model, scopes, batch_size=None):
+    """ Initialize quotas of new instances of the same model using single query.
+
+        It works the same way as init_quotas handler, but post_save signal is sent
+        only for quotas that are aggregated by ancestors and have non-zero values.
+    """
+    content_type = ContentType.objects.get_for_model(model)
+    quotas = []
+    for scope in scopes:
+        for field in model.get_quotas_fields():
+            if not field.is_connected_to_scope(scope):
+                continue
+            quotas.append(models.Quota(
+                content_type=content_type,
+                object_id=scope.pk,
+                name=field.name,
+                limit=field.scope_default_limit(scope),
+                usage=field.default_usage(scope) if six.callable(field.default_usage) else field.default_usage,
+            ))
+    models.Quota.objects.bulk_create(quotas, batch_size=batch_size)
+
+    aggregated_names = get_aggregated_quotas_names()
+    for quota in quotas:
+        if quota.name in aggregated_names and (quota.usage or quota.limit):
+            signals.post_save.send(sender=models.Quota, instance=quota, created=True)
+
+
+def add_counter_quotas_usage_in_bulk(model, instances):
+    """ Increase usage of counter quotas targeted by new instances of the same model.
+
+        Usage of each scope quota is changed once with total delta of its instances.
+    """
+    instances = list(instances)
+    if not instances:
+        return
+
+    if hasattr(model, 'GLOBAL_COUNT_QUOTA_NAME'):
+        models.Quota.objects.filter(name=model.GLOBAL_COUNT_QUOTA_NAME).update(usage=F('usage') + len(instances))
+
+    for scope_model in get_models_with_quotas():
+        for field in scope_model.get_quotas_fields(field_class=fields.CounterQuotaField):
+            if model not in field.target_models:
+                continue
+            path = field.path_to_scope.replace('.', '__')
+            scope_ids = dict(model.objects.filter(pk__in=[instance.pk for instance in instances])
+                             .values_list('pk', path))
+            deltas = defaultdict(int)
+            for instance in instances:
+                scope_id = scope_ids.get(instance.pk)
+                if scope_id is not None:
+                    deltas[scope_id] += field.get_delta(instance)
+            for scope in scope_model.objects.filter(pk__in=deltas.keys()):
+                if field.is_connected_to_scope(scope) and deltas[scope.pk]:
+                    scope.add_quota_usage(field.name, deltas[scope.pk], validate=True)
@@ -63,6 +63,7 @@ MIDDLEWARE = (
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'waldur_core.logging.middleware.CaptureEventContextMiddleware',
+    'waldur_core.structure.middleware.PermissionCacheMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'defender.middleware.FailedLoginMiddleware',
@@ -204,9 +205,16 @@ CACHES = {
 
 # Regular tasks
 CELERY_BEAT_SCHEDULE = {
+    # Task schedules only settings which are due according to their pull interval,
+    # so it is run often in order to start pulls soon after slots are released.
     'pull-service-settings': {
         'task': 'waldur_core.structure.ServiceSettingsListPullTask',
-        'schedule': timedelta(minutes=30),
+        'schedule': timedelta(minutes=1),
+        'args': (),
+    },
+    'poll-runtime-states': {
+        'task': 'waldur_core.structure.RuntimeStatePollerTask',
+        'schedule': timedelta(seconds=5),
         'args': (),
     },
     'check-expired-permissions': {
@@ -214,6 +222,11 @@ CELERY_BEAT_SCHEDULE = {
         'schedule': timedelta(hours=24),
         'args': (),
     },
+    'create-quota-timeline-rollups': {
+        'task': 'waldur_core.structure.create_quota_timeline_rollups',
+        'schedule': crontab(minute=0),
+        'args': (),
+    },
     'recalculate-price-estimates': {
         'task': 'waldur_core.cost_tracking.recalculate_estimate',
         # To avoid bugs and unexpected behavior - do not re-calculate estimates
@@ -284,6 +297,23 @@ WALDUR_CORE = {
     'NOTIFICATIONS_PROFILE_CHANGES': {'ENABLED': True, 'FIELDS': ('email', 'phone_number', 'job_title')},
     # 'COUNTRIES': ['EE', 'LV', 'LT'],
     'ENABLE_ACCOUNTING_START_DATE': False,
+    'COUNTERS_CACHE_TIMEOUT': timedelta(minutes=1),
+    'CREATION_TIME_STATS_CACHE_TIMEOUT': timedelta(minutes=5),
+    # Stats of service settings older than this period are refreshed in background.
+    'SERVICE_SETTINGS_STATS_CACHE_TIMEOUT': timedelta(minutes=10),
+    # Service settings are pulled from backend not more often than once per this interval.
+    # Failed pulls are retried with exponential backoff limited by SERVICE_SETTINGS_PULL_MAX_BACKOFF.
+    'SERVICE_SETTINGS_PULL_INTERVAL': timedelta(minutes=30),
+    'SERVICE_SETTINGS_PULL_MAX_BACKOFF': timedelta(hours=12),
+    'SERVICE_SETTINGS_PULL_CONCURRENCY': 20,
+    'SERVICE_SETTINGS_PULL_CONCURRENCY_PER_TYPE': 5,
+    # Snapshots of weekly and monthly intervals are never deleted.
+    'QUOTA_TIMELINE_ROLLUP_RETENTION': {'hour': timedelta(days=7), 'day': timedelta(days=365)},
+    # Coordinates of virtual machines are detected by external geo service.
+    # Use 'waldur_core.structure.geoip.DatabaseResolver' in order to look them up
+    # in local CSV database of IP ranges defined by GEOIP_DATABASE.
+    'GEOIP_RESOLVER': 'waldur_core.structure.geoip.HttpResolver',
+    'GEOIP_DATABASE': None,
 }
 
 WALDUR_CORE_PUBLIC_SETTINGS = [
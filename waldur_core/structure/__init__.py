@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 
+import copy
 import functools
 import importlib
 import logging
@@ -58,6 +59,14 @@ class SupportedServices(object):
             'resources': {},
             'properties': {}
         })
+        cls._clear_cache()
+
+    @classmethod
+    def _clear_cache(cls):
+        """ Clear indexes computed from registry, they are rebuilt on next access """
+        for method in (cls._get_service_models, cls._get_resource_models, cls._get_service_name_resources,
+                       cls._get_choices, cls._get_related_models_index, cls._get_services_views):
+            method.cache_clear()
 
     @classmethod
     def register_backend(cls, backend_class, nested=False):
@@ -228,27 +237,41 @@ class SupportedServices(object):
                 ...
             }
         """
+        data = {}
+        for name, views in cls._get_services_views().items():
+            data[name] = {
+                'url': reverse(views['list_view'], request=request),
+                'service_project_link_url': reverse(views['service_project_link_view'], request=request),
+                'resources': {resource_name: reverse(view, request=request)
+                              for resource_name, view in views['resources'].items()},
+                'properties': {property_name: reverse(view, request=request)
+                               for property_name, view in views['properties'].items()},
+                'is_public_service': views['is_public_service'],
+            }
+        return data
+
+    @classmethod
+    @lru_cache(maxsize=1)
+    def _get_services_views(cls):
+        """ Get names of list views of services and resources, URLs are built from them for each request """
         from django.apps import apps
 
         data = {}
         for service in cls._registry.values():
             service_model = apps.get_model(service['model_name'])
             service_project_link = service_model.projects.through
-            service_project_link_url = reverse(cls.get_list_view_for_model(service_project_link), request=request)
-
             data[service['name']] = {
-                'url': reverse(service['list_view'], request=request),
-                'service_project_link_url': service_project_link_url,
-                'resources': {resource['name']: reverse(resource['list_view'], request=request)
+                'list_view': service['list_view'],
+                'service_project_link_view': cls.get_list_view_for_model(service_project_link),
+                'resources': {resource['name']: resource['list_view']
                               for resource in service['resources'].values()},
-                'properties': {resource['name']: reverse(resource['list_view'], request=request)
+                'properties': {resource['name']: resource['list_view']
                                for resource in service.get('properties', {}).values()},
-                'is_public_service': cls.is_public_service(service_model)
+                'is_public_service': cls.is_public_service(service_model),
             }
         return data
 
     @classmethod
-    @lru_cache(maxsize=1)
     def get_service_models(cls):
         """ Get a list of service models.
             {
@@ -265,6 +288,11 @@ class SupportedServices(object):
             }
 
         """
+        return copy.deepcopy(cls._get_service_models())
+
+    @classmethod
+    @lru_cache(maxsize=1)
+    def _get_service_models(cls):
         from django.apps import apps
 
         data = {}
@@ -281,7 +309,6 @@ class SupportedServices(object):
         return data
 
     @classmethod
-    @lru_cache(maxsize=1)
     def get_resource_models(cls):
         """ Get a list of resource models.
             {
@@ -291,6 +318,11 @@ class SupportedServices(object):
             }
 
         """
+        return dict(cls._get_resource_models())
+
+    @classmethod
+    @lru_cache(maxsize=1)
+    def _get_resource_models(cls):
         from django.apps import apps
 
         return {'.'.join([service['name'], attrs['name']]): apps.get_model(resource)
@@ -298,16 +330,19 @@ class SupportedServices(object):
                 for resource, attrs in service['resources'].items()}
 
     @classmethod
-    @lru_cache(maxsize=20)
     def get_service_resources(cls, model):
         """ Get resource models by service model """
         key = cls.get_model_key(model)
         return cls.get_service_name_resources(key)
 
     @classmethod
-    @lru_cache(maxsize=20)
     def get_service_name_resources(cls, service_name):
         """ Get resource models by service name """
+        return list(cls._get_service_name_resources(service_name))
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _get_service_name_resources(cls, service_name):
         from django.apps import apps
 
         resources = cls._registry[service_name]['resources'].keys()
@@ -348,14 +383,17 @@ class SupportedServices(object):
         else:
             model_str = cls._get_model_str(model)
 
-        for models in cls.get_service_models().values():
-            if model_str == cls._get_model_str(models['service']) or \
-               model_str == cls._get_model_str(models['service_project_link']):
-                return models
+        return copy.deepcopy(cls._get_related_models_index().get(model_str))
 
-            for resource_model in models['resources']:
-                if model_str == cls._get_model_str(resource_model):
-                    return models
+    @classmethod
+    @lru_cache(maxsize=1)
+    def _get_related_models_index(cls):
+        """ Map service, service project link and resource models to models of their service """
+        index = {}
+        for models in cls._get_service_models().values():
+            for model in [models['service'], models['service_project_link']] + models['resources']:
+                index.setdefault(cls._get_model_str(model), models)
+        return index
 
     @classmethod
     def _is_active_model(cls, model):
@@ -380,8 +418,13 @@ class SupportedServices(object):
 
     @classmethod
     def get_app_config(cls, model):
+        return cls._get_app_config(model.__module__)
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _get_app_config(cls, module_name):
         from django.apps import apps
-        return apps.get_containing_app_config(model.__module__)
+        return apps.get_containing_app_config(module_name)
 
     @classmethod
     def get_list_view_for_model(cls, model):
@@ -392,8 +435,12 @@ class SupportedServices(object):
         return model.get_url_name() + '-detail'
 
     @classmethod
-    @lru_cache(maxsize=1)
     def get_choices(cls):
+        return list(cls._get_choices())
+
+    @classmethod
+    @lru_cache(maxsize=1)
+    def _get_choices(cls):
         items = [(code, service['name']) for code, service in cls._registry.items()]
         return sorted(items, key=lambda pair: pair[1])
 
@@ -12,9 +12,12 @@ class StructureConfig(AppConfig):
     def ready(self):
         from waldur_core.core.models import CoordinatesMixin, User
         from waldur_core.structure.executors import check_cleanup_executors
-        from waldur_core.structure.models import ResourceMixin, Service, TagMixin, VirtualMachine
+        from waldur_core.quotas.models import QuotaModelMixin
+        from waldur_core.structure.models import (HierarchyPath, ResourceMixin, Service, ServiceProjectLink,
+                                                  TagMixin, VirtualMachine)
         from waldur_core.structure import handlers
         from waldur_core.structure import signals as structure_signals
+        from taggit.models import Tag
 
         from django.core import checks
         checks.register(check_cleanup_executors)
@@ -68,6 +71,63 @@ class StructureConfig(AppConfig):
                 dispatch_uid='waldur_core.structure.handlers.%s' % name,
             )
 
+        for model in structure_models_with_roles:
+            structure_signals.structure_role_bulk_revoked.connect(
+                handlers.change_customer_nc_users_quota_on_role_bulk_revoked,
+                sender=model,
+                dispatch_uid='waldur_core.structure.handlers.'
+                             'change_customer_nc_users_quota_on_role_bulk_revoked_%s' % model.__name__,
+            )
+
+            structure_signals.structure_role_bulk_revoked.connect(
+                handlers.sync_user_scope_access_on_role_bulk_revoked,
+                sender=model,
+                dispatch_uid='waldur_core.structure.handlers.'
+                             'sync_user_scope_access_on_role_bulk_revoked_%s' % model.__name__,
+            )
+
+            structure_signals.structure_role_bulk_revoked.connect(
+                handlers.log_role_bulk_revoked,
+                sender=model,
+                dispatch_uid='waldur_core.structure.handlers.log_role_bulk_revoked_%s' % model.__name__,
+            )
+
+        for model in (CustomerPermission, ProjectPermission):
+            for signal in (signals.post_save, signals.post_delete):
+                signal.connect(
+                    handlers.sync_user_scope_access_on_permission_change,
+                    sender=model,
+                    dispatch_uid='waldur_core.structure.handlers.sync_user_scope_access_on_permission_change_%s_%s' % (
+                        model.__name__, signal is signals.post_save and 'save' or 'delete'),
+                )
+
+        for model in (CustomerPermission, ProjectPermission):
+            for signal in (signals.post_save, signals.post_delete):
+                signal.connect(
+                    handlers.clear_permission_cache,
+                    sender=model,
+                    dispatch_uid='waldur_core.structure.handlers.clear_permission_cache_%s_%s' % (
+                        model.__name__, signal is signals.post_save and 'save' or 'delete'),
+                )
+
+        signals.post_save.connect(
+            handlers.update_user_scope_access_on_project_move,
+            sender=Project,
+            dispatch_uid='waldur_core.structure.handlers.update_user_scope_access_on_project_move',
+        )
+
+        signals.post_save.connect(
+            handlers.move_customer_memberships_on_project_move,
+            sender=Project,
+            dispatch_uid='waldur_core.structure.handlers.move_customer_memberships_on_project_move',
+        )
+
+        signals.post_save.connect(
+            handlers.update_resource_index_on_project_move,
+            sender=Project,
+            dispatch_uid='waldur_core.structure.handlers.update_resource_index_on_project_move',
+        )
+
         structure_signals.structure_role_granted.connect(
             handlers.log_customer_role_granted,
             sender=Customer,
@@ -132,6 +192,13 @@ class StructureConfig(AppConfig):
                     model.__name__, index),
             )
 
+            fsm_signals.post_transition.connect(
+                handlers.release_provisioning_slot,
+                sender=model,
+                dispatch_uid='waldur_core.structure.handlers.release_provisioning_slot_{}_{}'.format(
+                    model.__name__, index),
+            )
+
             signals.post_save.connect(
                 handlers.log_resource_creation_scheduled,
                 sender=model,
@@ -139,6 +206,20 @@ class StructureConfig(AppConfig):
                     model.__name__, index),
             )
 
+            signals.post_save.connect(
+                handlers.update_resource_index,
+                sender=model,
+                dispatch_uid='waldur_core.structure.handlers.update_resource_index_{}_{}'.format(
+                    model.__name__, index),
+            )
+
+            signals.post_delete.connect(
+                handlers.delete_resource_index,
+                sender=model,
+                dispatch_uid='waldur_core.structure.handlers.delete_resource_index_{}_{}'.format(
+                    model.__name__, index),
+            )
+
             signals.pre_delete.connect(
                 handlers.delete_service_settings_on_scope_delete,
                 sender=model,
@@ -202,6 +283,56 @@ class StructureConfig(AppConfig):
             dispatch_uid='waldur_core.structure.handlers.clean_tags_cache_after_tagged_item_created'
         )
 
+        signals.post_save.connect(
+            handlers.clean_tags_cache_after_tag_renamed,
+            sender=Tag,
+            dispatch_uid='waldur_core.structure.handlers.clean_tags_cache_after_tag_renamed'
+        )
+
+        signals.post_save.connect(
+            handlers.update_tag_index_after_tagged_item_saved,
+            sender=TagMixin.tags.through,
+            dispatch_uid='waldur_core.structure.handlers.update_tag_index_after_tagged_item_saved'
+        )
+
+        signals.post_save.connect(
+            handlers.update_tag_index_after_tag_renamed,
+            sender=Tag,
+            dispatch_uid='waldur_core.structure.handlers.update_tag_index_after_tag_renamed'
+        )
+
+        for index, model in enumerate(Service.get_all_models() + ServiceProjectLink.get_all_models()):
+            if issubclass(model, QuotaModelMixin):
+                structure_signals.structure_objects_bulk_created.connect(
+                    handlers.init_quotas_of_bulk_created_objects,
+                    sender=model,
+                    dispatch_uid='waldur_core.structure.handlers.init_quotas_of_bulk_created_objects_{}_{}'.format(
+                        model.__name__, index),
+                )
+
+            if model in HierarchyPath.get_models():
+                structure_signals.structure_objects_bulk_created.connect(
+                    handlers.add_hierarchy_paths_of_bulk_created_objects,
+                    sender=model,
+                    dispatch_uid='waldur_core.structure.handlers.add_hierarchy_paths_of_bulk_created_objects_{}_{}'
+                                 .format(model.__name__, index),
+                )
+
+        for index, model in enumerate(HierarchyPath.get_models()):
+            signals.post_save.connect(
+                handlers.update_hierarchy_path,
+                sender=model,
+                dispatch_uid='waldur_core.structure.handlers.update_hierarchy_path_{}_{}'.format(
+                    model.__name__, index),
+            )
+
+            signals.post_delete.connect(
+                handlers.delete_hierarchy_path,
+                sender=model,
+                dispatch_uid='waldur_core.structure.handlers.delete_hierarchy_path_{}_{}'.format(
+                    model.__name__, index),
+            )
+
         signals.post_save.connect(
             handlers.notify_about_user_profile_changes,
             sender=User,
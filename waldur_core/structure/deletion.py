@@ -0,0 +1,209 @@
+""" Bulk deletion of structure objects together with their dependents.
+
+Deletion plan is computed using queries per relation instead of loading objects one by one:
+primary keys of dependent objects are collected through reverse foreign keys and
+generic foreign keys for each model. Objects are deleted with raw DELETE queries
+in chunks, dependents go before objects they refer to, and each chunk is committed
+in separate transaction. Foreign keys with SET_NULL, SET_DEFAULT or SET(...) handlers
+are updated before deletion, other custom handlers are not supported. Note that model
+signals are not sent, so quotas of remaining objects should be recalculated afterwards.
+"""
+from __future__ import unicode_literals
+
+import collections
+import logging
+
+from django.apps import apps
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.db import connections, router, transaction, models
+from django.db.migrations.topological_sort import stable_topological_sort
+from django.db.models.deletion import get_candidate_relations_to_delete
+from django.utils.lru_cache import lru_cache
+
+from waldur_core.structure.models import HierarchyPath, TagIndex
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+
+
+def iterate_chunks(values, chunk_size):
+    values = sorted(values)
+    for index in range(0, len(values), chunk_size):
+        yield values[index:index + chunk_size]
+
+
+@lru_cache(maxsize=1)
+def get_generic_relations():
+    """ Return list of (model, content type field name, object ID field name) of models referring to any model """
+    relations = [(model, field.ct_field, field.fk_field)
+                 for model in apps.get_models()
+                 for field in model._meta.private_fields
+                 if isinstance(field, GenericForeignKey)]
+    # These tables refer to objects by content type and object ID without generic foreign keys.
+    relations.extend([
+        (HierarchyPath, 'ancestor_content_type', 'ancestor_id'),
+        (HierarchyPath, 'descendant_content_type', 'descendant_id'),
+        (TagIndex, 'content_type', 'object_id'),
+    ])
+    return relations
+
+
+def get_field_update_value(field):
+    """ Return value which is assigned to foreign key by SET_NULL, SET_DEFAULT or SET(...) handler.
+
+        NotImplementedError is raised for other handlers, because their effect is not known.
+    """
+    on_delete = field.remote_field.on_delete
+    if on_delete == models.SET_NULL:
+        return None
+    if on_delete == models.SET_DEFAULT:
+        return field.get_default()
+    deconstruct = getattr(on_delete, 'deconstruct', None)
+    if deconstruct is not None:
+        path, args, _ = deconstruct()
+        if path == 'django.db.models.SET':
+            value = args[0]
+            return value() if callable(value) else value
+    raise NotImplementedError('Deletion of %s is not supported.' % field)
+
+
+class DeletionPlan(object):
+    """ Set of objects to be deleted grouped by model.
+
+        Objects that are protected from deletion by PROTECT foreign key prevent
+        execution of plan unless cascade_protected is True.
+    """
+
+    def __init__(self, queryset, cascade_protected=False, chunk_size=None):
+        self.cascade_protected = cascade_protected
+        self.chunk_size = chunk_size or CHUNK_SIZE
+        self.using = router.db_for_write(queryset.model)
+        # model -> set of primary keys
+        self.deleted = collections.defaultdict(set)
+        self.protected = collections.defaultdict(set)
+        # (model, field name) -> set of primary keys of objects which field is set to new value
+        self.updated = collections.defaultdict(set)
+        # (model, field name) -> value that is set by on_delete handler of field
+        self.update_values = {}
+        # model -> set of models that should be deleted before it
+        self.dependencies = collections.defaultdict(set)
+        # Objects of models referring to themselves are deleted in single transaction.
+        self.self_referencing_models = set()
+        self.collect(queryset.model, queryset.values_list('pk', flat=True))
+
+    def collect(self, model, pks):
+        queue = [(model, pks)]
+        while queue:
+            model, pks = queue.pop()
+            model = model._meta.concrete_model
+            pks = set(pks) - self.deleted[model]
+            if not pks:
+                continue
+            self.deleted[model] |= pks
+
+            for parent_model, parent_link in model._meta.parents.items():
+                if parent_link:
+                    queue.append((parent_model, self.get_values(model, 'pk', pks, parent_link.attname)))
+
+            for relation in get_candidate_relations_to_delete(model._meta):
+                field = relation.field
+                on_delete = field.remote_field.on_delete
+                if on_delete == models.DO_NOTHING:
+                    continue
+                related_model = relation.related_model._meta.concrete_model
+                related_pks = self.get_values(related_model, field.name + '__pk', pks)
+                if not related_pks:
+                    continue
+
+                if on_delete == models.CASCADE or (on_delete == models.PROTECT and self.cascade_protected):
+                    if related_model != model:
+                        self.dependencies[model].add(related_model)
+                    else:
+                        self.self_referencing_models.add(model)
+                    queue.append((related_model, related_pks))
+                elif on_delete == models.PROTECT:
+                    self.protected[related_model] |= related_pks
+                else:
+                    key = (related_model, field.name)
+                    if key not in self.update_values:
+                        self.update_values[key] = get_field_update_value(field)
+                    self.updated[key] |= related_pks
+
+            for related_model, ct_field, fk_field in get_generic_relations():
+                content_type = ContentType.objects.db_manager(self.using).get_for_model(model)
+                object_id_field = related_model._meta.get_field(fk_field)
+                try:
+                    object_ids = [object_id_field.to_python(pk) for pk in pks]
+                except ValidationError:
+                    continue
+                related_pks = self.get_values(related_model, fk_field, object_ids, extra={ct_field: content_type})
+                if related_pks:
+                    self.dependencies[model].add(related_model)
+                    queue.append((related_model, related_pks))
+
+    def get_values(self, model, lookup, values, field_name='pk', extra=None):
+        """ Return set of field values of objects which lookup field is in values """
+        result = set()
+        for chunk in iterate_chunks(values, self.chunk_size):
+            queryset = model._base_manager.using(self.using).filter(**{lookup + '__in': chunk})
+            if extra:
+                queryset = queryset.filter(**extra)
+            result.update(queryset.values_list(field_name, flat=True))
+        return result
+
+    def get_protected(self):
+        """ Return dict of primary keys of objects which are protected and are not deleted by plan """
+        protected = {model: pks - self.deleted[model] for model, pks in self.protected.items()}
+        return {model: pks for model, pks in protected.items() if pks}
+
+    def get_ordered_models(self):
+        """ Return models of deleted objects, dependents go before models they refer to """
+        deleted_models = [model for model, pks in self.deleted.items() if pks]
+        deleted_models.sort(key=lambda model: model._meta.label)
+        dependencies = {model: self.dependencies[model] & set(deleted_models) for model in deleted_models}
+        return list(stable_topological_sort(deleted_models, dependencies))
+
+    def get_report(self):
+        """ Return list of (action, model label, rows count) tuples in execution order """
+        report = [('update', '%s.%s' % (model._meta.label, field_name), len(pks - self.deleted[model]))
+                  for (model, field_name), pks in self.updated.items() if pks - self.deleted[model]]
+        report.extend(('delete', model._meta.label, len(self.deleted[model])) for model in self.get_ordered_models())
+        report.extend(('protected', model._meta.label, len(pks)) for model, pks in self.get_protected().items())
+        return report
+
+    def execute(self):
+        protected = self.get_protected()
+        if protected:
+            raise models.ProtectedError(
+                'Objects cannot be deleted because they are referenced by protected foreign keys.',
+                [model._base_manager.filter(pk__in=pks) for model, pks in protected.items()])
+
+        for (model, field_name), pks in self.updated.items():
+            for chunk in iterate_chunks(pks - self.deleted[model], self.chunk_size):
+                with transaction.atomic(using=self.using):
+                    model._base_manager.using(self.using).filter(pk__in=chunk).update(
+                        **{field_name: self.update_values[(model, field_name)]})
+
+        for model in self.get_ordered_models():
+            if model in self.self_referencing_models:
+                # Rows referring to each other may be in different chunks, so they are deleted in one transaction.
+                with transaction.atomic(using=self.using):
+                    for chunk in iterate_chunks(self.deleted[model], self.chunk_size):
+                        self.delete_rows(model, chunk)
+            else:
+                for chunk in iterate_chunks(self.deleted[model], self.chunk_size):
+                    with transaction.atomic(using=self.using):
+                        self.delete_rows(model, chunk)
+            logger.info('%s objects of model %s have been deleted.', len(self.deleted[model]), model._meta.label)
+
+    def delete_rows(self, model, pks):
+        connection = connections[self.using]
+        sql = 'DELETE FROM %s WHERE %s IN (%s)' % (
+            connection.ops.quote_name(model._meta.db_table),
+            connection.ops.quote_name(model._meta.pk.column),
+            ', '.join(['%s'] * len(pks)))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, pks)
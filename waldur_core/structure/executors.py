@@ -111,7 +111,7 @@ class BaseCleanupExecutor(core_executors.BaseExecutor):
         ]
 
         if not cleanup_tasks:
-            return core_tasks.EmptyTask()
+            return core_tasks.EmptyTask().si()
 
         return chain(cleanup_tasks)
 
@@ -148,7 +148,7 @@ class ProjectCleanupExecutor(core_executors.BaseExecutor):
         ]
 
         if not cleanup_tasks:
-            return core_tasks.EmptyTask()
+            return core_tasks.EmptyTask().si()
 
         return chain(cleanup_tasks)
 
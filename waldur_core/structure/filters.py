@@ -19,6 +19,7 @@ from django_filters.widgets import BooleanWidget
 from rest_framework.filters import BaseFilterBackend
 
 from waldur_core.core import filters as core_filters
+from waldur_core.core import managers as core_managers
 from waldur_core.core import models as core_models
 from waldur_core.core.filters import BaseExternalFilter, ExternalFilterBackend
 from waldur_core.logging.filters import ExternalAlertFilterBackend
@@ -617,6 +618,16 @@ class TagsFilter(BaseFilterBackend):
     Example:
         ?tag__license-os=centos7 - will filter objects with tag "license-os:centos7".
 
+    Tags are compared case-insensitively using normalized tag index.
+    Match mode is defined by tag_match parameter:
+     - exact (default) - value of tag is equal to the given value;
+     - prefix - value of tag starts with the given value;
+     - substring - tag starts with key and contains the given value, index can not be used for this mode.
+
+    If several tags are specified, objects that have all of them are returned.
+    Set tag_operator=or in order to return objects that have any of them. Example:
+        ?tag__license-os=centos7&tag__license-os=ubuntu&tag_operator=or
+
     Allow to define next parameters in view:
      - tags_filter_db_field - name of tags field in database. Default: tags.
      - tags_filter_request_field - name of tags in request. Default: tag.
@@ -631,16 +642,31 @@ class TagsFilter(BaseFilterBackend):
         return queryset
 
     def _filter(self, request, queryset):
-        for key in request.query_params.keys():
+        match = request.query_params.get(self.request_field + '_match')
+        if match not in models.TagIndex.Match.CHOICES:
+            match = models.TagIndex.Match.EXACT
+        require_all = request.query_params.get(self.request_field + '_operator', '').lower() != 'or'
+
+        conditions = []
+        for key, values in request.query_params.lists():
             item_name = self._get_item_name(key)
             if item_name:
-                value = request.query_params.get(key)
-                filter_kwargs = {
-                    self.db_field + '__name__startswith': item_name,
-                    self.db_field + '__name__icontains': value,
-                }
-                queryset = queryset.filter(**filter_kwargs)
-        return queryset
+                conditions.extend(models.TagIndex.get_condition(item_name, value, match) for value in values)
+        if not conditions:
+            return queryset
+
+        def filter_tagged(queryset):
+            path = self.db_field.split('__')[:-1]
+            tagged_model = queryset.model
+            for field_name in path:
+                tagged_model = tagged_model._meta.get_field(field_name).related_model
+            object_ids = models.TagIndex.get_object_ids(tagged_model, conditions, require_all)
+            return queryset.filter(**{'__'.join(path + ['pk__in']): object_ids})
+
+        # Summary queryset combines querysets of different models, so each of them is filtered separately.
+        if isinstance(queryset, core_managers.SummaryQuerySet):
+            return queryset.map(filter_tagged)
+        return filter_tagged(queryset)
 
     def _order(self, request, queryset):
         order_by = request.query_params.get('o')
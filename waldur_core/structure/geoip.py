@@ -0,0 +1,185 @@
+""" Detection of coordinates of virtual machines by IP address.
+
+Resolver is configured by GEOIP_RESOLVER setting. HttpResolver queries external geo service,
+DatabaseResolver looks up IP address in local database of IP ranges loaded into memory,
+so that it works in isolated deployments. Results of both resolvers are memoized by IP address.
+"""
+from __future__ import unicode_literals
+
+import bisect
+import collections
+import csv
+import logging
+
+from django.conf import settings
+from django.utils.lru_cache import lru_cache
+from django.utils.module_loading import import_string
+from iptools import ipv4, ipv6
+import requests
+
+logger = logging.getLogger(__name__)
+Coordinates = collections.namedtuple('Coordinates', ('latitude', 'longitude'))
+
+# IPv4 addresses are mapped to IPv6 space (::ffff:0:0/96) in order to store all ranges in single table.
+IPV4_MAPPED_PREFIX = 0xffff << 32
+
+
+class GeoIpException(Exception):
+    pass
+
+
+def ip_to_long(ip_address):
+    """ Convert IPv4 or IPv6 address to integer """
+    ip_address = ip_address.strip()
+    value = ipv4.ip2long(ip_address)
+    if value is not None:
+        return IPV4_MAPPED_PREFIX | value
+    value = ipv6.ip2long(ip_address)
+    if value is None:
+        raise GeoIpException('Invalid IP address %s' % ip_address)
+    return value
+
+
+class CoordinatesResolver(object):
+    """ Base class of coordinates resolvers.
+
+        Subclasses implement lookup of single IP address and
+        may override lookup_many if batch lookup can be done more efficiently.
+    """
+    # Memoized results are dropped when their count exceeds this limit.
+    cache_size = 10000
+    # If resolver does not support efficient batch lookup, addresses are resolved by separate tasks.
+    batch_lookup = False
+
+    def __init__(self):
+        self._cache = {}
+
+    def lookup(self, ip_address):
+        """ Return coordinates of IP address or None if they are unknown. Raise GeoIpException on failure. """
+        raise NotImplementedError()
+
+    def lookup_many(self, ip_addresses):
+        """ Return dict of coordinates by IP addresses, IP addresses which failed to resolve are skipped """
+        result = {}
+        for ip_address in ip_addresses:
+            try:
+                result[ip_address] = self.lookup(ip_address)
+            except GeoIpException as e:
+                logger.warning('Unable to detect coordinates of IP address %s: %s.', ip_address, e)
+        return result
+
+    def resolve(self, ip_address):
+        if ip_address not in self._cache:
+            self._remember({ip_address: self.lookup(ip_address)})
+        return self._cache[ip_address]
+
+    def resolve_many(self, ip_addresses):
+        missing = set(ip_addresses) - set(self._cache)
+        if missing:
+            self._remember(self.lookup_many(missing))
+        return {ip_address: self._cache[ip_address] for ip_address in ip_addresses if ip_address in self._cache}
+
+    def _remember(self, coordinates):
+        if len(self._cache) + len(coordinates) > self.cache_size:
+            self._cache.clear()
+        self._cache.update(coordinates)
+
+
+class HttpResolver(CoordinatesResolver):
+    """ Query freegeoip.net API for each IP address """
+    url = 'http://freegeoip.net/json/{}'
+    timeout = 10
+
+    def lookup(self, ip_address):
+        url = self.url.format(ip_address)
+
+        try:
+            response = requests.get(url, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            raise GeoIpException("Request to geoip API %s failed: %s" % (url, e))
+
+        if response.ok:
+            data = response.json()
+            return Coordinates(latitude=data['latitude'],
+                               longitude=data['longitude'])
+        else:
+            params = (url, response.status_code, response.text)
+            raise GeoIpException("Request to geoip API %s failed: %s %s" % params)
+
+
+class DatabaseResolver(CoordinatesResolver):
+    """ Look up IP address in CSV file defined by GEOIP_DATABASE setting.
+
+        Each row contains first and last IP address of range, latitude and longitude are
+        the last two columns. For example, DB-IP City Lite database has such format.
+        Rows which could not be parsed, such as header, are skipped.
+    """
+    batch_lookup = True
+
+    def __init__(self, path=None):
+        super(DatabaseResolver, self).__init__()
+        self.path = path or settings.WALDUR_CORE['GEOIP_DATABASE']
+        if not self.path:
+            raise GeoIpException('GEOIP_DATABASE setting is not defined.')
+        self.starts, self.ends, self.coordinates = self.load(self.path)
+
+    @classmethod
+    def load(cls, path):
+        """ Read ranges sorted by first IP address """
+        ranges = []
+        try:
+            with open(path) as database:
+                for row in csv.reader(database):
+                    try:
+                        ranges.append((ip_to_long(row[0]), ip_to_long(row[1]),
+                                       Coordinates(latitude=float(row[-2]), longitude=float(row[-1]))))
+                    except (GeoIpException, ValueError, IndexError):
+                        continue
+        except (IOError, csv.Error) as e:
+            raise GeoIpException('Unable to load geoip database %s: %s' % (path, e))
+
+        ranges.sort(key=lambda item: item[0])
+        logger.info('Geoip database %s with %s IP ranges has been loaded.', path, len(ranges))
+        return [item[0] for item in ranges], [item[1] for item in ranges], [item[2] for item in ranges]
+
+    def _find(self, value, lo=0):
+        index = bisect.bisect_right(self.starts, value, lo) - 1
+        if index >= 0 and value <= self.ends[index]:
+            return index, self.coordinates[index]
+        return max(index, lo), None
+
+    def lookup(self, ip_address):
+        return self._find(ip_to_long(ip_address))[1]
+
+    def lookup_many(self, ip_addresses):
+        values = []
+        for ip_address in ip_addresses:
+            try:
+                values.append((ip_to_long(ip_address), ip_address))
+            except GeoIpException as e:
+                logger.warning('Unable to detect coordinates of IP address %s: %s.', ip_address, e)
+
+        # Addresses are looked up in ascending order, so that search starts from previously found range.
+        result = {}
+        index = 0
+        for value, ip_address in sorted(values):
+            index, result[ip_address] = self._find(value, index)
+        return result
+
+
+def get_resolver():
+    return _get_resolver(settings.WALDUR_CORE['GEOIP_RESOLVER'], settings.WALDUR_CORE['GEOIP_DATABASE'])
+
+
+@lru_cache(maxsize=1)
+def _get_resolver(resolver_path, database_path):
+    # Database path is a part of cache key, so that resolver is reloaded if it is changed.
+    return import_string(resolver_path)()
+
+
+def get_coordinates_by_ip(ip_address):
+    return get_resolver().resolve(ip_address)
+
+
+def get_coordinates_by_ips(ip_addresses):
+    return get_resolver().resolve_many(ip_addresses)
@@ -1,19 +1,26 @@
 from __future__ import unicode_literals
 
+import collections
 import logging
 import re
 
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.template.loader import render_to_string
 from django.utils import timezone
 
 from waldur_core.core import utils
 from waldur_core.core.models import StateMixin
 from waldur_core.core.tasks import send_task
-from waldur_core.structure import SupportedServices, signals
+from waldur_core.quotas import utils as quotas_utils
+from waldur_core.structure import linking, signals, utils as structure_utils
+from waldur_core.structure import middleware as structure_middleware
 from waldur_core.structure.log import event_logger
 from waldur_core.structure.models import (Customer, CustomerPermission, Project, ProjectPermission,
-                                          Service, ServiceSettings, CustomerRole)
+                                          ServiceSettings, CustomerRole, UserScopeAccess,
+                                          ResourceIndex, CustomerMembership,
+                                          HierarchyPath, TagIndex, TagMixin)
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +34,32 @@ def revoke_roles_on_project_deletion(sender, instance=None, **kwargs):
     instance.remove_all_users()
 
 
+def clear_permission_cache(sender, instance, **kwargs):
+    structure_middleware.clear_permission_cache()
+
+
+def sync_user_scope_access_on_role_bulk_revoked(sender, roles, **kwargs):
+    rows = set()
+    for structure, user, role in roles:
+        if isinstance(structure, Customer):
+            rows.add((user.pk, structure.pk, None, role))
+        elif isinstance(structure, Project):
+            rows.add((user.pk, structure.customer_id, structure.pk, role))
+    UserScopeAccess.delete_stale_rows(rows)
+
+
+def sync_user_scope_access_on_permission_change(sender, instance, **kwargs):
+    if isinstance(instance, CustomerPermission):
+        UserScopeAccess.sync(instance.user_id, customer=instance.customer_id)
+    elif isinstance(instance, ProjectPermission):
+        UserScopeAccess.sync(instance.user_id, project=instance.project_id)
+
+
+def update_user_scope_access_on_project_move(sender, instance, created=False, **kwargs):
+    if not created and instance.tracker.has_changed('customer_id'):
+        UserScopeAccess.objects.filter(project=instance).update(customer=instance.customer_id)
+
+
 def log_customer_save(sender, instance, created=False, **kwargs):
     if created:
         event_logger.customer.info(
@@ -119,6 +152,12 @@ def log_customer_role_revoked(sender, structure, user, role, removed_by=None, **
         event_type='role_revoked', event_context=event_context)
 
 
+def log_role_bulk_revoked(sender, roles, removed_by=None, **kwargs):
+    log_role_revoked = log_customer_role_revoked if sender == Customer else log_project_role_revoked
+    for structure, user, role in roles:
+        log_role_revoked(sender, structure, user, role, removed_by)
+
+
 def log_customer_role_updated(sender, instance, user, **kwargs):
     template = 'User %(user_username)s has changed permission expiration time ' \
                'for user {affected_user_username} in customer {customer_name} from ' \
@@ -205,8 +244,37 @@ def change_customer_nc_users_quota(sender, structure, user, role, signal, **kwar
     elif sender == Project:
         customer = structure.customer
 
-    customer_users = customer.get_users()
-    customer.set_quota_usage(Customer.Quotas.nc_user_count, customer_users.count())
+    if signal == signals.structure_role_granted:
+        if CustomerMembership.increase(customer, user):
+            customer.add_quota_usage(Customer.Quotas.nc_user_count, 1)
+    elif CustomerMembership.decrease(customer, user):
+        customer.add_quota_usage(Customer.Quotas.nc_user_count, -1)
+
+
+def change_customer_nc_users_quota_on_role_bulk_revoked(sender, roles, **kwargs):
+    """ Decrease nc_user_count quota usage once per customer for roles revoked in bulk """
+    counts = collections.Counter()
+    for structure, user, role in roles:
+        customer_id = structure.pk if sender == Customer else structure.customer_id
+        counts[(customer_id, user.pk)] += 1
+
+    removed = CustomerMembership.decrease_in_bulk(counts)
+    for customer in Customer.objects.filter(pk__in=removed.keys()):
+        customer.add_quota_usage(Customer.Quotas.nc_user_count, -removed[customer.pk])
+
+
+def move_customer_memberships_on_project_move(sender, instance, created=False, **kwargs):
+    """ Move memberships of project users from previous customer to the new one """
+    if created or not instance.tracker.has_changed('customer_id'):
+        return
+
+    old_customer = Customer.objects.get(pk=instance.tracker.previous('customer_id'))
+    new_customer = instance.customer
+    for permission in instance.permissions.filter(is_active=True).select_related('user'):
+        if CustomerMembership.decrease(old_customer, permission.user):
+            old_customer.add_quota_usage(Customer.Quotas.nc_user_count, -1)
+        if CustomerMembership.increase(new_customer, permission.user):
+            new_customer.add_quota_usage(Customer.Quotas.nc_user_count, 1)
 
 
 def log_resource_deleted(sender, instance, **kwargs):
@@ -262,6 +330,11 @@ def log_resource_action(sender, instance, name, source, target, **kwargs):
         )
 
 
+def release_provisioning_slot(sender, instance, name, source, target, **kwargs):
+    if source == StateMixin.States.CREATING and target != StateMixin.States.CREATING:
+        structure_utils.get_provisioning_semaphore(instance).release(instance.pk)
+
+
 def detect_vm_coordinates(sender, instance, name, source, target, **kwargs):
     # Check if geolocation is enabled
     if not settings.WALDUR_CORE.get('ENABLE_GEOIP', True):
@@ -278,35 +351,19 @@ def detect_vm_coordinates(sender, instance, name, source, target, **kwargs):
 def connect_customer_to_shared_service_settings(sender, instance, created=False, **kwargs):
     if not created:
         return
-    customer = instance
-
-    for shared_settings in ServiceSettings.objects.filter(shared=True):
-        try:
-            service_model = SupportedServices.get_service_models()[shared_settings.type]['service']
-            service_model.objects.create(customer=customer,
-                                         settings=shared_settings,
-                                         available_for_all=True)
-        except KeyError:
-            logger.warning("Unregistered service of type %s" % shared_settings.type)
+    linking.connect_customer_to_shared_settings(instance)
 
 
 def connect_project_to_all_available_services(sender, instance, created=False, **kwargs):
     if not created:
         return
-    project = instance
-
-    for service_model in Service.get_all_models():
-        for service in service_model.objects.filter(available_for_all=True, customer=project.customer):
-            service_project_link_model = service.projects.through
-            service_project_link_model.objects.create(project=project, service=service)
+    linking.connect_project_to_available_services(instance)
 
 
 def connect_service_to_all_projects_if_it_is_available_for_all(sender, instance, created=False, **kwargs):
     service = instance
     if service.available_for_all:
-        service_project_link_model = service.projects.through
-        for project in service.customer.projects.all():
-            service_project_link_model.objects.get_or_create(project=project, service=service)
+        linking.connect_service_to_projects(service)
 
 
 def delete_service_settings_on_service_delete(sender, instance, **kwargs):
@@ -349,12 +406,37 @@ def delete_service_settings_on_scope_delete(sender, instance, **kwargs):
         service_settings.delete()
 
 
+def _clean_tags_cache(tagged_items):
+    keys = []
+    for content_type_id, object_id in tagged_items:
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is not None:
+            keys.append(TagMixin.get_tag_cache_key(model, object_id))
+    cache.delete_many(keys)
+
+
 def clean_tags_cache_after_tagged_item_saved(sender, instance, **kwargs):
-    instance.content_object.clean_tag_cache()
+    _clean_tags_cache([(instance.content_type_id, instance.object_id)])
 
 
 def clean_tags_cache_before_tagged_item_deleted(sender, instance, **kwargs):
-    instance.content_object.clean_tag_cache()
+    _clean_tags_cache([(instance.content_type_id, instance.object_id)])
+
+
+def clean_tags_cache_after_tag_renamed(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    tagged_items = TagMixin.tags.through.objects.filter(tag=instance).values_list('content_type_id', 'object_id')
+    _clean_tags_cache(tagged_items)
+
+
+def update_tag_index_after_tagged_item_saved(sender, instance, **kwargs):
+    TagIndex.add_tagged_item(instance)
+
+
+def update_tag_index_after_tag_renamed(sender, instance, created=False, **kwargs):
+    if not created:
+        TagIndex.update_tag(instance)
 
 
 def notify_about_user_profile_changes(sender, instance, created=False, **kwargs):
@@ -392,3 +474,39 @@ def notify_about_user_profile_changes(sender, instance, created=False, **kwargs)
         msg,
         event_type='user_profile_changed',
         event_context={'affected_user': user})
+
+
+def update_resource_index(sender, instance, update_fields=None, **kwargs):
+    ResourceIndex.update_resource(instance, update_fields)
+
+
+def delete_resource_index(sender, instance, **kwargs):
+    ResourceIndex.delete_resource(instance)
+
+
+def update_resource_index_on_project_move(sender, instance, created=False, **kwargs):
+    if not created and instance.tracker.has_changed('customer_id'):
+        ResourceIndex.objects.filter(project=instance).update(customer=instance.customer)
+
+
+def init_quotas_of_bulk_created_objects(sender, instances, **kwargs):
+    quotas_utils.init_quotas_in_bulk(sender, instances)
+    quotas_utils.add_counter_quotas_usage_in_bulk(sender, instances)
+
+
+def add_hierarchy_paths_of_bulk_created_objects(sender, instances, **kwargs):
+    HierarchyPath.add_nodes(instances)
+
+
+def update_hierarchy_path(sender, instance, created=False, update_fields=None, **kwargs):
+    if created:
+        HierarchyPath.add_node(instance)
+    elif HierarchyPath.has_parents_changed(instance, update_fields):
+        HierarchyPath.move_node(instance)
+    else:
+        return
+    HierarchyPath.remember_parents(instance)
+
+
+def delete_hierarchy_path(sender, instance, **kwargs):
+    HierarchyPath.delete_node(instance)
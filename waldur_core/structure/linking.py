@@ -0,0 +1,129 @@
+""" Bulk connection of customers to shared service settings and projects to services.
+
+Missing (customer, settings) and (project, service) pairs are computed using anti-joins.
+When shared settings are connected to all customers and projects, objects are created with
+bulk_create and post-save side effects are applied once for the whole batch by receivers
+of structure_objects_bulk_created signal. Objects for single new customer, project
+or service are created one by one, so that all post_save receivers, such as event loggers, are called.
+"""
+from __future__ import unicode_literals
+
+import logging
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Subquery
+
+from waldur_core.structure import SupportedServices, models, signals
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500
+
+
+def handle_objects_bulk_created(model, instances):
+    """ Apply side effects of post_save signal to objects created with bulk_create.
+        Quotas and hierarchy paths are created by receivers of structure_objects_bulk_created signal.
+    """
+    if not instances:
+        return
+    signals.structure_objects_bulk_created.send(sender=model, instances=instances)
+
+
+def create_in_bulk(model, field_names, rows, **defaults):
+    """ Create objects of model from rows of field values and return created objects """
+    rows = set(rows)
+    if not rows:
+        return []
+    model.objects.bulk_create([model(**dict(zip(field_names, row), **defaults)) for row in rows])
+    # Objects are fetched again because primary keys are not set by bulk_create for all databases.
+    query = {'%s__in' % name: {row[index] for row in rows} for index, name in enumerate(field_names)}
+    instances = [instance for instance in model.objects.filter(**query)
+                 if tuple(getattr(instance, name) for name in field_names) in rows]
+    handle_objects_bulk_created(model, instances)
+    return instances
+
+
+def create_one_by_one(model, field_names, rows, **defaults):
+    """ Create objects of model from rows of field values, post_save signal is sent for each object """
+    return [model.objects.create(**dict(zip(field_names, row), **defaults)) for row in rows]
+
+
+def iterate_chunks(queryset, field_names, chunk_size):
+    """ Iterate over lists of (pk, *field_names) rows ordered by primary key """
+    last_pk = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', *field_names)[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        last_pk = rows[-1][0]
+
+
+def get_service_model(service_settings):
+    return SupportedServices.get_service_models()[service_settings.type]['service']
+
+
+def connect_shared_settings(service_settings, chunk_size=None):
+    """ Create services of shared settings for all customers and connect them to customers projects.
+        Each chunk is committed in separate transaction.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    service_model = get_service_model(service_settings)
+    link_model = service_model.projects.through
+
+    customers = models.Customer.objects.annotate(is_connected=Exists(
+        service_model.objects.filter(customer=OuterRef('pk'), settings=service_settings)
+    )).filter(is_connected=False)
+    for rows in iterate_chunks(customers, [], chunk_size):
+        with transaction.atomic():
+            create_in_bulk(service_model, ('customer_id', 'settings_id'),
+                           [(customer_id, service_settings.pk) for customer_id, in rows],
+                           available_for_all=True)
+
+    services = service_model.objects.filter(customer=OuterRef('customer'), settings=service_settings)
+    projects = models.Project.objects.annotate(
+        connected_service_id=Subquery(services.values('pk')),
+        is_connected=Exists(link_model.objects.filter(project=OuterRef('pk'), service__settings=service_settings)),
+    ).filter(connected_service_id__isnull=False, is_connected=False)
+    for rows in iterate_chunks(projects, ['connected_service_id'], chunk_size):
+        with transaction.atomic():
+            create_in_bulk(link_model, ('project_id', 'service_id'), rows)
+
+
+def connect_customer_to_shared_settings(customer):
+    """ Create services of all shared settings for customer """
+    service_models = SupportedServices.get_service_models()
+    shared_types = models.ServiceSettings.objects.filter(shared=True).values_list('type', flat=True).distinct()
+    for service_type in shared_types:
+        try:
+            service_model = service_models[service_type]['service']
+        except KeyError:
+            logger.warning('Unregistered service of type %s' % service_type)
+            continue
+        settings_ids = models.ServiceSettings.objects.filter(shared=True, type=service_type).annotate(
+            is_connected=Exists(service_model.objects.filter(settings=OuterRef('pk'), customer=customer))
+        ).filter(is_connected=False).values_list('pk', flat=True)
+        create_one_by_one(service_model, ('customer_id', 'settings_id'),
+                          [(customer.pk, settings_id) for settings_id in settings_ids],
+                          available_for_all=True)
+
+
+def connect_project_to_available_services(project):
+    """ Connect project to all services of its customer that are available for all projects """
+    for service_model in models.Service.get_all_models():
+        link_model = service_model.projects.through
+        service_ids = service_model.objects.filter(available_for_all=True, customer_id=project.customer_id).annotate(
+            is_connected=Exists(link_model.objects.filter(service=OuterRef('pk'), project=project))
+        ).filter(is_connected=False).values_list('pk', flat=True)
+        create_one_by_one(link_model, ('project_id', 'service_id'),
+                          [(project.pk, service_id) for service_id in service_ids])
+
+
+def connect_service_to_projects(service):
+    """ Connect service to all projects of its customer """
+    link_model = service.projects.through
+    project_ids = models.Project.objects.filter(customer_id=service.customer_id).annotate(
+        is_connected=Exists(link_model.objects.filter(project=OuterRef('pk'), service=service))
+    ).filter(is_connected=False).values_list('pk', flat=True)
+    create_one_by_one(link_model, ('project_id', 'service_id'),
+                      [(project_id, service.pk) for project_id in project_ids])
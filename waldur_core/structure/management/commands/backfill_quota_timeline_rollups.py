@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from waldur_core.structure.models import QuotaTimelineRollup
+
+
+class Command(BaseCommand):
+    help = """ Create daily quota timeline snapshots for past days from quotas history """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-d', '--days', dest='days', type=int, default=30,
+            help='Number of past days for which snapshots are created. 30 days by default.',
+        )
+
+    def handle(self, *args, **options):
+        today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        dates = [today - timedelta(days=days) for days in range(options['days'], -1, -1)]
+
+        for date, values in QuotaTimelineRollup.iterate_history_values(dates):
+            QuotaTimelineRollup.create_snapshots(date, values=values)
+
+        self.stdout.write('Quota timeline snapshots have been created for %s days.' % len(dates))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from waldur_core.structure.models import HierarchyPath
+
+
+class Command(BaseCommand):
+    help = """ Check that hierarchy path table is consistent with customers, projects, services, links and resources """
+
+    def handle(self, *args, **options):
+        actual_rows = HierarchyPath.get_actual_rows()
+        stored_rows = HierarchyPath.get_stored_rows()
+
+        missing_rows = sorted(actual_rows - stored_rows)
+        stale_rows = sorted(stored_rows - actual_rows)
+        template = 'ancestor: %s-%s, descendant: %s-%s, depth: %s'
+
+        for row in missing_rows:
+            self.stdout.write('Missing row. ' + template % row)
+        for row in stale_rows:
+            self.stdout.write('Stale row. ' + template % row)
+
+        if missing_rows or stale_rows:
+            raise CommandError('Hierarchy path table is inconsistent: %s rows are missing, %s rows are stale. '
+                               'Run rebuild_hierarchy_paths command to fix it.' %
+                               (len(missing_rows), len(stale_rows)))
+
+        self.stdout.write('Hierarchy path table is consistent.')
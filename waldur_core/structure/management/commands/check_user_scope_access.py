@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from waldur_core.structure.models import UserScopeAccess
+
+
+class Command(BaseCommand):
+    help = """ Check that user scope access table is consistent with active customer and project permissions """
+
+    def handle(self, *args, **options):
+        actual_rows = UserScopeAccess.get_actual_rows()
+        stored_rows = UserScopeAccess.get_stored_rows()
+
+        missing_rows = sorted(actual_rows - stored_rows)
+        stale_rows = sorted(stored_rows - actual_rows)
+        template = 'user: %s, customer: %s, project: %s, role: %s'
+
+        for row in missing_rows:
+            self.stdout.write('Missing row. ' + template % row)
+        for row in stale_rows:
+            self.stdout.write('Stale row. ' + template % row)
+
+        if missing_rows or stale_rows:
+            raise CommandError('User scope access table is inconsistent: %s rows are missing, %s rows are stale. '
+                               'Run rebuild_user_scope_access command to fix it.' %
+                               (len(missing_rows), len(stale_rows)))
+
+        self.stdout.write('User scope access table is consistent.')
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import ProtectedError
+
+from waldur_core.structure.deletion import DeletionPlan
+from waldur_core.structure.models import Customer, Project
+
+
+class Command(BaseCommand):
+    help = """ Delete customers or projects together with all dependent objects using bulk queries.
+               Signals are not sent, so run recalculatequotas command afterwards. """
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=['customer', 'project'], help='Type of deleted objects.')
+        parser.add_argument('uuids', nargs='+', metavar='uuid', help='UUIDs of deleted objects.')
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only report numbers of rows which would be deleted.',
+        )
+        parser.add_argument(
+            '--force', action='store_true', dest='force', default=False,
+            help='Delete also objects protected from deletion, for example, projects of customer.',
+        )
+        parser.add_argument(
+            '--chunk-size', dest='chunk_size', type=int, default=None,
+            help='Number of rows deleted in one transaction.',
+        )
+
+    def handle(self, *args, **options):
+        model = {'customer': Customer, 'project': Project}[options['model']]
+        queryset = model.objects.filter(uuid__in=options['uuids'])
+        if queryset.count() != len(set(options['uuids'])):
+            raise CommandError('Some of %ss are not found.' % options['model'])
+
+        try:
+            plan = DeletionPlan(queryset, cascade_protected=options['force'], chunk_size=options['chunk_size'])
+        except NotImplementedError as e:
+            raise CommandError(e.args[0])
+        for action, label, count in plan.get_report():
+            self.stdout.write('%s %s: %s' % (action, label, count))
+
+        if options['dry_run']:
+            return
+
+        try:
+            plan.execute()
+        except ProtectedError as e:
+            raise CommandError('%s Use --force option in order to delete them too.' % e.args[0])
+
+        self.stdout.write('Objects have been deleted. Run recalculatequotas command in order to update quotas.')
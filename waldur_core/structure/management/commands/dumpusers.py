@@ -1,4 +1,7 @@
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
+import csv
+import io
+import json
 
 from django.contrib.auth import get_user_model
 from django.core.management.base import BaseCommand
@@ -16,10 +19,14 @@ USER_COLUMNS = OrderedDict([
     ('Job title', ('job_title',)),
     ('Staff, Support', ('is_staff', 'is_support',)),
 ])
+USER_FIELDS = [field for fields in USER_COLUMNS.values() for field in fields]
 
 # in chars
 COLUMN_MAX_WIDTH = 25
 
+# Users are fetched and written by chunks, so that memory usage does not depend on number of users.
+CHUNK_SIZE = 1000
+
 
 def format_string_to_column_size(string):
     if len(string) <= COLUMN_MAX_WIDTH:
@@ -48,6 +55,97 @@ def to_string(value):
     return format_string_to_column_size(str(value))
 
 
+def group_by_user(permissions):
+    result = defaultdict(list)
+    for permission in permissions.order_by('pk').iterator():
+        result[permission.user_id].append(six.text_type(permission))
+    return result
+
+
+def iterate_users(chunk_size):
+    """ Yield lists of (user, customer roles, project roles) tuples.
+        Each list is fetched using three queries.
+    """
+    last_pk = 0
+    while True:
+        users = list(User.objects.filter(pk__gt=last_pk).order_by('pk').only(*USER_FIELDS)[:chunk_size])
+        if not users:
+            return
+        user_ids = [user.pk for user in users]
+        customer_roles = group_by_user(models.CustomerPermission.objects.filter(
+            is_active=True, user_id__in=user_ids).select_related('customer'))
+        project_roles = group_by_user(models.ProjectPermission.objects.filter(
+            is_active=True, user_id__in=user_ids).select_related('project'))
+        yield [(user, customer_roles[user.pk], project_roles[user.pk]) for user in users]
+        last_pk = users[-1].pk
+
+
+class TableFormatter(object):
+    """ Columns have fixed width, so that tables of chunks are joined into single table. """
+
+    def __init__(self):
+        self.header_written = False
+
+    def format(self, rows):
+        columns = [name.center(COLUMN_MAX_WIDTH) for name in list(USER_COLUMNS.keys()) + ['Organizations', 'Projects']]
+        # Width of columns is computed from header, so it is rendered for each chunk.
+        table = prettytable.PrettyTable(columns, hrules=prettytable.ALL)
+        for user, customer_roles, project_roles in rows:
+            row = [to_string([getattr(user, f) for f in fields if getattr(user, f) not in ('', None)])
+                   for fields in USER_COLUMNS.values()]
+            row += [to_string(customer_roles), to_string(project_roles)]
+            table.add_row(row)
+
+        output = table.get_string()
+        if self.header_written:
+            # Top border, header and its border are skipped, because the first row
+            # of chunk is separated by bottom border of previous chunk.
+            output = output.split('\n', 3)[3]
+        self.header_written = True
+        return output + '\n'
+
+
+class CsvFormatter(object):
+    def __init__(self):
+        self.header_written = False
+
+    def format_row(self, values):
+        stream = six.StringIO()
+        if six.PY2:
+            values = [six.text_type(value).encode('utf-8') for value in values]
+        csv.writer(stream, lineterminator='\n').writerow(values)
+        output = stream.getvalue()
+        return output.decode('utf-8') if six.PY2 else output
+
+    def format(self, rows):
+        output = []
+        if not self.header_written:
+            output.append(self.format_row(USER_FIELDS + ['organizations', 'projects']))
+            self.header_written = True
+        for user, customer_roles, project_roles in rows:
+            values = [getattr(user, field) for field in USER_FIELDS]
+            output.append(self.format_row(values + ['; '.join(customer_roles), '; '.join(project_roles)]))
+        return ''.join(output)
+
+
+class JsonFormatter(object):
+    def format(self, rows):
+        output = []
+        for user, customer_roles, project_roles in rows:
+            data = OrderedDict((field, getattr(user, field)) for field in USER_FIELDS)
+            data['organizations'] = customer_roles
+            data['projects'] = project_roles
+            output.append(six.text_type(json.dumps(data)) + '\n')
+        return ''.join(output)
+
+
+FORMATTERS = {
+    'table': TableFormatter,
+    'csv': CsvFormatter,
+    'json': JsonFormatter,
+}
+
+
 class Command(BaseCommand):
     help = "Dumps information about users, their organizations and projects."
 
@@ -57,28 +155,20 @@ class Command(BaseCommand):
             dest='output', default=None,
             help='Specifies file to which the output is written. The output will be printed to stdout by default.',
         )
+        parser.add_argument(
+            '-f', '--format',
+            dest='format', default='table', choices=sorted(FORMATTERS.keys()),
+            help='Output format: table, CSV or JSON object per line. Table is used by default.',
+        )
 
     def handle(self, *args, **options):
-        # fetch objects
-        users = User.objects.all()
-        project_roles = models.ProjectPermission.objects.filter(is_active=True)
-        customer_roles = models.CustomerPermission.objects.filter(is_active=True)
-
-        # build table
-        columns = list(USER_COLUMNS.keys()) + ['Organizations', 'Projects']
-        table = prettytable.PrettyTable(columns, hrules=prettytable.ALL)
-        for user in users:
-            user_customers = to_string(list(customer_roles.filter(user=user)))
-            user_projects = to_string(list(project_roles.filter(user=user)))
-            row = [to_string([getattr(user, f) for f in fields if getattr(user, f) not in ('', None)])
-                   for fields in USER_COLUMNS.values()]
-            row += [user_customers, user_projects]
-            table.add_row(row)
+        formatter = FORMATTERS[options['format']]()
 
-        # output
         if options['output'] is None:
-            self.stdout.write(table.get_string())
+            for rows in iterate_users(CHUNK_SIZE):
+                self.stdout.write(formatter.format(rows), ending='')
             return
 
-        with open(options['output'], 'w') as output_file:
-            output_file.write(table.get_string())
+        with io.open(options['output'], 'w', encoding='utf-8') as output_file:
+            for rows in iterate_users(CHUNK_SIZE):
+                output_file.write(formatter.format(rows))
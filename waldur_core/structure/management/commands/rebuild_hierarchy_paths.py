@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from waldur_core.structure.models import HierarchyPath
+
+
+class Command(BaseCommand):
+    help = """ Rebuild hierarchy path table from customers, projects, services, links and resources """
+
+    def handle(self, *args, **options):
+        count = HierarchyPath.rebuild()
+        self.stdout.write('Hierarchy path table has been rebuilt: %s rows stored.' % count)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from waldur_core.structure.models import UserScopeAccess
+
+
+class Command(BaseCommand):
+    help = """ Rebuild denormalized user scope access table from active customer and project permissions """
+
+    def handle(self, *args, **options):
+        created_count, deleted_count = UserScopeAccess.sync()
+        self.stdout.write('User scope access table has been rebuilt: %s rows created, %s rows deleted.' %
+                          (created_count, deleted_count))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from waldur_core.structure.models import TagIndex
+
+
+class Command(BaseCommand):
+    help = """ Rebuild normalized index of tags of all objects """
+
+    def handle(self, *args, **options):
+        count = TagIndex.rebuild()
+        self.stdout.write('%s tagged items have been indexed.' % count)
@@ -1,26 +1,40 @@
+from django.apps import apps
 from django.db import models
 
 from waldur_core.core.managers import GenericKeyMixin, SummaryQuerySet
 
 
-def get_permission_subquery(permissions, user):
+def is_multivalued_path(model, path):
+    """ Return True if lookup path traverses one-to-many or many-to-many relation """
+    for name in path.split('__'):
+        field = model._meta.get_field(name)
+        if field.one_to_many or field.many_to_many:
+            return True
+        model = field.related_model
+    return False
+
+
+def get_permission_subquery(model, permissions, user):
+    access_model = apps.get_model('structure', 'UserScopeAccess')
     subquery = models.Q()
     for entity in ('customer', 'project'):
         path = getattr(permissions, '%s_path' % entity, None)
         if not path:
             continue
 
-        if path == 'self':
-            prefix = 'permissions__'
+        if entity == 'customer':
+            scopes = access_model.get_customers_subquery(user)
         else:
-            prefix = path + '__permissions__'
-
-        kwargs = {
-            prefix + 'user': user,
-            prefix + 'is_active': True
-        }
+            scopes = access_model.get_projects_subquery(user)
 
-        subquery |= models.Q(**kwargs)
+        if path == 'self':
+            subquery |= models.Q(pk__in=scopes)
+        elif is_multivalued_path(model, path):
+            # Filter by primary key in order to avoid duplicates without DISTINCT.
+            matching = model._default_manager.filter(**{path + '__in': scopes}).values('pk')
+            subquery |= models.Q(pk__in=matching)
+        else:
+            subquery |= models.Q(**{path + '__in': scopes})
 
     # Add extra query which basically allows to
     # additionally filter by some flag and ignore permissions
@@ -35,16 +49,20 @@ def filter_queryset_for_user(queryset, user):
     if user is None or user.is_staff or user.is_support:
         return queryset
 
+    if isinstance(queryset, SummaryQuerySet):
+        # Permission paths are resolved for each concrete model separately.
+        return queryset.map(lambda qs: filter_queryset_for_user(qs, user))
+
     try:
         permissions = queryset.model.Permissions
     except AttributeError:
         return queryset
 
-    subquery = get_permission_subquery(permissions, user)
+    subquery = get_permission_subquery(queryset.model, permissions, user)
     if not subquery:
         return queryset
 
-    return queryset.filter(subquery).distinct()
+    return queryset.filter(subquery)
 
 
 class StructureQueryset(models.QuerySet):
@@ -1,4 +1,5 @@
 from collections import OrderedDict
+import copy
 
 from django.utils.encoding import force_text
 from django.utils.http import urlencode
@@ -45,10 +46,25 @@ class ActionSerializer(object):
 
     def get_reason(self):
         try:
-            self.view.initial(self.request)
+            self.check_action()
         except exceptions.APIException as e:
             return force_text(e)
 
+    def check_action(self):
+        """
+        Run the same checks as view does before action execution.
+        Resource is passed to checks explicitly, so it is not fetched again for each action.
+        """
+        view = self.view
+        if not hasattr(view, 'validate_object_action'):
+            view.initial(self.request)
+            return
+        view.check_permissions(self.request)
+        if self.name in getattr(view, 'disabled_actions', []):
+            raise exceptions.MethodNotAllowed(method=self.request.method)
+        view.check_object_permissions(self.request, self.resource)
+        view.validate_object_action(self.name, self.resource)
+
     def get_method(self):
         if self.name == 'destroy':
             return 'DELETE'
@@ -84,6 +100,10 @@ class ActionsMetadata(SimpleMetadata):
         }, SimpleMetadata.label_lookup.mapping)
     )
 
+    # Static metadata does not depend on resource, so it is computed once per view class.
+    _actions_cache = {}
+    _fields_cache = {}
+
     def determine_metadata(self, request, view):
         self.request = request
         metadata = OrderedDict()
@@ -99,16 +119,8 @@ class ActionsMetadata(SimpleMetadata):
         such as start, stop, unlink
         """
         metadata = OrderedDict()
-        actions = self.get_resource_actions(view)
-
         resource = view.get_object()
-        for action_name, action in actions.items():
-            if action_name == 'update':
-                view.request = clone_request(request, 'PUT')
-            else:
-                view.action = action_name
-
-            data = ActionSerializer(action, action_name, request, view, resource)
+        for action_name, data in self.iterate_actions(request, view, resource):
             metadata[action_name] = data.serialize()
             if not metadata[action_name]['enabled']:
                 continue
@@ -119,13 +131,45 @@ class ActionsMetadata(SimpleMetadata):
                 metadata[action_name]['type'] = 'form'
                 metadata[action_name]['fields'] = fields
 
-            view.action = None
-            view.request = request
-
         return metadata
 
+    def get_actions_availability(self, request, view, resources):
+        """
+        Return availability of resource-specific actions for each resource.
+        """
+        self.request = request
+        availability = OrderedDict()
+        for resource in resources:
+            actions = OrderedDict()
+            for action_name, data in self.iterate_actions(request, view, resource):
+                reason = data.get_reason()
+                actions[action_name] = {'enabled': not reason, 'reason': reason}
+            availability[resource.uuid.hex] = actions
+        return availability
+
+    def iterate_actions(self, request, view, resource):
+        """
+        Yield name and serializer of each action. View is switched to action while it is processed.
+        """
+        for action_name, action in self.get_resource_actions(view).items():
+            action_request = clone_request(request, 'PUT') if action_name == 'update' else request
+            view.action = action_name
+            view.request = action_request
+            try:
+                yield action_name, ActionSerializer(action, action_name, action_request, view, resource)
+            finally:
+                view.action = None
+                view.request = request
+
     @classmethod
     def get_resource_actions(cls, view):
+        view_class = view.__class__
+        if view_class not in cls._actions_cache:
+            cls._actions_cache[view_class] = cls._get_resource_actions(view)
+        return cls._actions_cache[view_class]
+
+    @classmethod
+    def _get_resource_actions(cls, view):
         actions = {}
         disabled_actions = getattr(view.__class__, 'disabled_actions', [])
 
@@ -140,23 +184,54 @@ class ActionsMetadata(SimpleMetadata):
             actions[key] = callback
 
         if 'DELETE' in view.allowed_methods and 'destroy' not in disabled_actions:
-            actions['destroy'] = view.destroy
+            actions['destroy'] = view.__class__.destroy
 
         if 'PUT' in view.allowed_methods and 'update' not in disabled_actions:
-            actions['update'] = view.update
+            actions['update'] = view.__class__.update
 
         return sort_dict(actions)
 
     def get_action_fields(self, view, action_name, resource):
         """
-        Get fields exposed by action's serializer
+        Get fields exposed by action's serializer.
+        Metadata of fields which does not depend on request is computed on first use
+        and cached per view class, action and serializer class. Serializer is instantiated
+        again only if it may set query parameters or choices of fields for each request.
         """
-        serializer = view.get_serializer(resource)
-        fields = OrderedDict()
-        if not isinstance(serializer, view.serializer_class) or action_name == 'update':
-            fields = self.get_fields(serializer.fields)
+        serializer_class = view.get_serializer_class()
+        if issubclass(serializer_class, view.serializer_class) and action_name != 'update':
+            return OrderedDict()
+
+        key = (view.__class__, action_name, serializer_class)
+        serializer_fields = None
+        if key not in self._fields_cache:
+            serializer_fields = view.get_serializer(resource).fields
+            self._fields_cache[key] = self.get_static_fields(serializer_fields)
+        static_fields, dynamic_fields = self._fields_cache[key]
+
+        if dynamic_fields and serializer_fields is None:
+            serializer_fields = view.get_serializer(resource).fields
+        fields = copy.deepcopy(static_fields)
+        for field_name, info in fields.items():
+            if field_name in dynamic_fields:
+                self.update_field_info(info, serializer_fields[field_name])
+            elif 'url' in info:
+                info['url'] = self.get_list_url(info['url'])
         return fields
 
+    def get_static_fields(self, serializer_fields):
+        """
+        Return metadata of fields which does not depend on request
+        and names of fields which metadata should be updated for each request.
+        """
+        fields = OrderedDict()
+        dynamic_fields = set()
+        for field_name, field in self.iterate_fields(serializer_fields):
+            fields[field_name] = self.get_static_field_info(field, field_name)
+            if hasattr(field, 'query_params') or (hasattr(field, 'choices') and not hasattr(field, 'queryset')):
+                dynamic_fields.add(field_name)
+        return fields, dynamic_fields
+
     def get_serializer_info(self, serializer):
         """
         Given an instance of a serializer, return a dictionary of metadata
@@ -170,24 +245,38 @@ class ActionsMetadata(SimpleMetadata):
 
     def get_fields(self, serializer_fields):
         """
-        Get fields metadata skipping empty fields
+        Get fields metadata skipping empty fields.
         """
         fields = OrderedDict()
+        for field_name, field in self.iterate_fields(serializer_fields):
+            fields[field_name] = self.get_field_info(field, field_name)
+        return fields
+
+    def iterate_fields(self, serializer_fields):
         for field_name, field in serializer_fields.items():
             # Skip tags field in action because it is needed only for resource creation
             # See also: WAL-1223
             if field_name == 'tags':
                 continue
-            info = self.get_field_info(field, field_name)
-            if info:
-                fields[field_name] = info
-        return fields
+            if getattr(field, 'read_only', False):
+                continue
+            yield field_name, field
 
     def get_field_info(self, field, field_name):
         """
         Given an instance of a serializer field, return a dictionary
         of metadata about it.
         """
+        if getattr(field, 'read_only', False):
+            return None
+        field_info = self.get_static_field_info(field, field_name)
+        self.update_field_info(field_info, field)
+        return field_info
+
+    def get_static_field_info(self, field, field_name):
+        """
+        Return metadata of field which does not depend on request.
+        """
         field_info = OrderedDict()
         field_info['type'] = self.label_lookup[field]
         field_info['required'] = getattr(field, 'required', False)
@@ -197,9 +286,6 @@ class ActionsMetadata(SimpleMetadata):
             'min_length', 'max_length', 'min_value', 'max_value', 'many'
         ]
 
-        if getattr(field, 'read_only', False):
-            return None
-
         for attr in attrs:
             value = getattr(field, attr, None)
             if value is not None and value != '':
@@ -209,15 +295,21 @@ class ActionsMetadata(SimpleMetadata):
             field_info['label'] = field_name.replace('_', ' ').title()
 
         if hasattr(field, 'view_name'):
-            list_view = field.view_name.replace('-detail', '-list')
-            base_url = reverse(list_view, request=self.request)
             field_info['type'] = 'select'
-            field_info['url'] = base_url
-            if hasattr(field, 'query_params'):
-                field_info['url'] += '?%s' % urlencode(field.query_params)
+            # Name of list view is replaced with its URL for each request.
+            field_info['url'] = field.view_name.replace('-detail', '-list')
             field_info['value_field'] = getattr(field, 'value_field', 'url')
             field_info['display_name_field'] = getattr(field, 'display_name_field', 'display_name')
 
+        return field_info
+
+    def update_field_info(self, field_info, field):
+        """
+        Add metadata of field which serializer may set for each request.
+        """
+        if hasattr(field, 'view_name'):
+            field_info['url'] = self.get_list_url(field_info['url'], getattr(field, 'query_params', None))
+
         if hasattr(field, 'choices') and not hasattr(field, 'queryset'):
             field_info['choices'] = [
                 {
@@ -227,4 +319,8 @@ class ActionsMetadata(SimpleMetadata):
                 for choice_value, choice_name in field.choices.items()
             ]
 
-        return field_info
+    def get_list_url(self, list_view, query_params=None):
+        url = reverse(list_view, request=self.request)
+        if query_params is not None:
+            url += '?%s' % urlencode(query_params)
+        return url
@@ -0,0 +1,75 @@
+from __future__ import unicode_literals
+
+from collections import defaultdict
+import threading
+
+from django.utils.deprecation import MiddlewareMixin
+
+_locals = threading.local()
+
+
+class UserPermissions(object):
+    """ Active roles of user loaded from database using one query per permission model. """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.roles = {}
+
+    def get_roles(self, field):
+        """ Return dictionary that maps scope ID to list of (role, expiration_time) tuples.
+            `field` is foreign key from permission model to scope model.
+        """
+        if field not in self.roles:
+            roles = defaultdict(list)
+            permissions = field.model.objects.filter(user_id=self.user_id, is_active=True)
+            for scope_id, role, expiration_time in permissions.values_list(field.attname, 'role', 'expiration_time'):
+                roles[scope_id].append((role, expiration_time))
+            self.roles[field] = roles
+        return self.roles[field]
+
+    def has_role(self, field, scope_id, role=None, timestamp=False):
+        """ Has the same semantics as PermissionMixin.has_user """
+        for permission_role, expiration_time in self.get_roles(field).get(scope_id, []):
+            if role is not None and permission_role != role:
+                continue
+            if timestamp is None and expiration_time is not None:
+                continue
+            if timestamp and expiration_time is not None and expiration_time < timestamp:
+                continue
+            return True
+        return False
+
+
+def get_user_permissions(user):
+    """ Return cached permissions of user or None if permission cache is not enabled. """
+    cache = getattr(_locals, 'permissions', None)
+    if cache is None or user.pk is None:
+        return None
+    if user.pk not in cache:
+        cache[user.pk] = UserPermissions(user.pk)
+    return cache[user.pk]
+
+
+def enable_permission_cache():
+    _locals.permissions = {}
+
+
+def clear_permission_cache():
+    if getattr(_locals, 'permissions', None) is not None:
+        _locals.permissions = {}
+
+
+def disable_permission_cache():
+    if hasattr(_locals, 'permissions'):
+        del _locals.permissions
+
+
+class PermissionCacheMiddleware(MiddlewareMixin):
+    """ Cache active roles of users during request processing. """
+
+    def process_request(self, request):
+        enable_permission_cache()
+
+    def process_response(self, request, response):
+        disable_permission_cache()
+        return response
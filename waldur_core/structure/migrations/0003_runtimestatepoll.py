@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 21:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+import waldur_core.core.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('structure', '0002_immutable_default_json'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RuntimeStatePoll',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('backend_pull_method', models.CharField(max_length=255)),
+                ('success_state', models.CharField(max_length=150)),
+                ('erred_state', models.CharField(max_length=150)),
+                ('task_id', models.CharField(max_length=255)),
+                ('callbacks', waldur_core.core.fields.JSONField(blank=True, default=list)),
+                ('errbacks', waldur_core.core.fields.JSONField(blank=True, default=list)),
+                ('chain', waldur_core.core.fields.JSONField(blank=True, default=list)),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False)),
+                ('deadline', models.DateTimeField()),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+                ('service_settings', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='structure.ServiceSettings')),
+            ],
+        ),
+    ]
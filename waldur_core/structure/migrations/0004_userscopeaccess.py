@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 22:08
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_user_scope_access(apps, schema_editor):
+    CustomerPermission = apps.get_model('structure', 'CustomerPermission')
+    ProjectPermission = apps.get_model('structure', 'ProjectPermission')
+    UserScopeAccess = apps.get_model('structure', 'UserScopeAccess')
+
+    rows = set()
+    for user_id, customer_id, role in CustomerPermission.objects.filter(is_active=True).values_list(
+            'user_id', 'customer_id', 'role'):
+        rows.add((user_id, customer_id, None, role))
+    for user_id, customer_id, project_id, role in ProjectPermission.objects.filter(is_active=True).values_list(
+            'user_id', 'project__customer', 'project_id', 'role'):
+        rows.add((user_id, customer_id, project_id, role))
+
+    UserScopeAccess.objects.bulk_create([
+        UserScopeAccess(user_id=user_id, customer_id=customer_id, project_id=project_id, role=role)
+        for user_id, customer_id, project_id, role in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('structure', '0003_runtimestatepoll'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserScopeAccess',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(max_length=30)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='structure.Customer')),
+                ('project', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='structure.Project')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='userscopeaccess',
+            unique_together=set([('user', 'project', 'customer', 'role')]),
+        ),
+        migrations.RunPython(fill_user_scope_access, migrations.RunPython.noop),
+    ]
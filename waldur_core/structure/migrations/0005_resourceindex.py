@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 22:24
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('structure', '0004_userscopeaccess'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceIndex',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('uuid', models.CharField(db_index=True, max_length=32)),
+                ('name', models.CharField(db_index=True, max_length=150)),
+                ('backend_id', models.CharField(blank=True, db_index=True, max_length=255)),
+                ('ip_addresses', models.TextField(blank=True)),
+                ('state', models.IntegerField(null=True)),
+                ('tags', models.TextField(blank=True)),
+                ('created', models.DateTimeField(db_index=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='structure.Customer')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='structure.Project')),
+                ('service_settings', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='structure.ServiceSettings')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='resourceindex',
+            unique_together=set([('content_type', 'object_id')]),
+        ),
+    ]
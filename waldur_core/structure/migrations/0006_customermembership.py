@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 22:38
+from __future__ import unicode_literals
+
+import collections
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_customer_memberships(apps, schema_editor):
+    CustomerPermission = apps.get_model('structure', 'CustomerPermission')
+    ProjectPermission = apps.get_model('structure', 'ProjectPermission')
+    CustomerMembership = apps.get_model('structure', 'CustomerMembership')
+
+    counts = collections.Counter()
+    for row in CustomerPermission.objects.filter(is_active=True).values_list('customer_id', 'user_id'):
+        counts[row] += 1
+    for row in ProjectPermission.objects.filter(is_active=True).values_list('project__customer', 'user_id'):
+        counts[row] += 1
+
+    CustomerMembership.objects.bulk_create([
+        CustomerMembership(customer_id=customer_id, user_id=user_id, count=count)
+        for (customer_id, user_id), count in counts.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('structure', '0005_resourceindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerMembership',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='structure.Customer')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='customermembership',
+            unique_together=set([('customer', 'user')]),
+        ),
+        migrations.RunPython(fill_customer_memberships, migrations.RunPython.noop),
+    ]
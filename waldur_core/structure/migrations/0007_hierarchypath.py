@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 22:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Table is not filled here, because paths are computed from models of plugins which schema is not known
+# at this migration state. Run rebuild_hierarchy_paths management command after migration.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('structure', '0006_customermembership'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HierarchyPath',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ancestor_id', models.PositiveIntegerField()),
+                ('descendant_id', models.PositiveIntegerField()),
+                ('depth', models.PositiveSmallIntegerField()),
+                ('ancestor_content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+                ('descendant_content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='hierarchypath',
+            unique_together=set([('ancestor_content_type', 'ancestor_id', 'descendant_content_type', 'descendant_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='hierarchypath',
+            index_together=set([('descendant_content_type', 'descendant_id')]),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 23:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('structure', '0007_hierarchypath'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuotaTimelineRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('interval', models.CharField(choices=[('hour', 'hour'), ('day', 'day'), ('week', 'week'), ('month', 'month')], max_length=5)),
+                ('date', models.DateTimeField()),
+                ('name', models.CharField(max_length=150)),
+                ('limit', models.FloatField()),
+                ('usage', models.FloatField()),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='quotatimelinerollup',
+            unique_together=set([('content_type', 'object_id', 'name', 'date')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='quotatimelinerollup',
+            index_together=set([('date', 'interval')]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 23:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('structure', '0008_quotatimelinerollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicesettings',
+            name='next_pull_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='servicesettings',
+            name='pull_duration',
+            field=models.FloatField(blank=True, editable=False, help_text='Duration of last pull from backend in seconds', null=True),
+        ),
+        migrations.AddField(
+            model_name='servicesettings',
+            name='pull_failures',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of consecutive failed pulls'),
+        ),
+        migrations.AddField(
+            model_name='servicesettings',
+            name='pulled_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Time of last successful pull from backend', null=True),
+        ),
+    ]
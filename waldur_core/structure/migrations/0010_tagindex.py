@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 00:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_tag_index(apps, schema_editor):
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    TagIndex = apps.get_model('structure', 'TagIndex')
+
+    rows = TaggedItem.objects.values_list('pk', 'content_type_id', 'object_id', 'tag__name')
+    items = []
+    for pk, content_type_id, object_id, name in rows.iterator():
+        name = name.lower()
+        key, value = name.partition(':')[::2]
+        items.append(TagIndex(tagged_item_id=pk, content_type_id=content_type_id, object_id=object_id,
+                              name=name, key=key, value=value))
+    TagIndex.objects.bulk_create(items, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('taggit', '0002_auto_20150616_2121'),
+        ('structure', '0009_servicesettings_pull_schedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagIndex',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('name', models.CharField(db_index=True, max_length=100)),
+                ('key', models.CharField(max_length=100)),
+                ('value', models.CharField(blank=True, db_index=True, max_length=100)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+                ('tagged_item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='taggit.TaggedItem')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='tagindex',
+            index_together=set([('content_type', 'key', 'value')]),
+        ),
+        migrations.RunPython(fill_tag_index, reverse_code=migrations.RunPython.noop),
+    ]
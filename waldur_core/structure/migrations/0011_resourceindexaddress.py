@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_resource_index_addresses(apps, schema_editor):
+    ResourceIndex = apps.get_model('structure', 'ResourceIndex')
+    ResourceIndexAddress = apps.get_model('structure', 'ResourceIndexAddress')
+
+    rows = ResourceIndex.objects.exclude(ip_addresses='').values_list('pk', 'ip_addresses')
+    addresses = []
+    for pk, ip_addresses in rows.iterator():
+        for ip_address in set(ip_addresses.split(',')):
+            if ip_address:
+                addresses.append(ResourceIndexAddress(index_id=pk, ip_address=ip_address))
+    ResourceIndexAddress.objects.bulk_create(addresses, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('structure', '0010_tagindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceIndexAddress',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip_address', models.CharField(db_index=True, max_length=255)),
+                ('index', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='addresses', to='structure.ResourceIndex')),
+            ],
+        ),
+        migrations.RunPython(fill_resource_index_addresses, reverse_code=migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='resourceindex',
+            name='ip_addresses',
+        ),
+        migrations.RemoveField(
+            model_name='resourceindex',
+            name='tags',
+        ),
+    ]
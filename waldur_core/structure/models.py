@@ -1,8 +1,11 @@
 from __future__ import unicode_literals
 
+import collections
 import datetime
 from functools import reduce
+import hashlib
 import itertools
+import operator
 
 from django.apps import apps
 from django.conf import settings
@@ -15,14 +18,16 @@ from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models, transaction
 from django.db.models import Q
 from django.utils import timezone
-from django.utils.encoding import python_2_unicode_compatible
+from django.utils.encoding import force_text, python_2_unicode_compatible
 from django.utils.lru_cache import lru_cache
 from django.utils.translation import ugettext_lazy as _
 from model_utils import FieldTracker
 from model_utils.fields import AutoCreatedField
 from model_utils.models import TimeStampedModel
 import pyvat
+from reversion.models import Version
 from taggit.managers import TaggableManager
+from taggit.models import TaggedItem
 
 from waldur_core.core import fields as core_fields
 from waldur_core.core import models as core_models
@@ -33,12 +38,14 @@ from waldur_core.core.validators import validate_name, validate_cidr_list, FileT
 from waldur_core.logging.loggers import LoggableMixin
 from waldur_core.monitoring.models import MonitoringModelMixin
 from waldur_core.quotas import models as quotas_models, fields as quotas_fields
-from waldur_core.structure import SupportedServices
+from waldur_core.structure import SupportedServices, geoip
 from waldur_core.structure.images import ImageModelMixin
+from waldur_core.structure.middleware import clear_permission_cache, get_user_permissions
 from waldur_core.structure.managers import StructureManager, filter_queryset_for_user, \
     ServiceSettingsManager, PrivateServiceSettingsManager, SharedServiceSettingsManager
-from waldur_core.structure.signals import structure_role_granted, structure_role_revoked
-from waldur_core.structure.utils import get_coordinates_by_ip, sort_dependencies
+from waldur_core.structure.signals import structure_role_granted, structure_role_revoked, \
+    structure_role_bulk_revoked
+from waldur_core.structure.utils import sort_dependencies
 
 
 def validate_service_type(service_type):
@@ -73,6 +80,33 @@ class StructureModel(models.Model):
             "'%s' object has no attribute '%s'" % (self._meta.object_name, name))
 
 
+class HierarchyMixin(core_models.DescendantMixin):
+    """ Node of structure hierarchy which ancestors and descendants are read from HierarchyPath table """
+
+    def get_ancestors(self):
+        ancestors = HierarchyPath.get_ancestors(self) if self.pk else []
+        # Paths could be not stored yet if ancestors are requested during node creation.
+        if not ancestors and self.get_parents():
+            return super(HierarchyMixin, self).get_ancestors()
+        return ancestors
+
+    def get_descendants(self, model=None):
+        """ Get all unique instance descendants, optionally filtered by model or its base class """
+        descendants = HierarchyPath.get_descendants(self, model) if self.pk else []
+        # Paths are not stored if rebuild_hierarchy_paths command has not been run after migration.
+        if not descendants and self.pk and not HierarchyPath.has_node(self):
+            descendants = super(HierarchyMixin, self).get_descendants()
+            if model is not None:
+                descendants = [descendant for descendant in descendants if isinstance(descendant, model)]
+        return descendants
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(HierarchyMixin, cls).from_db(db, field_names, values)
+        HierarchyPath.remember_parents(instance)
+        return instance
+
+
 class StructureLoggableMixin(LoggableMixin):
 
     @classmethod
@@ -95,6 +129,9 @@ class TagMixin(models.Model):
     tags = TaggableManager(related_name='+', blank=True)
 
     def get_tags(self):
+        tags = getattr(self, '_prefetched_tags', None)
+        if tags is not None:
+            return tags
         key = self._get_tag_cache_key()
         tags = cache.get(key)
         if tags is None:
@@ -103,11 +140,49 @@ class TagMixin(models.Model):
         return tags
 
     def clean_tag_cache(self):
+        self._prefetched_tags = None
         key = self._get_tag_cache_key()
         cache.delete(key)
 
     def _get_tag_cache_key(self):
-        return 'tags:%s' % core_utils.serialize_instance(self)
+        return self.get_tag_cache_key(self._meta.concrete_model, self.pk)
+
+    @staticmethod
+    def get_tag_cache_key(model, object_id):
+        return 'tags:%s:%s' % (force_text(model._meta), object_id)
+
+    @staticmethod
+    def prefetch_tags(instances):
+        """
+        Load tags of instances with single cache lookup and single query for instances missing in cache.
+        Tags are stored in instances, so get_tags does not hit cache for them.
+        """
+        instances = [instance for instance in instances if isinstance(instance, TagMixin) and instance.pk]
+        if not instances:
+            return
+
+        keys = {instance: instance._get_tag_cache_key() for instance in instances}
+        tags = cache.get_many(set(keys.values()))
+        missing = [instance for instance in instances if keys[instance] not in tags]
+
+        if missing:
+            object_ids = collections.defaultdict(set)
+            for instance in missing:
+                object_ids[ContentType.objects.get_for_model(instance)].add(instance.pk)
+            query = reduce(operator.or_, [Q(content_type=content_type, object_id__in=ids)
+                                          for content_type, ids in object_ids.items()])
+            rows = TagMixin.tags.through.objects.filter(query).order_by('pk').values_list(
+                'content_type_id', 'object_id', 'tag__name')
+
+            loaded = {keys[instance]: [] for instance in missing}
+            for content_type_id, object_id, name in rows:
+                model = ContentType.objects.get_for_id(content_type_id).model_class()
+                loaded[TagMixin.get_tag_cache_key(model, object_id)].append(name)
+            cache.set_many(loaded)
+            tags.update(loaded)
+
+        for instance in instances:
+            instance._prefetched_tags = tags[keys[instance]]
 
 
 class VATException(Exception):
@@ -168,10 +243,42 @@ class BasePermission(models.Model):
     def get_url_name(cls):
         raise NotImplementedError
 
+    @classmethod
+    def get_structure_field_name(cls):
+        """ Name of foreign key to structure in which role is granted """
+        raise NotImplementedError
+
     @classmethod
     def get_expired(cls):
         return cls.objects.filter(expiration_time__lt=timezone.now(), is_active=True)
 
+    @classmethod
+    @transaction.atomic()
+    def revoke_expired(cls):
+        """ Deactivate expired permissions using single query and return them.
+            All revoked roles are reported by one structure_role_bulk_revoked signal.
+        """
+        permissions = list(cls.get_expired().select_for_update())
+        if not permissions:
+            return []
+
+        cls.objects.filter(pk__in=[permission.pk for permission in permissions]).update(is_active=None)
+        clear_permission_cache()
+
+        field = cls._meta.get_field(cls.get_structure_field_name())
+        structure_model = field.related_model
+        structures = structure_model.objects.in_bulk({getattr(permission, field.attname) for permission in permissions})
+        users = get_user_model().objects.in_bulk({permission.user_id for permission in permissions})
+        roles = []
+        for permission in permissions:
+            permission.is_active = None
+            permission.user = users[permission.user_id]
+            setattr(permission, field.name, structures[getattr(permission, field.attname)])
+            roles.append((getattr(permission, field.name), permission.user, permission.role))
+
+        structure_role_bulk_revoked.send(sender=structure_model, roles=roles, removed_by=None)
+        return permissions
+
     @classmethod
     @lru_cache(maxsize=1)
     def get_all_models(cls):
@@ -196,6 +303,10 @@ class PermissionMixin(object):
             - None - check whether user has permanent role in entity.
             - Datetime object - check whether user will have role in entity at specific timestamp.
         """
+        user_permissions = get_user_permissions(user)
+        if user_permissions is not None:
+            return user_permissions.has_role(self.permissions.field, self.pk, role, timestamp)
+
         permissions = self.permissions.filter(user=user, is_active=True)
 
         if role is not None:
@@ -239,17 +350,20 @@ class PermissionMixin(object):
         if role is not None:
             permissions = permissions.filter(role=role)
 
-        affected_permissions = list(permissions)
-        permissions.update(is_active=None, expiration_time=timezone.now())
-
-        for permission in affected_permissions:
+        now = timezone.now()
+        for permission in permissions:
+            # Permissions are saved one by one, so that post_save receivers sync denormalized access.
+            permission.is_active = None
+            permission.expiration_time = now
+            permission.save(update_fields=['is_active', 'expiration_time'])
             self.log_role_revoked(permission, removed_by)
 
     @transaction.atomic()
     def remove_all_users(self):
         for permission in self.permissions.all().iterator():
             permission.delete()
-            self.log_role_revoked(permission)
+            if permission.is_active:
+                self.log_role_revoked(permission)
 
     def log_role_revoked(self, permission, removed_by=None):
         structure_role_revoked.send(
@@ -292,6 +406,10 @@ class CustomerPermission(BasePermission):
     def get_url_name(cls):
         return 'customer_permission'
 
+    @classmethod
+    def get_structure_field_name(cls):
+        return 'customer'
+
     def revoke(self):
         self.customer.remove_user(self.user, self.role)
 
@@ -308,7 +426,7 @@ def get_next_agreement_number():
 @python_2_unicode_compatible
 class Customer(core_models.UuidMixin,
                core_models.NameMixin,
-               core_models.DescendantMixin,
+               HierarchyMixin,
                quotas_models.ExtendableQuotaModelMixin,
                PermissionMixin,
                VATMixin,
@@ -494,6 +612,10 @@ class ProjectPermission(core_models.UuidMixin, BasePermission):
     def get_url_name(cls):
         return 'project_permission'
 
+    @classmethod
+    def get_structure_field_name(cls):
+        return 'project'
+
     def revoke(self):
         self.project.remove_user(self.user, self.role)
 
@@ -520,7 +642,7 @@ class ProjectType(core_models.DescribableMixin, core_models.UuidMixin, core_mode
 class Project(core_models.DescribableMixin,
               core_models.UuidMixin,
               core_models.NameMixin,
-              core_models.DescendantMixin,
+              HierarchyMixin,
               quotas_models.ExtendableQuotaModelMixin,
               PermissionMixin,
               StructureLoggableMixin,
@@ -698,6 +820,15 @@ class ServiceSettings(quotas_models.ExtendableQuotaModelMixin,
     terms_of_services = models.URLField(max_length=255, blank=True)
     certifications = models.ManyToManyField(to='ServiceCertification', related_name='service_settings', blank=True)
 
+    # Pull schedule is maintained by ServiceSettingsListPullTask.
+    pulled_at = models.DateTimeField(null=True, blank=True, editable=False,
+                                     help_text=_('Time of last successful pull from backend'))
+    pull_duration = models.FloatField(null=True, blank=True, editable=False,
+                                      help_text=_('Duration of last pull from backend in seconds'))
+    pull_failures = models.PositiveIntegerField(default=0, editable=False,
+                                                help_text=_('Number of consecutive failed pulls'))
+    next_pull_at = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
+
     tracker = FieldTracker()
 
     # service settings scope - VM that contains service
@@ -764,7 +895,7 @@ class PrivateServiceSettings(ServiceSettings):
 
 @python_2_unicode_compatible
 class Service(core_models.UuidMixin,
-              core_models.DescendantMixin,
+              HierarchyMixin,
               quotas_models.QuotaModelMixin,
               LoggableMixin,
               StructureModel):
@@ -883,7 +1014,7 @@ class GeneralServiceProperty(BaseServiceProperty):
 
 @python_2_unicode_compatible
 class ServiceProjectLink(quotas_models.QuotaModelMixin,
-                         core_models.DescendantMixin,
+                         HierarchyMixin,
                          LoggableMixin,
                          StructureModel):
     """ Base service-project link class. See Service class for usage example. """
@@ -995,7 +1126,7 @@ class ResourceMixin(MonitoringModelMixin,
                     core_models.UuidMixin,
                     core_models.DescribableMixin,
                     core_models.NameMixin,
-                    core_models.DescendantMixin,
+                    HierarchyMixin,
                     core_models.BackendModelMixin,
                     LoggableMixin,
                     TagMixin,
@@ -1137,7 +1268,7 @@ class VirtualMachine(CoordinatesMixin, core_models.RuntimeStateMixin, NewResourc
 
     def detect_coordinates(self):
         if self.external_ips:
-            return get_coordinates_by_ip(self.external_ips)
+            return geoip.get_coordinates_by_ip(self.external_ips[0])
 
     def get_access_url(self):
         if self.external_ips:
@@ -1208,3 +1339,898 @@ class SubResource(NewResource):
     @lru_cache(maxsize=1)
     def get_all_models(cls):
         return [model for model in apps.get_models() if issubclass(model, cls)]
+
+
+@python_2_unicode_compatible
+class RuntimeStatePoll(models.Model):
+    """ Instance that is waiting until backend reports success or erred runtime state.
+
+        All waiting instances of the same service settings are polled together
+        by RuntimeStatePollerTask. Celery callbacks of the registering task are stored
+        in order to be applied when polling is completed.
+    """
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField()
+    scope = GenericForeignKey('content_type', 'object_id')
+    service_settings = models.ForeignKey(ServiceSettings, related_name='+')
+    backend_pull_method = models.CharField(max_length=255)
+    success_state = models.CharField(max_length=150)
+    erred_state = models.CharField(max_length=150)
+    task_id = models.CharField(max_length=255)
+    callbacks = JSONField(default=list, blank=True)
+    errbacks = JSONField(default=list, blank=True)
+    chain = JSONField(default=list, blank=True)
+    created = AutoCreatedField()
+    deadline = models.DateTimeField()
+
+    def __str__(self):
+        return '%s:%s | %s' % (self.content_type, self.object_id, self.backend_pull_method)
+
+
+@python_2_unicode_compatible
+class UserScopeAccess(models.Model):
+    """ Denormalized active customer and project roles of users.
+
+        Customer role is stored with empty project, project role is stored
+        together with customer of the project. Table is maintained by signal handlers
+        and allows to filter structure objects for user without joining permissions.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+')
+    customer = models.ForeignKey(Customer, related_name='+')
+    project = models.ForeignKey(Project, related_name='+', null=True, blank=True)
+    role = models.CharField(max_length=30)
+
+    class Meta(object):
+        unique_together = ('user', 'project', 'customer', 'role')
+
+    def __str__(self):
+        return '%s | %s | %s' % (self.user, self.project or self.customer, self.role)
+
+    @classmethod
+    def get_actual_rows(cls, user=None, customer=None, project=None, user_ids=None):
+        """ Return set of (user_id, customer_id, project_id, role) tuples computed from active permissions """
+        customer_permissions = CustomerPermission.objects.filter(is_active=True)
+        project_permissions = ProjectPermission.objects.filter(is_active=True)
+        if user is not None:
+            customer_permissions = customer_permissions.filter(user=user)
+            project_permissions = project_permissions.filter(user=user)
+        if user_ids is not None:
+            customer_permissions = customer_permissions.filter(user_id__in=user_ids)
+            project_permissions = project_permissions.filter(user_id__in=user_ids)
+        if customer is not None:
+            customer_permissions = customer_permissions.filter(customer=customer)
+            project_permissions = project_permissions.none()
+        if project is not None:
+            customer_permissions = customer_permissions.none()
+            project_permissions = project_permissions.filter(project=project)
+
+        rows = set()
+        for user_id, customer_id, role in customer_permissions.values_list('user_id', 'customer_id', 'role'):
+            rows.add((user_id, customer_id, None, role))
+        for user_id, customer_id, project_id, role in project_permissions.values_list(
+                'user_id', 'project__customer', 'project_id', 'role'):
+            rows.add((user_id, customer_id, project_id, role))
+        return rows
+
+    @classmethod
+    def get_stored_rows(cls, user=None, customer=None, project=None):
+        """ Return set of (user_id, customer_id, project_id, role) tuples that are stored in the table """
+        queryset = cls.objects.all()
+        if user is not None:
+            queryset = queryset.filter(user=user)
+        if customer is not None:
+            queryset = queryset.filter(customer=customer, project=None)
+        if project is not None:
+            queryset = queryset.filter(project=project)
+        return set(queryset.values_list('user_id', 'customer_id', 'project_id', 'role'))
+
+    @classmethod
+    @transaction.atomic()
+    def sync(cls, user=None, customer=None, project=None):
+        """ Update stored rows so that they match active permissions.
+            Returns tuple of created and deleted rows count.
+        """
+        actual_rows = cls.get_actual_rows(user, customer, project)
+        stored_rows = cls.get_stored_rows(user, customer, project)
+
+        stale_rows = stored_rows - actual_rows
+        for user_id, customer_id, project_id, role in stale_rows:
+            cls.objects.filter(user_id=user_id, customer_id=customer_id, project_id=project_id, role=role).delete()
+
+        missing_rows = actual_rows - stored_rows
+        cls.objects.bulk_create([
+            cls(user_id=user_id, customer_id=customer_id, project_id=project_id, role=role)
+            for user_id, customer_id, project_id, role in missing_rows
+        ])
+        return len(missing_rows), len(stale_rows)
+
+    @classmethod
+    @transaction.atomic()
+    def delete_stale_rows(cls, rows):
+        """ Delete given (user_id, customer_id, project_id, role) rows unless they are backed by active permissions.
+            It is used after roles are revoked in bulk. Returns deleted rows count.
+        """
+        user_ids = {row[0] for row in rows}
+        stale_rows = set(rows) - cls.get_actual_rows(user_ids=user_ids)
+        stored_rows = cls.objects.filter(user_id__in=user_ids).values_list(
+            'pk', 'user_id', 'customer_id', 'project_id', 'role')
+        stale_ids = [row[0] for row in stored_rows if row[1:] in stale_rows]
+        cls.objects.filter(pk__in=stale_ids).delete()
+        return len(stale_ids)
+
+    @classmethod
+    def get_customers_subquery(cls, user):
+        """ Customers where user has customer role """
+        return cls.objects.filter(user=user, project=None).values('customer_id')
+
+    @classmethod
+    def get_projects_subquery(cls, user):
+        """ Projects where user has project role """
+        return cls.objects.filter(user=user, project__isnull=False).values('project_id')
+
+    @classmethod
+    def get_fingerprint(cls, user):
+        """ Return string that is the same for all users that can see the same structure objects """
+        if user.is_staff or user.is_support:
+            return 'all'
+        rows = cls.objects.filter(user=user).order_by('customer_id', 'project_id').values_list(
+            'customer_id', 'project_id').distinct()
+        return hashlib.md5(';'.join('%s:%s' % row for row in rows).encode('utf-8')).hexdigest()
+
+
+@python_2_unicode_compatible
+class CustomerMembership(models.Model):
+    """ Number of active roles of user in customer and its projects.
+
+        Row exists only while user has at least one role, so number of rows
+        of customer is equal to its nc_user_count quota usage. Table is updated
+        by role signal handlers in the same transaction as permission.
+    """
+    customer = models.ForeignKey(Customer, related_name='+')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta(object):
+        unique_together = ('customer', 'user')
+
+    def __str__(self):
+        return '%s | %s | %s' % (self.customer, self.user, self.count)
+
+    @classmethod
+    def increase(cls, customer, user):
+        """ Register new role of user. Returns True if user has become member of customer. """
+        memberships = cls.objects.filter(customer=customer, user=user)
+        if memberships.update(count=models.F('count') + 1):
+            return False
+        membership, created = cls.objects.get_or_create(customer=customer, user=user, defaults={'count': 1})
+        if not created:
+            memberships.update(count=models.F('count') + 1)
+        return created
+
+    @classmethod
+    def decrease(cls, customer, user):
+        """ Unregister role of user. Returns True if user is not member of customer anymore. """
+        memberships = cls.objects.filter(customer=customer, user=user)
+        if memberships.filter(count__gt=1).update(count=models.F('count') - 1):
+            return False
+        deleted, _ = memberships.delete()
+        return bool(deleted)
+
+    @classmethod
+    @transaction.atomic()
+    def decrease_in_bulk(cls, counts):
+        """ Unregister roles of users in bulk. Counts map (customer_id, user_id) pairs to number of revoked roles.
+            Returns counter of users which are not members anymore by customer ID.
+        """
+        customer_ids = {pair[0] for pair in counts}
+        user_ids = {pair[1] for pair in counts}
+        memberships = [membership for membership in cls.objects.filter(
+            customer_id__in=customer_ids, user_id__in=user_ids).select_for_update()
+            if (membership.customer_id, membership.user_id) in counts]
+
+        removed = []
+        decreased = collections.defaultdict(list)
+        for membership in memberships:
+            delta = counts[(membership.customer_id, membership.user_id)]
+            if membership.count > delta:
+                decreased[delta].append(membership.pk)
+            else:
+                removed.append(membership)
+
+        cls.objects.filter(pk__in=[membership.pk for membership in removed]).delete()
+        for delta, membership_ids in decreased.items():
+            cls.objects.filter(pk__in=membership_ids).update(count=models.F('count') - delta)
+        return collections.Counter(membership.customer_id for membership in removed)
+
+    @classmethod
+    @transaction.atomic()
+    def rebuild(cls, customer):
+        """ Recalculate memberships of customer from active permissions. Returns number of members. """
+        counts = collections.Counter()
+        for user_id in CustomerPermission.objects.filter(customer=customer, is_active=True).values_list(
+                'user_id', flat=True):
+            counts[user_id] += 1
+        for user_id in ProjectPermission.objects.filter(project__customer=customer, is_active=True).values_list(
+                'user_id', flat=True):
+            counts[user_id] += 1
+
+        cls.objects.filter(customer=customer).delete()
+        cls.objects.bulk_create([
+            cls(customer=customer, user_id=user_id, count=count) for user_id, count in counts.items()
+        ])
+        return len(counts)
+
+
+@python_2_unicode_compatible
+class ResourceIndex(models.Model):
+    """ Denormalized searchable fields of resources of all types.
+
+        Allows to search resources of all plugins using single table.
+        Name is stored in lower case in order to use index for case-insensitive prefix search.
+        IP addresses are stored in separate table and tags are looked up in TagIndex,
+        so that each search condition is served by B-tree index.
+    """
+    class Permissions(object):
+        customer_path = 'customer'
+        project_path = 'project'
+
+    content_type = models.ForeignKey(ContentType, related_name='+')
+    object_id = models.PositiveIntegerField()
+    scope = GenericForeignKey('content_type', 'object_id')
+    uuid = models.CharField(max_length=32, db_index=True)
+    name = models.CharField(max_length=150, db_index=True)
+    backend_id = models.CharField(max_length=255, db_index=True, blank=True)
+    state = models.IntegerField(null=True)
+    project = models.ForeignKey(Project, related_name='+')
+    customer = models.ForeignKey(Customer, related_name='+')
+    service_settings = models.ForeignKey(ServiceSettings, related_name='+')
+    created = models.DateTimeField(db_index=True)
+
+    class Meta(object):
+        unique_together = ('content_type', 'object_id')
+
+    def __str__(self):
+        return '%s | %s' % (self.content_type, self.name)
+
+    @classmethod
+    def get_fields(cls, resource):
+        """ Return values of index fields for given resource """
+        project_id, customer_id, settings_id = resource.service_project_link._meta.model.objects.filter(
+            pk=resource.service_project_link_id,
+        ).values_list('project_id', 'project__customer', 'service__settings').get()
+
+        return dict(
+            uuid=resource.uuid.hex,
+            name=resource.name.lower(),
+            backend_id=resource.backend_id,
+            state=getattr(resource, 'state', None),
+            project_id=project_id,
+            customer_id=customer_id,
+            service_settings_id=settings_id,
+            created=resource.created,
+        )
+
+    @classmethod
+    def get_ip_addresses(cls, resource):
+        if not isinstance(resource, VirtualMachine):
+            return set()
+        return set(resource.external_ips or []) | set(resource.internal_ips or [])
+
+    # Fields of resource that are copied to index, IP addresses are computed.
+    SOURCE_FIELDS = {'name', 'backend_id', 'state', 'service_project_link', 'service_project_link_id'}
+
+    @classmethod
+    def update_resource(cls, resource, update_fields=None):
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            # IP addresses of virtual machine may be computed from any field, except of state.
+            if not isinstance(resource, VirtualMachine):
+                update_fields &= cls.SOURCE_FIELDS
+                if not update_fields:
+                    return
+            if update_fields == {'state'}:
+                cls.objects.filter(
+                    content_type=ContentType.objects.get_for_model(resource),
+                    object_id=resource.pk,
+                ).update(state=resource.state)
+                return
+
+        index, _ = cls.objects.update_or_create(
+            content_type=ContentType.objects.get_for_model(resource),
+            object_id=resource.pk,
+            defaults=cls.get_fields(resource),
+        )
+        if isinstance(resource, VirtualMachine):
+            index.set_ip_addresses(cls.get_ip_addresses(resource))
+
+    def set_ip_addresses(self, ip_addresses):
+        current = set(self.addresses.values_list('ip_address', flat=True))
+        if current == ip_addresses:
+            return
+        self.addresses.exclude(ip_address__in=ip_addresses).delete()
+        ResourceIndexAddress.objects.bulk_create([
+            ResourceIndexAddress(index=self, ip_address=ip_address) for ip_address in ip_addresses - current])
+
+    @classmethod
+    def delete_resource(cls, resource):
+        cls.objects.filter(
+            content_type=ContentType.objects.get_for_model(resource),
+            object_id=resource.pk,
+        ).delete()
+
+    @classmethod
+    @transaction.atomic()
+    def rebuild(cls, batch_size=500):
+        """ Recreate index for all resources. Returns number of indexed resources. """
+        ResourceIndexAddress.objects.all().delete()
+        cls.objects.all().delete()
+        count = 0
+        for model in ResourceMixin.get_all_models():
+            content_type = ContentType.objects.get_for_model(model)
+            rows = []
+            ip_addresses = {}
+            for resource in model.objects.all():
+                rows.append(cls(content_type=content_type, object_id=resource.pk, **cls.get_fields(resource)))
+                ip_addresses[resource.pk] = cls.get_ip_addresses(resource)
+            cls.objects.bulk_create(rows, batch_size=batch_size)
+            count += len(rows)
+
+            if any(ip_addresses.values()):
+                index_ids = dict(cls.objects.filter(content_type=content_type).values_list('object_id', 'pk'))
+                ResourceIndexAddress.objects.bulk_create([
+                    ResourceIndexAddress(index_id=index_ids[object_id], ip_address=ip_address)
+                    for object_id, addresses in ip_addresses.items()
+                    for ip_address in addresses
+                ], batch_size=batch_size)
+        return count
+
+    @classmethod
+    def search(cls, query):
+        """ Filter index by prefix of name, backend ID or IP address or by exact tag.
+
+            Matching IP addresses and tags are fetched from their tables first, so that
+            index is filtered only by indexed columns instead of scanning text of all rows.
+        """
+        query = query.strip()
+        condition = Q(name__startswith=query.lower()) | Q(backend_id__startswith=query)
+
+        index_ids = set(ResourceIndexAddress.objects.filter(
+            ip_address__startswith=query).values_list('index_id', flat=True))
+        if index_ids:
+            condition |= Q(pk__in=index_ids)
+
+        tagged = collections.defaultdict(set)
+        for content_type_id, object_id in TagIndex.objects.filter(
+                name=query.lower()).values_list('content_type_id', 'object_id'):
+            tagged[content_type_id].add(object_id)
+        for content_type_id, object_ids in tagged.items():
+            condition |= Q(content_type_id=content_type_id, object_id__in=object_ids)
+
+        return cls.objects.filter(condition)
+
+
+@python_2_unicode_compatible
+class ResourceIndexAddress(models.Model):
+    """ IP address of indexed resource, each address is stored in separate row for prefix search. """
+    index = models.ForeignKey(ResourceIndex, related_name='addresses', on_delete=models.CASCADE)
+    ip_address = models.CharField(max_length=255, db_index=True)
+
+    def __str__(self):
+        return self.ip_address
+
+
+@python_2_unicode_compatible
+class TagIndex(models.Model):
+    """ Normalized tags of tagged objects of all models.
+
+        Tag is stored in lower case and split to key and value by the first colon,
+        for example tag "license-os:centos7" has key "license-os" and value "centos7".
+        Exact and prefix filters by tags are served by B-tree indexes of this table
+        and objects matching several tags are found using single scan grouped by object.
+        Table is maintained by signal handlers.
+    """
+    class Match(object):
+        EXACT = 'exact'
+        PREFIX = 'prefix'
+        SUBSTRING = 'substring'
+
+        CHOICES = (EXACT, PREFIX, SUBSTRING)
+
+    tagged_item = models.OneToOneField(TaggedItem, related_name='+', on_delete=models.CASCADE)
+    content_type = models.ForeignKey(ContentType, related_name='+')
+    object_id = models.PositiveIntegerField()
+    name = models.CharField(max_length=100, db_index=True)
+    key = models.CharField(max_length=100)
+    value = models.CharField(max_length=100, blank=True, db_index=True)
+
+    class Meta(object):
+        index_together = ('content_type', 'key', 'value')
+
+    def __str__(self):
+        return '%s | %s' % (self.content_type, self.name)
+
+    @staticmethod
+    def get_fields(name):
+        """ Return normalized name, key and value of tag """
+        name = name.lower()
+        key, value = name.partition(':')[::2]
+        return dict(name=name, key=key, value=value)
+
+    @classmethod
+    def add_tagged_item(cls, tagged_item):
+        cls.objects.update_or_create(
+            tagged_item=tagged_item,
+            defaults=dict(content_type_id=tagged_item.content_type_id, object_id=tagged_item.object_id,
+                          **cls.get_fields(tagged_item.tag.name)),
+        )
+
+    @classmethod
+    def update_tag(cls, tag):
+        cls.objects.filter(tagged_item__tag=tag).update(**cls.get_fields(tag.name))
+
+    @classmethod
+    @transaction.atomic()
+    def rebuild(cls, batch_size=500):
+        """ Recreate index for all tagged items. Returns number of indexed items. """
+        cls.objects.all().delete()
+        rows = TaggedItem.objects.values_list('pk', 'content_type_id', 'object_id', 'tag__name')
+        items = [cls(tagged_item_id=pk, content_type_id=content_type_id, object_id=object_id, **cls.get_fields(name))
+                 for pk, content_type_id, object_id, name in rows.iterator()]
+        cls.objects.bulk_create(items, batch_size=batch_size)
+        return len(items)
+
+    @classmethod
+    def get_condition(cls, key, value, match=Match.EXACT):
+        """ Return condition for tags with given key and value.
+
+            Exact and prefix match compare key exactly and value exactly or by prefix.
+            Substring match finds tags that start with key and contain value, it can not use indexes.
+        """
+        key, value = key.lower(), value.lower()
+        if match == cls.Match.PREFIX:
+            return Q(key=key, value__startswith=value)
+        elif match == cls.Match.SUBSTRING:
+            return Q(name__startswith=key, name__contains=value)
+        return Q(key=key, value=value)
+
+    @classmethod
+    def get_object_ids(cls, model, conditions, require_all=True):
+        """ Return queryset with IDs of objects of model that have tags matching all or any of conditions """
+        queryset = cls.objects.filter(
+            reduce(operator.or_, conditions),
+            content_type=ContentType.objects.get_for_model(model),
+        )
+        if require_all and len(conditions) > 1:
+            matches = {
+                'match_%s' % index: models.Max(models.Case(
+                    models.When(condition, then=models.Value(1)),
+                    default=models.Value(0),
+                    output_field=models.IntegerField(),
+                ))
+                for index, condition in enumerate(conditions)
+            }
+            queryset = queryset.values('object_id').annotate(**matches).filter(**{name: 1 for name in matches})
+        return queryset.values('object_id')
+
+
+@python_2_unicode_compatible
+class HierarchyPath(models.Model):
+    """ Closure table of structure hierarchy.
+
+        Row is stored for each pair of node and its ancestor in
+        customer -> project and service -> service project link -> resource hierarchy.
+        Service settings are stored as ancestors of their services.
+        Table is maintained by signal handlers and allows to get all ancestors
+        or descendants of node using single query.
+    """
+    ancestor_content_type = models.ForeignKey(ContentType, related_name='+')
+    ancestor_id = models.PositiveIntegerField()
+    descendant_content_type = models.ForeignKey(ContentType, related_name='+')
+    descendant_id = models.PositiveIntegerField()
+    depth = models.PositiveSmallIntegerField()
+
+    class Meta(object):
+        unique_together = ('ancestor_content_type', 'ancestor_id', 'descendant_content_type', 'descendant_id')
+        index_together = ('descendant_content_type', 'descendant_id')
+
+    def __str__(self):
+        return '%s-%s | %s-%s | %s' % (self.ancestor_content_type_id, self.ancestor_id,
+                                       self.descendant_content_type_id, self.descendant_id, self.depth)
+
+    @classmethod
+    @lru_cache(maxsize=1)
+    def get_parent_fields(cls):
+        """ Map models of hierarchy nodes to names of foreign keys to their parents. Parents go before children. """
+        parent_fields = collections.OrderedDict([
+            (Customer, ()),
+            (ServiceSettings, ()),
+            (Project, ('customer',)),
+        ])
+        for model in Service.get_all_models():
+            parent_fields[model] = ('settings', 'customer')
+        for model in ServiceProjectLink.get_all_models():
+            parent_fields[model] = ('project', 'service')
+        for model in ResourceMixin.get_all_models() + SubResource.get_all_models():
+            parent_fields[model] = ('service_project_link',)
+        return parent_fields
+
+    @classmethod
+    def get_models(cls):
+        return list(cls.get_parent_fields().keys())
+
+    @classmethod
+    def _get_node(cls, instance):
+        return ContentType.objects.get_for_model(instance).id, instance.pk
+
+    @classmethod
+    def _get_parents(cls, instance):
+        """ Return list of (content type ID, object ID) tuples of instance parents """
+        parents = []
+        for name in cls.get_parent_fields()[instance._meta.concrete_model]:
+            field = instance._meta.get_field(name)
+            parent_id = getattr(instance, field.attname)
+            if parent_id is not None:
+                parents.append((ContentType.objects.get_for_model(field.related_model).id, parent_id))
+        return parents
+
+    @classmethod
+    def _get_nodes_query(cls, prefix, nodes):
+        ids = collections.defaultdict(list)
+        for content_type_id, object_id in nodes:
+            ids[content_type_id].append(object_id)
+        return reduce(lambda x, y: x | y, [
+            Q(**{prefix + '_content_type_id': content_type_id, prefix + '_id__in': object_ids})
+            for content_type_id, object_ids in ids.items()
+        ])
+
+    @classmethod
+    def _get_ancestor_depths(cls, parents):
+        """ Return dictionary that maps ancestors of node with given parents to their depth """
+        depths = {parent: 1 for parent in parents}
+        if not parents:
+            return depths
+        rows = cls.objects.filter(cls._get_nodes_query('descendant', parents)).values_list(
+            'ancestor_content_type_id', 'ancestor_id', 'depth')
+        for content_type_id, object_id, depth in rows:
+            ancestor = (content_type_id, object_id)
+            depths[ancestor] = min(depths.get(ancestor, depth + 1), depth + 1)
+        return depths
+
+    @classmethod
+    def add_node(cls, instance):
+        """ Store paths from ancestors of new instance to it """
+        content_type_id, object_id = cls._get_node(instance)
+        depths = cls._get_ancestor_depths(cls._get_parents(instance))
+        cls.objects.bulk_create([
+            cls(ancestor_content_type_id=ancestor_content_type_id, ancestor_id=ancestor_id,
+                descendant_content_type_id=content_type_id, descendant_id=object_id, depth=depth)
+            for (ancestor_content_type_id, ancestor_id), depth in depths.items()
+        ])
+
+    @classmethod
+    def add_nodes(cls, instances, batch_size=None):
+        """ Store paths from ancestors of new instances to them using one query for all ancestors """
+        instance_parents = [(cls._get_node(instance), cls._get_parents(instance)) for instance in instances]
+        parents = {parent for _, node_parents in instance_parents for parent in node_parents}
+        parent_ancestors = collections.defaultdict(dict)
+        if parents:
+            rows = cls.objects.filter(cls._get_nodes_query('descendant', parents)).values_list(
+                'descendant_content_type_id', 'descendant_id', 'ancestor_content_type_id', 'ancestor_id', 'depth')
+            for descendant_content_type_id, descendant_id, ancestor_content_type_id, ancestor_id, depth in rows:
+                parent_ancestors[(descendant_content_type_id, descendant_id)][
+                    (ancestor_content_type_id, ancestor_id)] = depth
+
+        paths = []
+        for (content_type_id, object_id), node_parents in instance_parents:
+            depths = {parent: 1 for parent in node_parents}
+            for parent in node_parents:
+                for ancestor, depth in parent_ancestors[parent].items():
+                    depths[ancestor] = min(depths.get(ancestor, depth + 1), depth + 1)
+            paths.extend(
+                cls(ancestor_content_type_id=ancestor_content_type_id, ancestor_id=ancestor_id,
+                    descendant_content_type_id=content_type_id, descendant_id=object_id, depth=depth)
+                for (ancestor_content_type_id, ancestor_id), depth in depths.items()
+            )
+        cls.objects.bulk_create(paths, batch_size=batch_size)
+
+    @classmethod
+    def has_node(cls, instance):
+        """ Return True if paths from or to instance are stored """
+        content_type_id, object_id = cls._get_node(instance)
+        return cls.objects.filter(
+            Q(ancestor_content_type_id=content_type_id, ancestor_id=object_id) |
+            Q(descendant_content_type_id=content_type_id, descendant_id=object_id)
+        ).exists()
+
+    @classmethod
+    def remember_parents(cls, instance):
+        """ Store parents of instance loaded from database, so that their change is detected without query """
+        names = cls.get_parent_fields().get(instance._meta.concrete_model)
+        deferred = instance.get_deferred_fields()
+        if names and not any(instance._meta.get_field(name).attname in deferred for name in names):
+            instance._hierarchy_parents = set(cls._get_parents(instance))
+
+    @classmethod
+    def has_parents_changed(cls, instance, update_fields=None):
+        names = cls.get_parent_fields()[instance._meta.concrete_model]
+        if not names:
+            return False
+        attnames = [instance._meta.get_field(name).attname for name in names]
+        if update_fields is not None and not set(update_fields) & set(names + tuple(attnames)):
+            return False
+        tracker = getattr(instance, 'tracker', None)
+        if tracker is not None and set(attnames) <= set(tracker.fields):
+            return any(tracker.has_changed(attname) for attname in attnames)
+        loaded_parents = getattr(instance, '_hierarchy_parents', None)
+        if loaded_parents is not None:
+            return loaded_parents != set(cls._get_parents(instance))
+        content_type_id, object_id = cls._get_node(instance)
+        stored_parents = cls.objects.filter(
+            descendant_content_type_id=content_type_id, descendant_id=object_id, depth=1).values_list(
+            'ancestor_content_type_id', 'ancestor_id')
+        return set(stored_parents) != set(cls._get_parents(instance))
+
+    @classmethod
+    @transaction.atomic()
+    def move_node(cls, instance):
+        """ Update paths to instance and its descendants after instance parents have been changed.
+
+            Descendants could have parents outside of moved subtree, for example resource is connected
+            to project and to service, so their paths are recalculated from their parents starting from instance.
+        """
+        node = cls._get_node(instance)
+        rows = cls.objects.filter(ancestor_content_type_id=node[0], ancestor_id=node[1]).order_by('depth').values_list(
+            'descendant_content_type_id', 'descendant_id')
+        subtree = [node] + list(rows)
+        members = [instance] + cls._get_objects(subtree[1:])
+
+        cls.objects.filter(cls._get_nodes_query('descendant', subtree)).exclude(
+            cls._get_nodes_query('ancestor', subtree)).delete()
+
+        ancestors = {}
+        paths = []
+        subtree_nodes = set(subtree)
+        for member in members:
+            member_node = cls._get_node(member)
+            depths = {}
+            for parent in cls._get_parents(member):
+                if parent in ancestors:
+                    parent_depths = {parent: 1}
+                    parent_depths.update({a: d + 1 for a, d in ancestors[parent].items()})
+                else:
+                    parent_depths = cls._get_ancestor_depths([parent])
+                for ancestor, depth in parent_depths.items():
+                    depths[ancestor] = min(depths.get(ancestor, depth), depth)
+            ancestors[member_node] = depths
+            paths.extend(
+                cls(ancestor_content_type_id=ancestor[0], ancestor_id=ancestor[1],
+                    descendant_content_type_id=member_node[0], descendant_id=member_node[1], depth=depth)
+                for ancestor, depth in depths.items() if ancestor not in subtree_nodes
+            )
+        cls.objects.bulk_create(paths)
+
+    @classmethod
+    def delete_node(cls, instance):
+        content_type_id, object_id = cls._get_node(instance)
+        cls.objects.filter(
+            Q(ancestor_content_type_id=content_type_id, ancestor_id=object_id) |
+            Q(descendant_content_type_id=content_type_id, descendant_id=object_id)
+        ).delete()
+
+    @classmethod
+    def _get_objects(cls, nodes):
+        """ Fetch objects for list of (content type ID, object ID) tuples using one query per model """
+        ids = collections.OrderedDict()
+        for content_type_id, object_id in nodes:
+            ids.setdefault(content_type_id, []).append(object_id)
+        instances = {}
+        for content_type_id, object_ids in ids.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            for instance in model.objects.filter(pk__in=object_ids):
+                instances[(content_type_id, instance.pk)] = instance
+        return [instances[node] for node in nodes if node in instances]
+
+    @classmethod
+    def get_ancestors(cls, instance):
+        """ Return ancestors of instance ordered from the nearest one """
+        content_type_id, object_id = cls._get_node(instance)
+        rows = cls.objects.filter(descendant_content_type_id=content_type_id, descendant_id=object_id).order_by(
+            'depth', 'ancestor_content_type_id', 'ancestor_id').values_list('ancestor_content_type_id', 'ancestor_id')
+        return cls._get_objects(list(rows))
+
+    @classmethod
+    def get_descendants(cls, instance, model=None):
+        """ Return descendants of instance ordered from the nearest one.
+            If model is specified only descendants that are instances of it are returned.
+        """
+        content_type_id, object_id = cls._get_node(instance)
+        rows = cls.objects.filter(ancestor_content_type_id=content_type_id, ancestor_id=object_id)
+        if model is not None:
+            descendant_models = [m for m in cls.get_models() if issubclass(m, model)]
+            content_types = ContentType.objects.get_for_models(*descendant_models).values()
+            rows = rows.filter(descendant_content_type__in=content_types)
+        rows = rows.order_by('depth', 'descendant_content_type_id', 'descendant_id').values_list(
+            'descendant_content_type_id', 'descendant_id')
+        return cls._get_objects(list(rows))
+
+    @classmethod
+    def get_actual_rows(cls, node_models=None):
+        """ Return set of (ancestor content type ID, ancestor ID, descendant content type ID, descendant ID, depth)
+            tuples computed from foreign keys of hierarchy models.
+        """
+        ancestors = {}
+        rows = set()
+        for model, names in cls.get_parent_fields().items():
+            if node_models is not None and model not in node_models:
+                continue
+            content_type_id = ContentType.objects.get_for_model(model).id
+            fields = [model._meta.get_field(name) for name in names]
+            parent_content_types = [ContentType.objects.get_for_model(field.related_model).id for field in fields]
+            for values in model.objects.values_list('pk', *[field.attname for field in fields]).iterator():
+                node = (content_type_id, values[0])
+                depths = {}
+                for parent_content_type_id, parent_id in zip(parent_content_types, values[1:]):
+                    if parent_id is None:
+                        continue
+                    parent = (parent_content_type_id, parent_id)
+                    depths[parent] = 1
+                    for ancestor, depth in ancestors.get(parent, {}).items():
+                        depths[ancestor] = min(depths.get(ancestor, depth + 1), depth + 1)
+                ancestors[node] = depths
+                rows.update(node_ancestor + node + (depth,) for node_ancestor, depth in depths.items())
+        return rows
+
+    @classmethod
+    def get_stored_rows(cls):
+        return set(cls.objects.values_list(
+            'ancestor_content_type_id', 'ancestor_id', 'descendant_content_type_id', 'descendant_id', 'depth'))
+
+    @classmethod
+    @transaction.atomic()
+    def rebuild(cls, node_models=None, batch_size=1000):
+        """ Recreate paths for all nodes of hierarchy. Returns number of stored paths. """
+        rows = cls.get_actual_rows(node_models)
+        cls.objects.all().delete()
+        cls.objects.bulk_create([
+            cls(ancestor_content_type_id=ancestor_content_type_id, ancestor_id=ancestor_id,
+                descendant_content_type_id=descendant_content_type_id, descendant_id=descendant_id, depth=depth)
+            for ancestor_content_type_id, ancestor_id, descendant_content_type_id, descendant_id, depth in rows
+        ], batch_size=batch_size)
+        return len(rows)
+
+
+@python_2_unicode_compatible
+class QuotaTimelineRollup(models.Model):
+    """ Snapshot of service project links quotas aggregated by project or customer.
+
+        Snapshots are created every hour by create_quota_timeline_rollups task.
+        Each snapshot is marked with the coarsest interval its date is aligned to,
+        so daily, weekly and monthly timelines are built from midnight snapshots
+        and hourly snapshots could be cleaned up earlier.
+    """
+    class Intervals(object):
+        HOUR = 'hour'
+        DAY = 'day'
+        WEEK = 'week'
+        MONTH = 'month'
+
+        CHOICES = ((HOUR, 'hour'), (DAY, 'day'), (WEEK, 'week'), (MONTH, 'month'))
+
+    content_type = models.ForeignKey(ContentType, related_name='+')
+    object_id = models.PositiveIntegerField()
+    scope = GenericForeignKey('content_type', 'object_id')
+    interval = models.CharField(max_length=5, choices=Intervals.CHOICES)
+    date = models.DateTimeField()
+    name = models.CharField(max_length=150)
+    limit = models.FloatField()
+    usage = models.FloatField()
+
+    class Meta(object):
+        unique_together = ('content_type', 'object_id', 'name', 'date')
+        index_together = ('date', 'interval')
+
+    def __str__(self):
+        return '%s | %s | %s' % (self.scope, self.name, self.date)
+
+    @classmethod
+    def get_interval(cls, date):
+        """ Return the coarsest interval that date is aligned to """
+        if (date.hour, date.minute, date.second, date.microsecond) != (0, 0, 0, 0):
+            return cls.Intervals.HOUR
+        if date.day == 1:
+            return cls.Intervals.MONTH
+        if date.weekday() == 0:
+            return cls.Intervals.WEEK
+        return cls.Intervals.DAY
+
+    @classmethod
+    def get_quota_scope_models(cls):
+        """ Return list of (model, path to project) tuples of timeline quotas scopes """
+        scope_models = []
+        for model in ServiceProjectLink.get_all_models():
+            # XXX: quick and dirty hack for OpenStack: use tenants instead of SPLs as quotas scope.
+            if model.__name__ == 'OpenStackServiceProjectLink':
+                scope_models.append((model.tenants.field.model, 'service_project_link__project'))
+            else:
+                scope_models.append((model, 'project'))
+        return scope_models
+
+    @classmethod
+    def aggregate_quotas(cls, projects=None, names=None, values=None):
+        """ Return dictionary that maps (model, object ID, quota name) tuples to (limit, usage) tuples
+            summed for quotas scopes of project or customer. Limit is -1 if any of summed limits is -1.
+
+            If values dictionary is specified, it maps quota ID to (limit, usage) tuple that is used
+            instead of current quota values. Quotas that are missing in it are skipped.
+        """
+        result = {}
+        for model, project_path in cls.get_quota_scope_models():
+            scopes = model.objects.all()
+            if projects is not None:
+                scopes = scopes.filter(**{project_path + '__in': projects})
+            scope_projects = {pk: (project_id, customer_id) for pk, project_id, customer_id in
+                              scopes.values_list('pk', project_path, project_path + '__customer')}
+            if not scope_projects:
+                continue
+            quotas = quotas_models.Quota.objects.filter(
+                content_type=ContentType.objects.get_for_model(model), object_id__in=scopes.values('pk'))
+            if names is not None:
+                quotas = quotas.filter(name__in=names)
+            rows = quotas.values_list('pk', 'object_id', 'name', 'limit', 'usage')
+            for quota_id, object_id, name, limit, usage in rows:
+                if object_id not in scope_projects:
+                    continue
+                if values is not None:
+                    if quota_id not in values:
+                        continue
+                    limit, usage = values[quota_id]
+                project_id, customer_id = scope_projects[object_id]
+                for key in ((Project, project_id, name), (Customer, customer_id, name)):
+                    total_limit, total_usage = result.get(key, (0, 0))
+                    if limit == -1 or total_limit == -1:
+                        total_limit = -1
+                    else:
+                        total_limit += limit
+                    result[key] = (total_limit, total_usage + usage)
+        return result
+
+    @classmethod
+    def iterate_history_values(cls, dates, names=None):
+        """ Yield (date, values) tuples for ascending dates, where values are restored from quotas history
+            in format of aggregate_quotas values. Values dictionary is updated in place between iterations.
+        """
+        versions = Version.objects.get_for_model(quotas_models.Quota).select_related('revision').filter(
+            revision__date_created__lte=dates[-1]).order_by('revision__date_created').iterator()
+        quota_ids = None
+        if names is not None:
+            quota_ids = set(quotas_models.Quota.objects.filter(name__in=names).values_list('pk', flat=True))
+        version = next(versions, None)
+        values = {}
+        for date in dates:
+            while version is not None and version.revision.date_created <= date:
+                if quota_ids is None or int(version.object_id) in quota_ids:
+                    values[int(version.object_id)] = (version.field_dict['limit'], version.field_dict['usage'])
+                version = next(versions, None)
+            yield date, values
+
+    @classmethod
+    @transaction.atomic()
+    def create_snapshots(cls, date, values=None, batch_size=1000):
+        """ Store quotas of all projects and customers as snapshot for given date.
+            By default current quotas are stored, check aggregate_quotas for values format.
+        """
+        interval = cls.get_interval(date)
+        content_types = ContentType.objects.get_for_models(Project, Customer)
+        cls.objects.filter(date=date).delete()
+        cls.objects.bulk_create([
+            cls(content_type=content_types[model], object_id=object_id, name=name,
+                interval=interval, date=date, limit=limit, usage=usage)
+            for (model, object_id, name), (limit, usage) in cls.aggregate_quotas(values=values).items()
+        ], batch_size=batch_size)
+
+    @classmethod
+    def cleanup(cls):
+        """ Delete snapshots that are older than retention period of their interval """
+        for interval, retention in settings.WALDUR_CORE['QUOTA_TIMELINE_ROLLUP_RETENTION'].items():
+            if retention is not None:
+                cls.objects.filter(interval=interval, date__lt=timezone.now() - retention).delete()
@@ -7,6 +7,7 @@ import logging
 from django.conf import settings
 from django.contrib import auth
 from django.core import exceptions as django_exceptions
+from django.core.cache import cache
 from django.core.validators import RegexValidator, MaxLengthValidator
 from django.db import models as django_models, transaction
 from django.db.models import Q
@@ -18,8 +19,8 @@ from rest_framework import exceptions, serializers
 from rest_framework.reverse import reverse
 import six
 
-from waldur_core.core import (models as core_models, fields as core_fields, serializers as core_serializers,
-                              utils as core_utils)
+from waldur_core.core import (models as core_models, fields as core_fields, managers as core_managers,
+                              serializers as core_serializers, utils as core_utils)
 from waldur_core.core.fields import MappedChoiceField
 from waldur_core.monitoring.serializers import MonitoringSerializerMixin
 from waldur_core.quotas import serializers as quotas_serializers
@@ -101,6 +102,32 @@ class PermissionListSerializer(serializers.ListSerializer):
         return super(PermissionListSerializer, self).to_representation(data)
 
 
+class TagListSerializer(serializers.ListSerializer):
+    """
+    Loads tags of all serialized objects at once instead of loading them for each object.
+    If tags of related object are serialized, path to it is specified by Meta.tagged_object_path.
+
+    In order to use it set Meta.list_serializer_class. Example:
+
+    >>> class ServiceSerializer(serializers.HyperlinkedModelSerializer):
+    >>>     class Meta(object):
+    >>>         list_serializer_class = TagListSerializer
+    >>>         tagged_object_path = 'settings'
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, django_models.Manager) else data
+        iterable = list(iterable)
+
+        path = getattr(getattr(self.child, 'Meta', None), 'tagged_object_path', None)
+        tagged_objects = iterable
+        for attr in path.split('.') if path else []:
+            tagged_objects = [getattr(obj, attr) for obj in tagged_objects if obj is not None]
+        models.TagMixin.prefetch_tags(tagged_objects)
+
+        return super(TagListSerializer, self).to_representation(iterable)
+
+
 class BasicUserSerializer(serializers.HyperlinkedModelSerializer):
     class Meta(object):
         model = User
@@ -760,23 +787,45 @@ class CreationTimeStatsSerializer(serializers.Serializer):
     segments_count = serializers.IntegerField(min_value=0)
 
     def get_stats(self, user):
-        start_datetime = core_utils.timestamp_to_datetime(self.data['start_timestamp'])
-        end_datetime = core_utils.timestamp_to_datetime(self.data['end_timestamp'])
-
-        model = self.MODEL_CLASSES[self.data['model_name']]
-        filtered_queryset = filter_queryset_for_user(model.objects.all(), user)
-        created_datetimes = (
-            filtered_queryset
-            .filter(created__gte=start_datetime, created__lte=end_datetime)
-            .values('created')
-            .annotate(count=django_models.Count('id', distinct=True)))
-
-        time_and_value_list = [
-            (core_utils.datetime_to_timestamp(dt['created']), dt['count']) for dt in created_datetimes]
-
-        return core_utils.format_time_and_value_to_segment_list(
-            time_and_value_list, self.data['segments_count'],
-            self.data['start_timestamp'], self.data['end_timestamp'])
+        cache_key = 'structure:creation_time_stats:%s:%s:%s:%s:%s' % (
+            models.UserScopeAccess.get_fingerprint(user),
+            self.data['model_name'],
+            self.data['start_timestamp'],
+            self.data['end_timestamp'],
+            self.data['segments_count'],
+        )
+        stats = cache.get(cache_key)
+        if stats is None:
+            stats = self._get_stats(user)
+            timeout = settings.WALDUR_CORE['CREATION_TIME_STATS_CACHE_TIMEOUT'].total_seconds()
+            cache.set(cache_key, stats, timeout)
+        return stats
+
+    def _get_stats(self, user):
+        start_timestamp = self.data['start_timestamp']
+        end_timestamp = self.data['end_timestamp']
+        segments_count = self.data['segments_count']
+        if not segments_count:
+            return []
+        time_step = (end_timestamp - start_timestamp) / segments_count
+
+        segment_values = {}
+        if time_step > 0:
+            model = self.MODEL_CLASSES[self.data['model_name']]
+            filtered_queryset = filter_queryset_for_user(model.objects.all(), user)
+            rows = (
+                filtered_queryset
+                .filter(created__gte=core_utils.timestamp_to_datetime(start_timestamp),
+                        created__lte=core_utils.timestamp_to_datetime(end_timestamp))
+                .annotate(segment=core_managers.TimeSegmentIndex('created', start_timestamp, time_step))
+                .order_by()
+                .values('segment')
+                .annotate(count=django_models.Count('id', distinct=True))
+                .values_list('segment', 'count'))
+            segment_values = {int(segment): count for segment, count in rows}
+
+        return core_utils.format_segment_values_to_segment_list(
+            segment_values, segments_count, start_timestamp, end_timestamp)
 
 
 class PasswordSerializer(serializers.Serializer):
@@ -1025,6 +1074,8 @@ class BaseServiceSerializer(six.with_metaclass(ServiceSerializerMetaclass,
             'certifications', 'geolocations', 'available_for_all', 'scope', 'tags', 'quotas',
         )
         settings_fields = ('backend_url', 'username', 'password', 'token', 'certificate', 'scope', 'domain')
+        list_serializer_class = TagListSerializer
+        tagged_object_path = 'settings'
         protected_fields = ('customer', 'settings', 'project') + settings_fields
         related_paths = ('customer', 'settings')
         extra_kwargs = {
@@ -1430,6 +1481,7 @@ class BaseResourceSerializer(six.with_metaclass(ResourceSerializerMetaclass,
         )
         protected_fields = ('service', 'service_project_link', 'project', 'service_settings')
         read_only_fields = ('error_message', 'backend_id')
+        list_serializer_class = TagListSerializer
         extra_kwargs = {
             'url': {'lookup_field': 'uuid'},
         }
@@ -5,5 +5,14 @@ from django.dispatch import Signal
 structure_role_granted = Signal(providing_args=['structure', 'user', 'role', 'created_by'])
 structure_role_revoked = Signal(providing_args=['structure', 'user', 'role', 'removed_by'])
 structure_role_updated = Signal(providing_args=['instance', 'user'])
+# roles = list of (structure, user, role) tuples revoked at once, e.g. when permissions are expired
+structure_role_bulk_revoked = Signal(providing_args=['roles', 'removed_by'])
 
 resource_imported = Signal(providing_args=['instance'])
+
+# sender = model of created objects, e.g. service or service project link model
+# Signal is sent instead of post_save for objects created with bulk_create when shared service settings
+# are connected to all customers and projects. Receivers of structure app initialize quotas, increase
+# counter quotas and add hierarchy paths. Other post_save receivers, such as event loggers and handlers
+# of extensions, are not called for these objects, so extensions should connect batched receivers here.
+structure_objects_bulk_created = Signal(providing_args=['instances'])
@@ -1,23 +1,69 @@
 from __future__ import unicode_literals
 
+import collections
+import datetime
+import itertools
 import logging
+import time
+from operator import itemgetter
+import traceback
 
-from celery import shared_task
+from celery import shared_task, signature
+from celery.exceptions import Ignore
+from django.contrib.contenttypes.models import ContentType
 from django.core import exceptions
-from django.db import transaction
+from django.core.cache import cache
+from django.db.models import F, Q
 from django.db.utils import DatabaseError
+from django.utils import timezone
+from django_fsm import ConcurrentTransition
 import six
 
-from waldur_core.core import utils as core_utils, tasks as core_tasks, models as core_models
-from waldur_core.structure import SupportedServices, models, utils, ServiceBackendError
+from waldur_core.core import utils as core_utils, tasks as core_tasks
+from waldur_core.core.exceptions import RuntimeStateException
+from waldur_core.structure import geoip, linking, models, utils, ServiceBackendError
 
 logger = logging.getLogger(__name__)
 
 
 @shared_task(name='waldur_core.structure.detect_vm_coordinates_batch')
 def detect_vm_coordinates_batch(serialized_virtual_machines):
-    for vm in serialized_virtual_machines:
-        detect_vm_coordinates.delay(vm)
+    """ Resolve coordinates of all virtual machines at once, each IP address is resolved only once.
+        If resolver does not support batch lookup, separate task is scheduled for each virtual machine.
+    """
+    try:
+        resolver = geoip.get_resolver()
+    except geoip.GeoIpException as e:
+        logger.warning('Unable to detect coordinates for virtual machines: %s.', e)
+        return
+
+    if not resolver.batch_lookup:
+        for serialized_virtual_machine in serialized_virtual_machines:
+            detect_vm_coordinates.delay(serialized_virtual_machine)
+        return
+
+    virtual_machines = []
+    for serialized_virtual_machine in serialized_virtual_machines:
+        try:
+            vm = core_utils.deserialize_instance(serialized_virtual_machine)
+        except exceptions.ObjectDoesNotExist:
+            logger.warning('Missing virtual machine %s.', serialized_virtual_machine)
+            continue
+        if vm.external_ips:
+            virtual_machines.append(vm)
+
+    try:
+        coordinates = resolver.resolve_many({vm.external_ips[0] for vm in virtual_machines})
+    except geoip.GeoIpException as e:
+        logger.warning('Unable to detect coordinates for virtual machines: %s.', e)
+        return
+
+    for vm in virtual_machines:
+        vm_coordinates = coordinates.get(vm.external_ips[0])
+        if vm_coordinates:
+            vm.latitude = vm_coordinates.latitude
+            vm.longitude = vm_coordinates.longitude
+            vm.save(update_fields=['latitude', 'longitude'])
 
 
 @shared_task(name='waldur_core.structure.detect_vm_coordinates')
@@ -31,7 +77,7 @@ def detect_vm_coordinates(serialized_virtual_machine):
 
     try:
         coordinates = vm.detect_coordinates()
-    except utils.GeoIpException as e:
+    except geoip.GeoIpException as e:
         logger.warning('Unable to detect coordinates for virtual machines %s: %s.', serialized_virtual_machine, e)
         return
 
@@ -44,8 +90,27 @@ def detect_vm_coordinates(serialized_virtual_machine):
 @shared_task(name='waldur_core.structure.check_expired_permissions')
 def check_expired_permissions():
     for cls in models.BasePermission.get_all_models():
-        for permission in cls.get_expired():
-            permission.revoke()
+        cls.revoke_expired()
+
+
+@shared_task(name='waldur_core.structure.pull_service_settings_stats')
+def pull_service_settings_stats(service_settings_uuid):
+    try:
+        service_settings = models.ServiceSettings.objects.get(uuid=service_settings_uuid)
+    except models.ServiceSettings.DoesNotExist:
+        cache.delete(utils.get_service_settings_stats_lock_key(service_settings_uuid))
+        return
+    try:
+        utils.pull_service_settings_stats(service_settings)
+    except ServiceBackendError as e:
+        logger.warning('Unable to pull stats of service settings %s: %s.', service_settings_uuid, e)
+
+
+@shared_task(name='waldur_core.structure.create_quota_timeline_rollups')
+def create_quota_timeline_rollups():
+    date = timezone.now().replace(minute=0, second=0, microsecond=0)
+    models.QuotaTimelineRollup.create_snapshots(date)
+    models.QuotaTimelineRollup.cleanup()
 
 
 class ConnectSharedSettingsTask(core_tasks.Task):
@@ -54,17 +119,7 @@ class ConnectSharedSettingsTask(core_tasks.Task):
         logger.debug('About to connect service settings "%s" to all available customers' % service_settings.name)
         if not service_settings.shared:
             raise ValueError('It is impossible to connect non-shared settings')
-        service_model = SupportedServices.get_service_models()[service_settings.type]['service']
-
-        with transaction.atomic():
-            for customer in models.Customer.objects.all():
-                defaults = {'available_for_all': True}
-                service, _ = service_model.objects.get_or_create(
-                    customer=customer, settings=service_settings, defaults=defaults)
-
-                service_project_link_model = service.projects.through
-                for project in service.customer.projects.all():
-                    service_project_link_model.objects.get_or_create(project=project, service=service)
+        linking.connect_shared_settings(service_settings)
         logger.info('Successfully connected service settings "%s" to all available customers' % service_settings.name)
 
 
@@ -98,14 +153,15 @@ class BackgroundPullTask(core_tasks.BackgroundTask):
         self.log_error_message(instance, error_message)
         try:
             self.set_instance_erred(instance, error_message)
-        except DatabaseError as e:
+        except (DatabaseError, ConcurrentTransition) as e:
             logger.debug(e, exc_info=True)
 
     def on_pull_success(self, instance):
         if instance.state == instance.States.ERRED:
-            instance.recover()
-            instance.error_message = ''
-            instance.save(update_fields=['state', 'error_message'])
+            try:
+                instance.atomic_transition('recover', error_message='')
+            except ConcurrentTransition as e:
+                logger.debug(e, exc_info=True)
 
     def log_error_message(self, instance, error_message):
         logger_message = 'Failed to pull %s %s (PK: %s). Error: %s' % (
@@ -117,15 +173,61 @@ class BackgroundPullTask(core_tasks.BackgroundTask):
 
     def set_instance_erred(self, instance, error_message):
         """ Mark instance as erred and save error message """
-        instance.set_erred()
-        instance.error_message = error_message
-        instance.save(update_fields=['state', 'error_message'])
+        instance.atomic_transition('set_erred', error_message=error_message)
+
+
+class BackgroundBatchPullTask(core_tasks.BackgroundTask):
+    """ Pull chunk of objects that are connected to the same service settings.
+
+        If backend implements method "pull_many" - all objects are pulled with single backend call,
+        otherwise method "pull" of the pull task is called for each object.
+    """
+
+    def run(self, serialized_pull_task, serialized_instances):
+        pull_task = core_utils.deserialize_class(serialized_pull_task)()
+        instances = core_utils.deserialize_instances(serialized_instances)
+        if not instances:
+            return
+
+        backend = instances[0].get_backend()
+        if hasattr(backend, 'pull_many'):
+            self.pull_many(pull_task, backend, instances)
+        else:
+            for instance in instances:
+                self.pull(pull_task, instance)
+
+    def is_equal(self, other_task, serialized_pull_task, serialized_instances):
+        return self.name == other_task.get('name') and serialized_instances in other_task.get('args', [])
+
+    def pull_many(self, pull_task, backend, instances):
+        try:
+            backend.pull_many(instances)
+        except ServiceBackendError as e:
+            for instance in instances:
+                pull_task.on_pull_fail(instance, e)
+        else:
+            for instance in instances:
+                pull_task.on_pull_success(instance)
+
+    def pull(self, pull_task, instance):
+        try:
+            pull_task.pull(instance)
+        except ServiceBackendError as e:
+            pull_task.on_pull_fail(instance, e)
+        else:
+            pull_task.on_pull_success(instance)
 
 
 class BackgroundListPullTask(core_tasks.BackgroundTask):
-    """ Schedules pull task for each stable object of the model. """
+    """ Schedules pull task for each stable object of the model.
+
+        If batch_size is defined, objects are grouped by service settings and
+        one batch pull task is scheduled for each chunk of objects.
+    """
     model = NotImplemented
     pull_task = NotImplemented
+    batch_size = None
+    settings_path = 'service_project_link__service__settings'
 
     def is_equal(self, other_task):
         return self.name == other_task.get('name')
@@ -134,27 +236,120 @@ class BackgroundListPullTask(core_tasks.BackgroundTask):
         States = self.model.States
         return self.model.objects.filter(state__in=[States.ERRED, States.OK]).exclude(backend_id='')
 
+    def get_pulled_chunks(self):
+        """ Yield lists of serialized objects, each list contains objects of the same service settings. """
+        rows = self.get_pulled_objects().order_by(self.settings_path, 'pk').values_list(self.settings_path, 'pk')
+        for _, group in itertools.groupby(rows, key=itemgetter(0)):
+            pks = [pk for _, pk in group]
+            for index in range(0, len(pks), self.batch_size):
+                yield [core_utils.serialize_instance(self.model(pk=pk)) for pk in pks[index:index + self.batch_size]]
+
     def run(self):
+        if self.batch_size:
+            serialized_pull_task = core_utils.serialize_class(self.pull_task)
+            for chunk in self.get_pulled_chunks():
+                BackgroundBatchPullTask().apply_async(args=(serialized_pull_task, chunk), kwargs={})
+            return
+
         for instance in self.get_pulled_objects():
             serialized = core_utils.serialize_instance(instance)
             self.pull_task().apply_async(args=(serialized,), kwargs={})
 
 
 class ServiceSettingsBackgroundPullTask(BackgroundPullTask):
+    """ Pull service settings from backend, record pull duration and schedule next pull.
+
+        Task is scheduled by ServiceSettingsListPullTask only after pull slots are acquired,
+        so it is not checked whether previous task is processing. Slots are released when pull is completed,
+        even if settings do not exist anymore or pull has failed unexpectedly.
+    """
+
+    def run(self, serialized_instance, service_type=None):
+        pk = models.ServiceSettings._meta.pk.to_python(serialized_instance.split(':')[1])
+        try:
+            service_settings = core_utils.deserialize_instance(serialized_instance)
+            # Type is passed by scheduler, because slot is acquired for the type settings had at that moment.
+            service_type = service_type or service_settings.type
+            started = time.time()
+            try:
+                self.pull(service_settings)
+            except ServiceBackendError as e:
+                self.on_pull_fail(service_settings, e)
+                self.update_pull_schedule(service_settings, time.time() - started, succeeded=False)
+            else:
+                self.on_pull_success(service_settings)
+                self.update_pull_schedule(service_settings, time.time() - started, succeeded=True)
+        finally:
+            if service_type is not None:
+                utils.get_service_settings_pull_semaphore(service_type).release(pk)
+            utils.get_service_settings_pull_semaphore().release(pk)
+
+    def is_previous_task_processing(self, *args, **kwargs):
+        return False
 
     def pull(self, service_settings):
         backend = service_settings.get_backend()
         backend.sync()
 
+    def update_pull_schedule(self, service_settings, duration, succeeded):
+        now = timezone.now()
+        failures = 0 if succeeded else service_settings.pull_failures + 1
+        values = dict(
+            pull_duration=duration,
+            pull_failures=failures,
+            next_pull_at=now + utils.get_service_settings_pull_delay(failures),
+        )
+        if succeeded:
+            values['pulled_at'] = now
+        # Fields are updated directly in order to avoid overriding concurrent changes of settings.
+        models.ServiceSettings.objects.filter(pk=service_settings.pk).update(**values)
+
 
 class ServiceSettingsListPullTask(BackgroundListPullTask):
+    """ Schedule pull of service settings that are due in order of their last successful pull.
+
+        Number of concurrent pulls is limited globally and per service type,
+        settings that do not get pull slot are scheduled by next runs of the task.
+        Erred settings are pulled again with exponential backoff.
+    """
     name = 'waldur_core.structure.ServiceSettingsListPullTask'
     model = models.ServiceSettings
     pull_task = ServiceSettingsBackgroundPullTask
 
     def get_pulled_objects(self):
         States = self.model.States
-        return self.model.objects.filter(state__in=[States.ERRED, States.OK])
+        return self.model.objects.filter(
+            Q(next_pull_at__isnull=True) | Q(next_pull_at__lte=timezone.now()),
+            state__in=[States.ERRED, States.OK],
+        ).order_by(F('pulled_at').asc(nulls_first=True), 'pk')
+
+    def run(self):
+        global_semaphore = utils.get_service_settings_pull_semaphore()
+        busy_types = set()
+        for pk, service_type in self.get_pulled_objects().values_list('pk', 'type'):
+            if service_type in busy_types:
+                continue
+            # Settings that do not get slot are removed from wait queues, otherwise they would block
+            # other settings until their wait TTL expires. Order of settings is kept by query anyway.
+            type_semaphore = utils.get_service_settings_pull_semaphore(service_type)
+            if not type_semaphore.acquire(pk):
+                type_semaphore.release(pk)
+                busy_types.add(service_type)
+                continue
+            if not global_semaphore.acquire(pk):
+                global_semaphore.release(pk)
+                type_semaphore.release(pk)
+                break
+            try:
+                # Settings are not scheduled again until pull is completed or its slot is expired.
+                next_pull_at = timezone.now() + datetime.timedelta(seconds=utils.SERVICE_SETTINGS_PULL_SLOT_TTL)
+                self.model.objects.filter(pk=pk).update(next_pull_at=next_pull_at)
+                serialized = core_utils.serialize_instance(self.model(pk=pk))
+                self.pull_task().apply_async(args=(serialized,), kwargs={'service_type': service_type})
+            except Exception:
+                global_semaphore.release(pk)
+                type_semaphore.release(pk)
+                raise
 
 
 class RetryUntilAvailableTask(core_tasks.Task):
@@ -172,25 +367,30 @@ class RetryUntilAvailableTask(core_tasks.Task):
 
 class BaseThrottleProvisionTask(RetryUntilAvailableTask):
     """
-    Before starting resource provisioning, count how many resources
-    are already in "creating" state and delay provisioning if there are too many of them.
+    Before starting resource provisioning, acquire slot of service settings semaphore
+    and delay provisioning if too many resources are already in "creating" state.
+    Waiting resources get free slots in FIFO order. Slot is released when resource
+    leaves "creating" state or when task fails.
+    Limit could be configured using "max_concurrent_provisioning" option of service settings.
     """
     DEFAULT_LIMIT = 4
 
     def is_available(self, resource):
-        usage = self.get_usage(resource)
-        limit = self.get_limit(resource)
-        return usage <= limit
-
-    def get_usage(self, resource):
-        service_settings = resource.service_project_link.service.settings
-        model_class = resource._meta.model
-        return model_class.objects.filter(
-            state=core_models.StateMixin.States.CREATING,
-            service_project_link__service__settings=service_settings).count()
+        semaphore = utils.get_provisioning_semaphore(resource, self.get_limit(resource))
+        return semaphore.acquire(resource.pk)
 
     def get_limit(self, resource):
-        return self.DEFAULT_LIMIT
+        options = resource.service_project_link.service.settings.options or {}
+        return options.get('max_concurrent_provisioning', self.DEFAULT_LIMIT)
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        try:
+            resource = core_utils.deserialize_instance(args[0])
+        except exceptions.ObjectDoesNotExist:
+            pass
+        else:
+            utils.get_provisioning_semaphore(resource).release(resource.pk)
+        return super(BaseThrottleProvisionTask, self).on_failure(exc, task_id, args, kwargs, einfo)
 
 
 class ThrottleProvisionTask(BaseThrottleProvisionTask, core_tasks.BackendMethodTask):
@@ -199,3 +399,154 @@ class ThrottleProvisionTask(BaseThrottleProvisionTask, core_tasks.BackendMethodT
 
 class ThrottleProvisionStateTask(BaseThrottleProvisionTask, core_tasks.StateTransitionTask):
     pass
+
+
+class BatchPollRuntimeStateTask(core_tasks.PollRuntimeStateTask):
+    """ Register instance in runtime state poller instead of retrying task until runtime state is changed.
+
+        Task has the same signature as PollRuntimeStateTask, so executor can opt into
+        centralized polling by replacing task class. Callbacks, errbacks and the rest
+        of the chain are applied by RuntimeStatePollerTask when polling is completed.
+    """
+
+    def execute(self, instance, backend_pull_method, success_state, erred_state):
+        if self.request.is_eager:
+            return super(BatchPollRuntimeStateTask, self).execute(
+                instance, backend_pull_method, success_state, erred_state)
+
+        timeout = datetime.timedelta(seconds=self.max_retries * self.default_retry_delay)
+        models.RuntimeStatePoll.objects.create(
+            content_type=ContentType.objects.get_for_model(instance),
+            object_id=instance.pk,
+            service_settings=instance.service_settings,
+            backend_pull_method=backend_pull_method,
+            success_state=success_state,
+            erred_state=erred_state,
+            task_id=self.request.id,
+            callbacks=list(self.request.callbacks or []),
+            errbacks=list(self.request.errbacks or []),
+            chain=list(self.request.chain or []),
+            deadline=timezone.now() + timeout,
+        )
+        # Callbacks should not be applied until polling is completed.
+        raise Ignore()
+
+
+class RuntimeStatePollerTask(core_tasks.BackgroundTask):
+    """ Poll all instances registered by BatchPollRuntimeStateTask.
+
+        Instances of the same service settings are grouped by registered pull method.
+        Each group is pulled with single call of backend method "<pull method>_many"
+        if it is implemented, otherwise pull method is called for each instance.
+    """
+    name = 'waldur_core.structure.RuntimeStatePollerTask'
+
+    def is_equal(self, other_task):
+        return self.name == other_task.get('name')
+
+    def run(self):
+        polls = models.RuntimeStatePoll.objects.select_related('service_settings').order_by('service_settings', 'pk')
+        for service_settings, settings_polls in itertools.groupby(polls, key=lambda poll: poll.service_settings):
+            self.poll_service_settings(service_settings, list(settings_polls))
+
+    def poll_service_settings(self, service_settings, polls):
+        instances = self.get_instances(polls)
+        for poll in polls:
+            if poll not in instances:
+                logger.info('Instance %s:%s is not polled anymore, because it has been deleted.',
+                            poll.content_type, poll.object_id)
+                poll.delete()
+        polls = [poll for poll in polls if poll in instances]
+        if not polls:
+            return
+
+        backend = service_settings.get_backend()
+        pulled_polls = []
+        polls = sorted(polls, key=lambda poll: poll.backend_pull_method)
+        for pull_method, method_polls in itertools.groupby(polls, key=lambda poll: poll.backend_pull_method):
+            pulled_polls.extend(self.pull(backend, pull_method, list(method_polls), instances))
+        polls = pulled_polls
+
+        runtime_states = self.get_runtime_states(polls)
+        now = timezone.now()
+        for poll in polls:
+            runtime_state = runtime_states.get((poll.content_type_id, poll.object_id))
+            if runtime_state == poll.success_state:
+                self.on_success(poll, instances[poll])
+            elif runtime_state == poll.erred_state:
+                self.on_failure(poll, RuntimeStateException(
+                    '%s (PK: %s) runtime state become erred: %s' % (
+                        instances[poll].__class__.__name__, poll.object_id, poll.erred_state)))
+            elif now > poll.deadline:
+                self.on_failure(poll, RuntimeStateException(
+                    '%s (PK: %s) runtime state has not become %s in time.' % (
+                        instances[poll].__class__.__name__, poll.object_id, poll.success_state)))
+
+    def pull(self, backend, pull_method, polls, instances):
+        """ Pull instances using the same backend method and return polls of pulled instances """
+        if hasattr(backend, pull_method + '_many'):
+            try:
+                getattr(backend, pull_method + '_many')([instances[poll] for poll in polls])
+            except Exception as e:
+                for poll in polls:
+                    self.on_failure(poll, e, traceback.format_exc())
+                return []
+            return polls
+
+        pulled_polls = []
+        for poll in polls:
+            try:
+                getattr(backend, pull_method)(instances[poll])
+            except Exception as e:
+                self.on_failure(poll, e, traceback.format_exc())
+            else:
+                pulled_polls.append(poll)
+        return pulled_polls
+
+    def get_instances(self, polls):
+        """ Return dictionary that maps poll to its instance, use single query for each model """
+        instances = {}
+        for content_type, model_polls in self._group_by_content_type(polls):
+            model = content_type.model_class()
+            model_instances = model.objects.in_bulk([poll.object_id for poll in model_polls])
+            for poll in model_polls:
+                if poll.object_id in model_instances:
+                    instances[poll] = model_instances[poll.object_id]
+        return instances
+
+    def get_runtime_states(self, polls):
+        """ Return dictionary that maps (content type ID, object ID) to current runtime state """
+        runtime_states = {}
+        for content_type, model_polls in self._group_by_content_type(polls):
+            model = content_type.model_class()
+            rows = model.objects.filter(pk__in=[poll.object_id for poll in model_polls]).values_list(
+                'pk', 'runtime_state')
+            for pk, runtime_state in rows:
+                runtime_states[(content_type.id, pk)] = runtime_state
+        return runtime_states
+
+    def _group_by_content_type(self, polls):
+        groups = collections.OrderedDict()
+        for poll in polls:
+            groups.setdefault(poll.content_type_id, []).append(poll)
+        for content_type_id, model_polls in groups.items():
+            yield ContentType.objects.get_for_id(content_type_id), model_polls
+
+    def on_success(self, poll, instance):
+        serialized_instance = core_utils.serialize_instance(instance)
+        poll.delete()
+        self.app.backend.mark_as_done(poll.task_id, serialized_instance)
+        for callback in poll.callbacks:
+            signature(callback, app=self.app).apply_async((serialized_instance,), parent_id=poll.task_id)
+        if poll.chain:
+            chain = list(poll.chain)
+            signature(chain.pop(), app=self.app).apply_async(
+                (serialized_instance,), chain=chain, parent_id=poll.task_id)
+
+    def on_failure(self, poll, exc, exc_traceback=''):
+        logger.warning('Polling of %s:%s with method %s has failed: %s',
+                       poll.content_type, poll.object_id, poll.backend_pull_method, exc)
+        poll.delete()
+        self.app.backend.mark_as_failure(poll.task_id, exc, traceback=exc_traceback)
+        for errback in poll.errbacks:
+            signature(errback, app=self.app).apply_async((poll.task_id,), parent_id=poll.task_id)
@@ -486,6 +486,40 @@ class CustomerQuotasTest(test.APITransactionTestCase):
         self.customer.projects.all().delete()
         self.assert_quota_usage('nc_user_count', 0)
 
+    def test_customer_users_quota_decreases_only_when_last_role_is_revoked(self):
+        user = factories.UserFactory()
+        project = factories.ProjectFactory(customer=self.customer)
+        self.customer.add_user(user, CustomerRole.OWNER)
+        project.add_user(user, ProjectRole.ADMINISTRATOR)
+
+        self.customer.remove_user(user)
+        self.assert_quota_usage('nc_user_count', 1)
+
+        project.remove_user(user)
+        self.assert_quota_usage('nc_user_count', 0)
+
+    def test_revoked_role_is_not_counted_again_when_project_is_deleted(self):
+        user = factories.UserFactory()
+        project = factories.ProjectFactory(customer=self.customer)
+        self.customer.add_user(user, CustomerRole.OWNER)
+        project.add_user(user, ProjectRole.ADMINISTRATOR)
+        project.remove_user(user)
+
+        project.delete()
+        self.assert_quota_usage('nc_user_count', 1)
+
+    def test_customer_users_quota_is_moved_together_with_project(self):
+        user = factories.UserFactory()
+        project = factories.ProjectFactory(customer=self.customer)
+        project.add_user(user, ProjectRole.ADMINISTRATOR)
+        new_customer = factories.CustomerFactory()
+
+        project.customer = new_customer
+        project.save()
+
+        self.assert_quota_usage('nc_user_count', 0)
+        self.assertEqual(new_customer.quotas.get(name='nc_user_count').usage, 1)
+
     def assert_quota_usage(self, name, value):
         self.assertEqual(value, self.customer.quotas.get(name=name).usage)
 
@@ -578,6 +612,17 @@ class CustomerCountersListTest(test.APITransactionTestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, {'users': 5, 'projects': 1, 'services': 1})
 
+    def test_project_admin_gets_counters_only_for_connected_projects(self):
+        factories.ProjectFactory(customer=self.customer)
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(self.url, {'fields': ['projects']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'projects': 1})
+
+        self.client.force_authenticate(self.owner)
+        response = self.client.get(self.url, {'fields': ['projects']})
+        self.assertEqual(response.data, {'projects': 2})
+
 
 class UserCustomersFilterTest(test.APITransactionTestCase):
     def setUp(self):
@@ -1,7 +1,12 @@
 from rest_framework import status, test
 from rest_framework.reverse import reverse
+from six.moves import mock
 
-from waldur_core.structure.tests import factories
+from waldur_core.core.models import StateMixin
+from waldur_core.structure.metadata import ActionsMetadata
+from waldur_core.structure.tests import factories, fixtures
+
+States = StateMixin.States
 
 
 class ServiceMetadataTest(test.APITransactionTestCase):
@@ -9,3 +14,60 @@ class ServiceMetadataTest(test.APITransactionTestCase):
         self.client.force_authenticate(factories.UserFactory())
         response = self.client.get(reverse('service_metadata-list'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ResourceActionsMetadataTest(test.APITransactionTestCase):
+    def setUp(self):
+        ActionsMetadata._fields_cache.clear()
+        self.fixture = fixtures.ServiceFixture()
+        self.client.force_authenticate(self.fixture.staff)
+        link = self.fixture.service_project_link
+        self.ok_resource = factories.TestNewInstanceFactory(service_project_link=link, state=States.OK)
+        self.erred_resource = factories.TestNewInstanceFactory(service_project_link=link, state=States.ERRED)
+
+    def test_actions_metadata_is_rendered_for_resource(self):
+        response = self.client.options(factories.TestNewInstanceFactory.get_url(self.ok_resource))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        actions = response.data['actions']
+        self.assertTrue(actions['pull']['enabled'])
+        self.assertEqual(actions['pull']['type'], 'button')
+        self.assertEqual(actions['update']['type'], 'form')
+        self.assertIn('name', actions['update']['fields'])
+
+    def test_static_info_of_action_fields_is_computed_once_per_view(self):
+        url = factories.TestNewInstanceFactory.get_url(self.ok_resource)
+        with mock.patch.object(ActionsMetadata, 'get_static_field_info', autospec=True,
+                               side_effect=ActionsMetadata.get_static_field_info) as get_static_field_info:
+            self.client.options(url)
+            call_count = get_static_field_info.call_count
+            self.client.options(url)
+
+        self.assertTrue(call_count)
+        self.assertEqual(get_static_field_info.call_count, call_count)
+
+    def test_availability_of_actions_is_returned_for_several_resources(self):
+        url = factories.TestNewInstanceFactory.get_list_url() + 'actions/'
+        response = self.client.get(url, {'uuid': [self.ok_resource.uuid.hex, self.erred_resource.uuid.hex]})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ok_actions = response.data[self.ok_resource.uuid.hex]
+        erred_actions = response.data[self.erred_resource.uuid.hex]
+        self.assertTrue(ok_actions['update']['enabled'])
+        self.assertFalse(erred_actions['update']['enabled'])
+        self.assertTrue(erred_actions['update']['reason'])
+        self.assertTrue(erred_actions['pull']['enabled'])
+
+    def test_resources_of_other_projects_are_skipped(self):
+        self.client.force_authenticate(self.fixture.admin)
+        other_resource = factories.TestNewInstanceFactory()
+        url = factories.TestNewInstanceFactory.get_list_url() + 'actions/'
+
+        response = self.client.get(url, {'uuid': [self.ok_resource.uuid.hex, other_resource.uuid.hex]})
+
+        self.assertEqual(list(response.data.keys()), [self.ok_resource.uuid.hex])
+
+    def test_invalid_uuid_is_rejected(self):
+        url = factories.TestNewInstanceFactory.get_list_url() + 'actions/'
+        response = self.client.get(url, {'uuid': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
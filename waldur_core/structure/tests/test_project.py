@@ -457,6 +457,33 @@ class ProjectCountersListTest(test.APITransactionTestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, {'test': 100})
 
+    def test_resource_counters_are_read_from_project_quotas(self):
+        self.project.set_quota_usage(Project.Quotas.nc_vm_count, 5)
+        self.client.force_authenticate(self.fixture.owner)
+        response = self.client.get(self.url, {'fields': ['vms']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'vms': 5})
+
+    def test_cacheable_counter_is_computed_once_for_user(self):
+        counter = mock.Mock(return_value=10)
+        views.ProjectCountersView.register_counter('cached', counter, cacheable=True)
+        self.client.force_authenticate(self.fixture.owner)
+
+        for _ in range(2):
+            response = self.client.get(self.url, {'fields': ['cached']})
+            self.assertEqual(response.data, {'cached': 10})
+        self.client.force_authenticate(self.fixture.admin)
+        self.client.get(self.url, {'fields': ['cached']})
+
+        self.assertEqual(counter.call_count, 2)
+
+    def test_cacheable_counter_is_registered_only_for_its_view(self):
+        views.ProjectCountersView.register_counter('cached', mock.Mock(), cacheable=True)
+
+        self.assertIn('cached', views.ProjectCountersView.cacheable_counters)
+        self.assertNotIn('cached', views.BaseCounterView.cacheable_counters)
+        self.assertNotIn('cached', views.CustomerCountersView.cacheable_counters)
+
 
 @ddt
 class ProjectCertificationUpdateTest(test.APITransactionTestCase):
@@ -1,9 +1,10 @@
 import unittest
 
+from django.urls import reverse
 from rest_framework import test, status
 
 from waldur_core.core import models as core_models
-from waldur_core.structure.models import NewResource, ServiceSettings
+from waldur_core.structure.models import CustomerRole, NewResource, ResourceIndex, ServiceSettings
 from waldur_core.structure.tests import factories, fixtures, models as test_models
 
 States = core_models.StateMixin.States
@@ -163,3 +164,159 @@ class ResourceTagsTest(test.APITransactionTestCase):
         url = factories.TestNewInstanceFactory.get_list_url()
         response = self.client.get(url, {'tag': 'tag1'})
         self.assertEqual(len(response.data), 1)
+
+
+class ResourceSummaryTest(test.APITransactionTestCase):
+    def setUp(self):
+        self.fixture = fixtures.ServiceFixture()
+        self.url = reverse('resource-list')
+
+    def test_user_can_see_resources_of_his_project(self):
+        resource = self.fixture.resource
+        self.client.force_authenticate(user=self.fixture.admin)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['uuid'] for item in response.data], [resource.uuid.hex])
+
+    def test_user_can_not_see_resources_of_other_project(self):
+        factories.TestNewInstanceFactory()
+        self.client.force_authenticate(user=self.fixture.admin)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [])
+
+
+class ResourceTagsFilterTest(test.APITransactionTestCase):
+    def setUp(self):
+        self.fixture = fixtures.ServiceFixture()
+        self.client.force_authenticate(user=self.fixture.staff)
+        self.url = reverse('resource-list')
+        link = self.fixture.service_project_link
+        self.centos = factories.TestNewInstanceFactory(service_project_link=link)
+        self.centos.tags.add('license-os:centos7', 'env:prod')
+        self.centos_minor = factories.TestNewInstanceFactory(service_project_link=link)
+        self.centos_minor.tags.add('license-os:CentOS7.1')
+        self.ubuntu = factories.TestNewInstanceFactory(service_project_link=link)
+        self.ubuntu.tags.add('license-os:ubuntu16', 'env:prod')
+
+    def get_filtered_resources(self, query):
+        response = self.client.get(self.url, query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {item['uuid'] for item in response.data}
+
+    def test_tag_value_is_matched_exactly_by_default(self):
+        uuids = self.get_filtered_resources({'tag__license-os': 'centos7'})
+        self.assertEqual(uuids, {self.centos.uuid.hex})
+
+    def test_tag_value_is_matched_by_prefix_case_insensitively(self):
+        uuids = self.get_filtered_resources({'tag__license-os': 'centos', 'tag_match': 'prefix'})
+        self.assertEqual(uuids, {self.centos.uuid.hex, self.centos_minor.uuid.hex})
+
+    def test_tag_value_is_matched_by_substring(self):
+        uuids = self.get_filtered_resources({'tag__license-os': 'tos7', 'tag_match': 'substring'})
+        self.assertEqual(uuids, {self.centos.uuid.hex, self.centos_minor.uuid.hex})
+
+    def test_resources_with_all_tags_are_returned_by_default(self):
+        uuids = self.get_filtered_resources({'tag__license-os': 'ubuntu16', 'tag__env': 'prod'})
+        self.assertEqual(uuids, {self.ubuntu.uuid.hex})
+
+    def test_resources_with_any_tag_are_returned_for_or_operator(self):
+        uuids = self.get_filtered_resources({'tag__license-os': ['centos7', 'ubuntu16'], 'tag_operator': 'or'})
+        self.assertEqual(uuids, {self.centos.uuid.hex, self.ubuntu.uuid.hex})
+
+    def test_index_is_updated_when_tag_is_removed_or_renamed(self):
+        self.centos.tags.remove('license-os:centos7')
+        tag = self.ubuntu.tags.get(name='license-os:ubuntu16')
+        tag.name = 'license-os:centos7'
+        tag.save()
+
+        uuids = self.get_filtered_resources({'tag__license-os': 'centos7'})
+        self.assertEqual(uuids, {self.ubuntu.uuid.hex})
+
+
+class ResourceSearchTest(test.APITransactionTestCase):
+    def setUp(self):
+        self.fixture = fixtures.ServiceFixture()
+        self.resource = self.fixture.resource
+        self.url = reverse('resource-search')
+        self.client.force_authenticate(user=self.fixture.admin)
+
+    def search(self, query):
+        response = self.client.get(self.url, {'query': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['uuid'] for item in response.data]
+
+    def test_resource_is_found_by_name_prefix(self):
+        self.resource.name = 'Web server'
+        self.resource.save()
+
+        self.assertEqual(self.search('web'), [self.resource.uuid.hex])
+        self.assertEqual(self.search('server'), [])
+
+    def test_resource_is_found_by_backend_id(self):
+        self.resource.backend_id = 'abc-123'
+        self.resource.save()
+
+        self.assertEqual(self.search('abc'), [self.resource.uuid.hex])
+
+    def test_resource_is_found_by_tag(self):
+        self.resource.tags.add('production')
+
+        self.assertEqual(self.search('production'), [self.resource.uuid.hex])
+
+    def test_resource_is_found_by_ip_address_prefix(self):
+        # Test instance has internal IP 127.0.0.1 and external IP 8.8.8.8
+        self.assertEqual(self.search('127.0'), [self.resource.uuid.hex])
+        self.assertEqual(self.search('8.8.8'), [self.resource.uuid.hex])
+        self.assertEqual(self.search('0.1'), [])
+
+    def test_ip_addresses_are_indexed_by_rebuild(self):
+        ResourceIndex.rebuild()
+
+        self.assertEqual(self.search('8.8.8'), [self.resource.uuid.hex])
+
+    def test_resources_are_searched_directly_until_index_is_built(self):
+        self.resource.name = 'Web server'
+        self.resource.save()
+        self.resource.tags.add('production')
+        ResourceIndex.objects.all().delete()
+
+        self.assertEqual(self.search('web'), [self.resource.uuid.hex])
+        self.assertEqual(self.search('production'), [self.resource.uuid.hex])
+        self.assertEqual(self.search('server'), [])
+
+    def test_resource_is_found_by_owner_of_new_customer_after_project_move(self):
+        self.resource.name = 'Web server'
+        self.resource.save()
+        new_customer = factories.CustomerFactory()
+        new_owner = factories.UserFactory()
+        new_customer.add_user(new_owner, CustomerRole.OWNER)
+
+        project = self.fixture.project
+        project.customer = new_customer
+        project.save()
+
+        self.client.force_authenticate(user=self.fixture.owner)
+        self.assertEqual(self.search('web'), [])
+        self.client.force_authenticate(user=new_owner)
+        self.assertEqual(self.search('web'), [self.resource.uuid.hex])
+
+    def test_deleted_resource_is_not_found(self):
+        self.resource.name = 'Web server'
+        self.resource.save()
+        self.resource.delete()
+
+        self.assertEqual(self.search('web'), [])
+
+    def test_resource_of_other_project_is_not_found(self):
+        factories.TestNewInstanceFactory(name='Web server')
+
+        self.assertEqual(self.search('web'), [])
+
+    def test_query_is_required(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
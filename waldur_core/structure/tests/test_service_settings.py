@@ -1,10 +1,17 @@
+from datetime import timedelta
+import time
+
 from ddt import ddt, data
+from django.core.cache import cache
+from django.utils import timezone
+from freezegun import freeze_time
+import mock
 from rest_framework import status, test
 
 from waldur_core.core.tests.helpers import override_waldur_core_settings
-from waldur_core.structure import models
+from waldur_core.structure import models, tasks
 
-from . import fixtures, factories
+from . import fixtures, factories, TestBackend
 
 
 class ServiceSettingsListTest(test.APITransactionTestCase):
@@ -348,3 +355,78 @@ class ServiceSettingsUpdateCertifications(test.APITransactionTestCase):
         return {
             'certifications': certification_urls
         }
+
+
+class SlowStatsBackend(TestBackend):
+    DELAY = 0.5
+
+    calls = 0
+
+    def get_stats(self):
+        SlowStatsBackend.calls += 1
+        time.sleep(self.DELAY)
+        return {'vcpu': 10, 'vcpu_usage': SlowStatsBackend.calls}
+
+
+@mock.patch('waldur_core.structure.models.ServiceSettings.get_backend', lambda settings: SlowStatsBackend(settings))
+@mock.patch('waldur_core.structure.utils.core_tasks')
+class ServiceSettingsStatsTest(test.APITransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        SlowStatsBackend.calls = 0
+        self.fixture = fixtures.ServiceFixture()
+        self.settings = self.fixture.service_settings
+        self.url = factories.ServiceSettingsFactory.get_url(self.settings, 'stats')
+        self.client.force_authenticate(self.fixture.staff)
+
+    def test_missing_stats_are_not_pulled_synchronously(self, core_tasks):
+        start = time.time()
+        response = self.client.get(self.url)
+
+        self.assertLess(time.time() - start, SlowStatsBackend.DELAY)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertIn('Retry-After', response)
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(SlowStatsBackend.calls, 0)
+        core_tasks.send_task.assert_called_once_with('structure', 'pull_service_settings_stats')
+        core_tasks.send_task.return_value.assert_called_once_with(self.settings.uuid.hex)
+
+    def test_concurrent_requests_schedule_single_refresh(self, core_tasks):
+        for _ in range(3):
+            self.client.get(self.url)
+
+        self.assertEqual(core_tasks.send_task.return_value.call_count, 1)
+
+    def test_last_known_stats_are_returned_after_refresh(self, core_tasks):
+        self.client.get(self.url)
+        tasks.pull_service_settings_stats(self.settings.uuid.hex)
+
+        start = time.time()
+        response = self.client.get(self.url)
+
+        self.assertLess(time.time() - start, SlowStatsBackend.DELAY)
+        self.assertEqual(response.data, {'vcpu': 10, 'vcpu_usage': 1})
+        self.assertIn('Last-Modified', response)
+        self.assertEqual(core_tasks.send_task.return_value.call_count, 1)
+
+    def test_stale_stats_are_returned_while_refresh_is_scheduled(self, core_tasks):
+        with freeze_time('2017-01-01 00:00:00'):
+            tasks.pull_service_settings_stats(self.settings.uuid.hex)
+
+        with freeze_time('2017-01-01 01:00:00'):
+            response = self.client.get(self.url)
+            self.client.get(self.url)
+
+        self.assertEqual(response.data, {'vcpu': 10, 'vcpu_usage': 1})
+        self.assertEqual(response['Last-Modified'], 'Sun, 01 Jan 2017 00:00:00 GMT')
+        self.assertEqual(core_tasks.send_task.return_value.call_count, 1)
+
+    def test_lock_is_released_after_refresh(self, core_tasks):
+        self.client.get(self.url)
+        tasks.pull_service_settings_stats(self.settings.uuid.hex)
+
+        with freeze_time(timezone.now() + timedelta(hours=1)):
+            self.client.get(self.url)
+
+        self.assertEqual(core_tasks.send_task.return_value.call_count, 2)
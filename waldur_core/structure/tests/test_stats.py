@@ -2,9 +2,11 @@ from __future__ import unicode_literals
 
 from datetime import timedelta
 
+from django.core.cache import cache
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import test, status
+from reversion.models import Version
 
 from waldur_core.core import utils as core_utils
 from waldur_core.structure import models
@@ -14,6 +16,7 @@ from waldur_core.structure.tests import factories
 class CreationTimeStatsTest(test.APITransactionTestCase):
 
     def setUp(self):
+        cache.clear()
         # customers
         self.old_customer = factories.CustomerFactory(created=timezone.now() - timedelta(days=10))
         self.new_customer = factories.CustomerFactory(created=timezone.now() - timedelta(days=1))
@@ -70,6 +73,17 @@ class CreationTimeStatsTest(test.APITransactionTestCase):
         self.assertEqual(response.data[1]['value'], 0, 'Second datapoint has to contain 0 projects')
         self.assertEqual(response.data[2]['value'], 3, 'Third datapoint has to contain 3 projects (new)')
 
+    def test_stats_are_cached_for_users_with_the_same_permissions(self):
+        self.default_data['to'] = core_utils.datetime_to_timestamp(timezone.now())
+        self.execute_request_with_data(self.staff, {'type': 'customer'})
+        factories.CustomerFactory(created=timezone.now() - timedelta(days=1))
+
+        response = self.execute_request_with_data(factories.UserFactory(is_support=True), {'type': 'customer'})
+        self.assertEqual(response.data[1]['value'], 1)
+
+        response = self.execute_request_with_data(self.old_customer_owner, {'type': 'customer'})
+        self.assertEqual(response.data[0]['value'], 1)
+
 
 class BaseQuotaAggregationTest(test.APITransactionTestCase):
     def setUp(self):
@@ -89,6 +103,7 @@ class BaseQuotaAggregationTest(test.APITransactionTestCase):
         link2 = factories.TestServiceProjectLinkFactory(project=self.project)
         link2.set_quota_limit('vcpu', limit2)
         link2.set_quota_usage('vcpu', usage2)
+        return link1, link2
 
 
 class StatsQuotaTimelineTest(BaseQuotaAggregationTest):
@@ -114,13 +129,49 @@ class StatsQuotaTimelineTest(BaseQuotaAggregationTest):
         self.assertEqual(110, response.data[0]['vcpu_limit'])
         self.assertEqual(12, response.data[0]['vcpu_usage'])
 
-    def get_response(self):
+    def test_past_ranges_are_read_from_snapshots(self):
+        link1, _ = self.create_links(limit1=10, usage1=2, limit2=100, usage2=10)
+        yesterday = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+        models.QuotaTimelineRollup.create_snapshots(yesterday)
+        link1.set_quota_usage('vcpu', 5)
+
+        response = self.get_response(start=yesterday - timedelta(hours=1), end=timezone.now())
+
+        self.assertEqual(15, response.data[0]['vcpu_usage'])
+        self.assertEqual(12, response.data[1]['vcpu_usage'])
+        self.assertEqual(110, response.data[1]['vcpu_limit'])
+
+    def test_customer_snapshots_are_used_for_customer_owner(self):
+        self.create_links(limit1=10, usage1=2, limit2=100, usage2=10)
+        yesterday = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+        models.QuotaTimelineRollup.create_snapshots(yesterday)
+        models.QuotaTimelineRollup.objects.filter(object_id=self.project.id, content_type__model='project').delete()
+
+        response = self.get_response(start=yesterday - timedelta(hours=1), end=timezone.now(),
+                                     aggregate='customer', uuid=self.project.customer.uuid.hex)
+
+        self.assertEqual(12, response.data[1]['vcpu_usage'])
+
+    def test_ranges_without_snapshots_are_computed_from_quotas_history(self):
+        link1, link2 = self.create_links(limit1=10, usage1=2, limit2=100, usage2=10)
+        two_days_ago = timezone.now() - timedelta(days=2)
+        for link in (link1, link2):
+            for version in Version.objects.get_for_object(link.quotas.get(name='vcpu')):
+                version.revision.date_created = two_days_ago
+                version.revision.save()
+
+        response = self.get_response(start=two_days_ago, end=timezone.now())
+
+        self.assertEqual(12, response.data[-1]['vcpu_usage'])
+        self.assertEqual(110, response.data[-1]['vcpu_limit'])
+
+    def get_response(self, start=None, end=None, aggregate='project', uuid=None):
         response = self.client.get(reverse('stats_quota_timeline'), data={
-            'aggregate': 'project',
-            'uuid': self.project.uuid.hex,
+            'aggregate': aggregate,
+            'uuid': uuid or self.project.uuid.hex,
             'item': 'vcpu',
-            'from': core_utils.datetime_to_timestamp(timezone.now() - timedelta(minutes=1)),
-            'to': core_utils.datetime_to_timestamp(timezone.now() + timedelta(minutes=1))
+            'from': core_utils.datetime_to_timestamp(start or timezone.now() - timedelta(minutes=1)),
+            'to': core_utils.datetime_to_timestamp(end or timezone.now() + timedelta(minutes=1))
         })
         return response
 
@@ -1,10 +1,16 @@
 # coding=utf-8
 from __future__ import unicode_literals
 
+import json
+
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase
 import six
 from six import StringIO
+from six.moves import mock
+
+from waldur_core.structure import models
 
 from .. import factories
 
@@ -22,3 +28,105 @@ class DumpUsersCommandTest(TestCase):
         if not isinstance(value, six.text_type):
             value = value.decode('utf-8')
         self.assertIn(user.full_name, value)
+
+    def test_users_are_written_by_chunks(self):
+        users = factories.UserFactory.create_batch(3)
+        output = StringIO()
+        with mock.patch('waldur_core.structure.management.commands.dumpusers.CHUNK_SIZE', 2):
+            call_command('dumpusers', stdout=output)
+
+        value = output.getvalue()
+        self.assertEqual(value.count('Organizations'), 1)
+        for user in users:
+            self.assertIn(user.email, value)
+
+    def test_columns_of_chunks_are_aligned(self):
+        factories.UserFactory.create_batch(2)
+        factories.UserFactory(full_name='', email='a@b.c')
+        output = StringIO()
+        with mock.patch('waldur_core.structure.management.commands.dumpusers.CHUNK_SIZE', 2):
+            call_command('dumpusers', stdout=output)
+
+        widths = set(len(line) for line in output.getvalue().splitlines())
+        self.assertEqual(len(widths), 1)
+
+    def test_roles_are_written_in_csv_format(self):
+        permission = factories.CustomerPermissionFactory()
+        output = StringIO()
+        call_command('dumpusers', format='csv', stdout=output)
+
+        rows = output.getvalue().splitlines()
+        self.assertTrue(rows[0].startswith('full_name,'))
+        row = [line for line in rows if permission.user.email in line][0]
+        self.assertIn(permission.customer.name, row)
+
+    def test_roles_are_written_in_json_format(self):
+        permission = factories.ProjectPermissionFactory()
+        output = StringIO()
+        call_command('dumpusers', format='json', stdout=output)
+
+        rows = [json.loads(line) for line in output.getvalue().splitlines()]
+        row = [row for row in rows if row['email'] == permission.user.email][0]
+        self.assertEqual(row['projects'], [six.text_type(permission)])
+        self.assertEqual(row['organizations'], [])
+
+
+class UserScopeAccessCommandsTest(TestCase):
+
+    def setUp(self):
+        self.permission = factories.ProjectPermissionFactory()
+
+    def test_check_command_passes_if_table_is_consistent(self):
+        output = StringIO()
+        call_command('check_user_scope_access', stdout=output)
+        self.assertIn('consistent', output.getvalue())
+
+    def test_check_command_fails_if_row_is_missing(self):
+        models.UserScopeAccess.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command('check_user_scope_access', stdout=StringIO())
+
+    def test_rebuild_command_restores_missing_rows(self):
+        models.UserScopeAccess.objects.all().delete()
+
+        call_command('rebuild_user_scope_access', stdout=StringIO())
+
+        self.assertTrue(models.UserScopeAccess.objects.filter(
+            user=self.permission.user, project=self.permission.project).exists())
+
+
+class HierarchyPathCommandsTest(TestCase):
+
+    def setUp(self):
+        self.resource = factories.TestNewInstanceFactory()
+
+    def test_check_command_passes_if_table_is_consistent(self):
+        output = StringIO()
+        call_command('check_hierarchy_paths', stdout=output)
+        self.assertIn('consistent', output.getvalue())
+
+    def test_check_command_fails_if_row_is_missing(self):
+        models.HierarchyPath.objects.filter(depth=1).delete()
+        with self.assertRaises(CommandError):
+            call_command('check_hierarchy_paths', stdout=StringIO())
+
+    def test_rebuild_command_restores_missing_rows(self):
+        models.HierarchyPath.objects.all().delete()
+
+        call_command('rebuild_hierarchy_paths', stdout=StringIO())
+
+        customer = self.resource.service_project_link.project.customer
+        self.assertEqual(customer.get_descendants(model=models.ResourceMixin), [self.resource])
+
+
+class ReindexResourcesCommandTest(TestCase):
+
+    def test_missing_resources_are_indexed(self):
+        resource = factories.TestNewInstanceFactory()
+        models.ResourceIndex.objects.all().delete()
+
+        call_command('reindex_resources', stdout=StringIO())
+
+        index = models.ResourceIndex.objects.get(object_id=resource.pk)
+        self.assertEqual(index.uuid, resource.uuid.hex)
+        self.assertEqual(index.customer, resource.service_project_link.project.customer)
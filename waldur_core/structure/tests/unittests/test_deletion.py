@@ -0,0 +1,108 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import models as django_models
+from django.db.models import ProtectedError
+from django.test import TestCase
+from six import StringIO
+
+from waldur_core.quotas.models import Quota
+from waldur_core.structure import models
+from waldur_core.structure.deletion import DeletionPlan, get_field_update_value
+from waldur_core.structure.tests import fixtures, models as test_models
+
+
+class DeletionPlanTest(TestCase):
+
+    def setUp(self):
+        self.fixture = fixtures.ServiceFixture()
+        self.project = self.fixture.project
+        self.link = self.fixture.service_project_link
+        self.resource = self.fixture.resource
+        self.queryset = models.Project.objects.filter(pk=self.project.pk)
+
+    def get_quotas(self, scope):
+        content_type = ContentType.objects.get_for_model(scope)
+        return Quota.objects.filter(content_type=content_type, object_id=scope.pk)
+
+    def test_dependents_are_collected(self):
+        plan = DeletionPlan(self.queryset, cascade_protected=True)
+
+        self.assertEqual(plan.deleted[models.Project], {self.project.pk})
+        self.assertEqual(plan.deleted[test_models.TestServiceProjectLink], {self.link.pk})
+        self.assertEqual(plan.deleted[test_models.TestNewInstance], {self.resource.pk})
+        self.assertTrue(set(self.get_quotas(self.project).values_list('pk', flat=True)) <= plan.deleted[Quota])
+        self.assertFalse(plan.deleted[models.Customer])
+
+    def test_dependents_are_deleted_before_objects_they_refer_to(self):
+        ordered_models = DeletionPlan(self.queryset, cascade_protected=True).get_ordered_models()
+
+        self.assertLess(ordered_models.index(test_models.TestNewInstance),
+                        ordered_models.index(test_models.TestServiceProjectLink))
+        self.assertLess(ordered_models.index(test_models.TestServiceProjectLink), ordered_models.index(models.Project))
+        self.assertLess(ordered_models.index(Quota), ordered_models.index(models.Project))
+
+    def test_protected_objects_prevent_deletion(self):
+        plan = DeletionPlan(self.queryset)
+
+        self.assertIn(('protected', 'structure_tests.TestNewInstance', 1), plan.get_report())
+        self.assertRaises(ProtectedError, plan.execute)
+        self.assertTrue(models.Project.objects.filter(pk=self.project.pk).exists())
+
+    def test_plan_is_executed(self):
+        quotas = self.get_quotas(self.project)
+        self.assertTrue(quotas.exists())
+
+        DeletionPlan(self.queryset, cascade_protected=True, chunk_size=1).execute()
+
+        self.assertFalse(models.Project.objects.filter(pk=self.project.pk).exists())
+        self.assertFalse(test_models.TestServiceProjectLink.objects.filter(pk=self.link.pk).exists())
+        self.assertFalse(test_models.TestNewInstance.objects.filter(pk=self.resource.pk).exists())
+        self.assertFalse(quotas.exists())
+        self.assertFalse(models.HierarchyPath.objects.filter(
+            descendant_content_type=ContentType.objects.get_for_model(models.Project),
+            descendant_id=self.project.pk).exists())
+        self.assertTrue(models.Customer.objects.filter(pk=self.fixture.customer.pk).exists())
+        self.assertTrue(test_models.TestService.objects.filter(pk=self.fixture.service.pk).exists())
+
+    def test_tag_index_of_deleted_resource_is_deleted(self):
+        self.resource.tags.add('production')
+
+        DeletionPlan(self.queryset, cascade_protected=True).execute()
+
+        self.assertFalse(models.TagIndex.objects.filter(
+            content_type=ContentType.objects.get_for_model(self.resource),
+            object_id=self.resource.pk).exists())
+
+    def test_value_is_taken_from_set_default_and_set_handlers(self):
+        field = django_models.ForeignKey(models.Customer, on_delete=django_models.SET_DEFAULT, default=5)
+        self.assertEqual(get_field_update_value(field), 5)
+
+        field = django_models.ForeignKey(models.Customer, on_delete=django_models.SET(lambda: 7))
+        self.assertEqual(get_field_update_value(field), 7)
+
+    def test_custom_on_delete_handler_is_not_supported(self):
+        field = django_models.ForeignKey(models.Customer, on_delete=lambda *args: None)
+        self.assertRaises(NotImplementedError, get_field_update_value, field)
+
+
+class DeleteStructureCommandTest(TestCase):
+
+    def setUp(self):
+        self.fixture = fixtures.ProjectFixture()
+        self.project = self.fixture.project
+
+    def test_dry_run_reports_row_counts(self):
+        output = StringIO()
+        call_command('delete_structure', 'project', self.project.uuid.hex, '--dry-run', stdout=output)
+
+        self.assertIn('delete structure.Project: 1', output.getvalue())
+        self.assertTrue(models.Project.objects.filter(pk=self.project.pk).exists())
+
+    def test_customer_with_projects_is_deleted_only_with_force_option(self):
+        customer_uuid = self.fixture.customer.uuid.hex
+        self.assertRaises(CommandError, call_command, 'delete_structure', 'customer', customer_uuid, stdout=StringIO())
+
+        call_command('delete_structure', 'customer', customer_uuid, '--force', stdout=StringIO())
+        self.assertFalse(models.Customer.objects.filter(pk=self.fixture.customer.pk).exists())
+        self.assertFalse(models.Project.objects.filter(pk=self.project.pk).exists())
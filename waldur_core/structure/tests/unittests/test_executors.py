@@ -0,0 +1,200 @@
+from django.contrib import messages
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django_fsm import ConcurrentTransition, TransitionNotAllowed
+from django_fsm.signals import post_transition
+from mock_django import mock_signal_receiver
+from six.moves import mock
+
+from waldur_core.core import admin as core_admin, executors as core_executors, tasks as core_tasks
+from waldur_core.structure import models as structure_models
+from waldur_core.structure.tests import factories, models
+
+States = models.TestNewInstance.States
+
+
+class TestDeleteExecutor(core_executors.DeleteExecutor):
+
+    @classmethod
+    def get_task_signature(cls, instance, serialized_instance, **kwargs):
+        return core_tasks.EmptyTask().si()
+
+
+class TestActionExecutor(core_executors.ActionExecutor):
+    action = 'Restart'
+
+    @classmethod
+    def get_task_signature(cls, instance, serialized_instance, **kwargs):
+        return core_tasks.EmptyTask().si()
+
+
+class TestCustomDeleteExecutor(TestDeleteExecutor):
+
+    @classmethod
+    def pre_apply(cls, instance, **kwargs):
+        instance.atomic_transition('schedule_deleting', runtime_state='deleting')
+
+
+class TestCustomExecuteDeleteExecutor(TestDeleteExecutor):
+
+    @classmethod
+    def execute(cls, instance, **kwargs):
+        instance.name = 'executed'
+        instance.save(update_fields=['name'])
+        return super(TestCustomExecuteDeleteExecutor, cls).execute(instance, **kwargs)
+
+
+@mock.patch('waldur_core.core.executors.group')
+class ExecuteManyTest(TestCase):
+
+    def setUp(self):
+        self.instances = factories.TestNewInstanceFactory.create_batch(3, state=States.OK)
+
+    def test_instances_are_scheduled_with_single_update_query(self, group):
+        with CaptureQueriesContext(connection) as context:
+            errors = TestDeleteExecutor.execute_many(self.instances)
+
+        self.assertEqual(errors, {})
+        table = models.TestNewInstance._meta.db_table
+        updates = [query for query in context.captured_queries
+                   if query['sql'].startswith('UPDATE') and table in query['sql']]
+        self.assertEqual(len(updates), 1)
+        for instance in self.instances:
+            instance.refresh_from_db()
+            self.assertEqual(instance.state, States.DELETION_SCHEDULED)
+
+    def test_signatures_are_published_in_chunks(self, group):
+        TestDeleteExecutor.execute_many(self.instances, chunk_size=2)
+
+        self.assertEqual(group.call_count, 2)
+        self.assertEqual(len(group.call_args_list[0][0][0]), 2)
+        self.assertEqual(len(group.call_args_list[1][0][0]), 1)
+        signature = group.call_args_list[0][0][0][0]
+        self.assertEqual(signature.options['link'].task, core_tasks.DeletionTask().name)
+
+    def test_instance_with_invalid_state_is_reported_as_failure(self, group):
+        erred_instance = self.instances[0]
+        erred_instance.state = States.CREATING
+        erred_instance.save()
+
+        errors = TestDeleteExecutor.execute_many(self.instances)
+
+        self.assertEqual(list(errors.keys()), [erred_instance])
+        self.assertIsInstance(errors[erred_instance], TransitionNotAllowed)
+        self.assertEqual(len(group.call_args[0][0]), 2)
+
+    def test_concurrently_changed_instance_is_reported_as_failure(self, group):
+        changed_instance = self.instances[0]
+        models.TestNewInstance.objects.filter(pk=changed_instance.pk).update(state=States.UPDATING)
+
+        errors = TestDeleteExecutor.execute_many(self.instances)
+
+        self.assertEqual(list(errors.keys()), [changed_instance])
+        self.assertIsInstance(errors[changed_instance], ConcurrentTransition)
+        changed_instance.refresh_from_db()
+        self.assertEqual(changed_instance.state, States.UPDATING)
+
+    def test_custom_pre_apply_is_used_for_each_instance(self, group):
+        TestCustomDeleteExecutor.execute_many(self.instances)
+
+        for instance in self.instances:
+            instance.refresh_from_db()
+            self.assertEqual(instance.state, States.DELETION_SCHEDULED)
+            self.assertEqual(instance.runtime_state, 'deleting')
+
+    @mock.patch('waldur_core.core.executors.BaseExecutor.apply_signature')
+    def test_custom_execute_is_used_for_each_instance(self, apply_signature, group):
+        errors = TestCustomExecuteDeleteExecutor.execute_many(self.instances)
+
+        self.assertEqual(errors, {})
+        self.assertFalse(group.called)
+        self.assertEqual(apply_signature.call_count, 3)
+        for instance in self.instances:
+            instance.refresh_from_db()
+            self.assertEqual(instance.name, 'executed')
+            self.assertEqual(instance.state, States.DELETION_SCHEDULED)
+
+    def test_action_executor_schedules_updating(self, group):
+        errors = TestActionExecutor.execute_many(self.instances)
+
+        self.assertEqual(errors, {})
+        for instance in self.instances:
+            instance.refresh_from_db()
+            self.assertEqual(instance.state, States.UPDATE_SCHEDULED)
+
+
+class TransitionManyTest(TestCase):
+
+    def test_post_transition_is_sent_for_each_transited_instance(self):
+        instances = factories.TestNewInstanceFactory.create_batch(2, state=States.CREATING)
+
+        with mock_signal_receiver(post_transition) as receiver:
+            transited, errors = core_executors.transition_many(instances, 'set_ok')
+
+        self.assertEqual(errors, {})
+        self.assertEqual(receiver.call_count, 2)
+        for call in receiver.call_args_list:
+            self.assertEqual(call[1]['source'], States.CREATING)
+            self.assertEqual(call[1]['target'], States.OK)
+
+    def test_resource_index_is_updated_for_transited_instances(self):
+        instances = factories.TestNewInstanceFactory.create_batch(2, state=States.OK)
+
+        core_executors.transition_many(instances, 'schedule_deleting')
+
+        states = structure_models.ResourceIndex.objects.filter(
+            object_id__in=[instance.pk for instance in instances]).values_list('state', flat=True)
+        self.assertEqual(list(states), [States.DELETION_SCHEDULED] * 2)
+
+    def test_concurrently_changed_instance_is_restored(self):
+        instance = factories.TestNewInstanceFactory(state=States.OK, name='original')
+        models.TestNewInstance.objects.filter(pk=instance.pk).update(state=States.UPDATING)
+
+        transited, errors = core_executors.transition_many(
+            [instance], 'schedule_updating', lambda instance: dict(name='renamed'))
+
+        self.assertEqual(transited, [])
+        self.assertIsInstance(errors[instance], ConcurrentTransition)
+        self.assertEqual(instance.state, States.OK)
+        self.assertEqual(instance.name, 'original')
+
+    def test_provisioning_slot_is_released_for_transited_instance(self):
+        instance = factories.TestNewInstanceFactory(state=States.CREATING)
+        semaphore = mock.Mock()
+
+        with mock.patch('waldur_core.structure.utils.get_provisioning_semaphore', return_value=semaphore):
+            core_executors.transition_many([instance], 'set_ok')
+
+        semaphore.release.assert_called_once_with(instance.pk)
+
+
+class TestDeleteAction(core_admin.ExecutorAdminAction):
+    executor = TestDeleteExecutor
+
+    def validate(self, instance):
+        if instance.state == States.CREATING:
+            raise ValidationError('Instance is being created.')
+
+
+@mock.patch('waldur_core.core.executors.group')
+class ExecutorAdminActionTest(TestCase):
+
+    def test_validation_and_scheduling_failures_are_reported(self, group):
+        ok_instance = factories.TestNewInstanceFactory(state=States.OK)
+        creating_instance = factories.TestNewInstanceFactory(state=States.CREATING)
+        deleting_instance = factories.TestNewInstanceFactory(state=States.DELETING)
+        admin_class = mock.Mock()
+
+        TestDeleteAction()(admin_class, None, models.TestNewInstance.objects.order_by('pk'))
+
+        self.assertEqual(len(group.call_args[0][0]), 1)
+        levels = [call[1].get('level') for call in admin_class.message_user.call_args_list]
+        self.assertEqual(levels.count(messages.ERROR), 2)
+        ok_instance.refresh_from_db()
+        self.assertEqual(ok_instance.state, States.DELETION_SCHEDULED)
+        deleting_instance.refresh_from_db()
+        self.assertEqual(deleting_instance.state, States.DELETING)
+        creating_instance.refresh_from_db()
+        self.assertEqual(creating_instance.state, States.CREATING)
@@ -0,0 +1,83 @@
+import os
+import tempfile
+
+from django.test import TestCase
+from six.moves import mock
+
+from waldur_core.core import utils
+from waldur_core.core.tests.helpers import override_waldur_core_settings
+from waldur_core.structure import geoip, tasks
+from waldur_core.structure.tests import factories
+
+DATABASE = """ip_start,ip_end,latitude,longitude
+10.0.0.0,10.0.0.255,10.5,20.5
+8.8.0.0,8.8.255.255,37.4,-122.1
+2001:db8::,2001:db8::ffff,50.1,8.6
+invalid,row
+"""
+
+
+class DatabaseResolverTest(TestCase):
+    def setUp(self):
+        database = tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=False)
+        database.write(DATABASE)
+        database.close()
+        self.path = database.name
+        self.addCleanup(os.remove, self.path)
+        self.resolver = geoip.DatabaseResolver(self.path)
+
+    def test_invalid_rows_are_skipped(self):
+        self.assertEqual(len(self.resolver.starts), 3)
+
+    def test_address_is_resolved_by_range(self):
+        self.assertEqual(self.resolver.resolve('8.8.8.8'), geoip.Coordinates(37.4, -122.1))
+        self.assertEqual(self.resolver.resolve('10.0.0.255'), geoip.Coordinates(10.5, 20.5))
+        self.assertEqual(self.resolver.resolve('2001:db8::1'), geoip.Coordinates(50.1, 8.6))
+
+    def test_address_outside_of_ranges_is_not_resolved(self):
+        self.assertIsNone(self.resolver.resolve('9.0.0.1'))
+        self.assertIsNone(self.resolver.resolve('1.1.1.1'))
+        self.assertIsNone(self.resolver.resolve('192.168.0.1'))
+
+    def test_invalid_address_raises_exception(self):
+        self.assertRaises(geoip.GeoIpException, self.resolver.resolve, 'localhost')
+
+    def test_batch_resolution(self):
+        coordinates = self.resolver.resolve_many(['10.0.0.1', '9.0.0.1', '8.8.4.4', 'localhost', '10.0.0.1'])
+        self.assertEqual(coordinates, {
+            '10.0.0.1': geoip.Coordinates(10.5, 20.5),
+            '8.8.4.4': geoip.Coordinates(37.4, -122.1),
+            '9.0.0.1': None,
+        })
+
+    def test_results_are_memoized(self):
+        with mock.patch.object(self.resolver, 'lookup_many', wraps=self.resolver.lookup_many) as lookup_many:
+            self.resolver.resolve_many(['8.8.8.8', '10.0.0.1'])
+            self.resolver.resolve_many(['8.8.8.8'])
+            self.resolver.resolve('10.0.0.1')
+
+        self.assertEqual(lookup_many.call_count, 1)
+
+    def test_missing_database_raises_exception(self):
+        self.assertRaises(geoip.GeoIpException, geoip.DatabaseResolver, self.path + '.missing')
+
+    def test_batch_task_sets_coordinates(self):
+        instances = factories.TestNewInstanceFactory.create_batch(2)
+
+        with override_waldur_core_settings(GEOIP_RESOLVER='waldur_core.structure.geoip.DatabaseResolver',
+                                           GEOIP_DATABASE=self.path):
+            tasks.detect_vm_coordinates_batch([utils.serialize_instance(instance) for instance in instances])
+
+        for instance in instances:
+            instance.refresh_from_db()
+            self.assertEqual((instance.latitude, instance.longitude), (37.4, -122.1))
+
+    @override_waldur_core_settings(GEOIP_RESOLVER='waldur_core.structure.geoip.HttpResolver')
+    @mock.patch('waldur_core.structure.tasks.detect_vm_coordinates.delay')
+    def test_batch_task_schedules_task_per_virtual_machine_if_batch_lookup_is_not_supported(self, delay):
+        instances = factories.TestNewInstanceFactory.create_batch(2)
+        serialized = [utils.serialize_instance(instance) for instance in instances]
+
+        tasks.detect_vm_coordinates_batch(serialized)
+
+        self.assertEqual([call[0][0] for call in delay.call_args_list], serialized)
@@ -1,9 +1,11 @@
+from django.db.models.signals import post_save
 from django.test import TestCase
+from mock_django import mock_signal_receiver
 from six.moves import mock
 
-from .. import factories, fixtures
+from .. import factories, fixtures, models
 
-from waldur_core.structure import models as structure_models
+from waldur_core.structure import managers, models as structure_models
 
 
 class LogProjectSaveTest(TestCase):
@@ -135,3 +137,126 @@ class LogRoleEventTest(TestCase):
                     'role_name': 'Manager',
                 },
             )
+
+
+class UserScopeAccessTest(TestCase):
+
+    def setUp(self):
+        self.fixture = fixtures.ProjectFixture()
+        self.project = self.fixture.project
+        self.customer = self.fixture.customer
+        self.user = factories.UserFactory()
+
+    def get_rows(self):
+        return structure_models.UserScopeAccess.get_stored_rows(user=self.user)
+
+    def test_row_is_created_when_role_is_granted(self):
+        self.project.add_user(self.user, structure_models.ProjectRole.ADMINISTRATOR)
+        self.customer.add_user(self.user, structure_models.CustomerRole.OWNER)
+
+        self.assertEqual(self.get_rows(), {
+            (self.user.id, self.customer.id, self.project.id, structure_models.ProjectRole.ADMINISTRATOR),
+            (self.user.id, self.customer.id, None, structure_models.CustomerRole.OWNER),
+        })
+
+    def test_row_is_deleted_when_role_is_revoked(self):
+        self.project.add_user(self.user, structure_models.ProjectRole.ADMINISTRATOR)
+        self.project.remove_user(self.user)
+
+        self.assertEqual(self.get_rows(), set())
+
+    def test_access_is_synced_once_when_role_is_granted_and_revoked(self):
+        with mock.patch.object(structure_models.UserScopeAccess, 'sync') as sync:
+            self.project.add_user(self.user, structure_models.ProjectRole.ADMINISTRATOR)
+            self.assertEqual(sync.call_count, 1)
+            self.project.remove_user(self.user)
+            self.assertEqual(sync.call_count, 2)
+
+    def test_row_is_deleted_when_expired_permission_is_revoked(self):
+        permission, _ = self.customer.add_user(self.user, structure_models.CustomerRole.OWNER)
+        permission.revoke()
+
+        self.assertEqual(self.get_rows(), set())
+
+    def test_row_is_updated_when_project_is_moved(self):
+        self.project.add_user(self.user, structure_models.ProjectRole.MANAGER)
+        new_customer = factories.CustomerFactory()
+
+        self.project.customer = new_customer
+        self.project.save()
+
+        self.assertEqual(self.get_rows(), {
+            (self.user.id, new_customer.id, self.project.id, structure_models.ProjectRole.MANAGER),
+        })
+
+    def test_rows_are_deleted_with_project(self):
+        self.project.add_user(self.user, structure_models.ProjectRole.MANAGER)
+        self.project.delete()
+
+        self.assertEqual(self.get_rows(), set())
+
+    def test_queryset_is_filtered_without_distinct(self):
+        self.project.add_user(self.user, structure_models.ProjectRole.ADMINISTRATOR)
+        self.customer.add_user(self.user, structure_models.CustomerRole.OWNER)
+        factories.ProjectFactory(customer=self.customer)
+        factories.CustomerFactory()
+
+        queryset = structure_models.filter_queryset_for_user(structure_models.Customer.objects.all(), self.user)
+
+        self.assertFalse(queryset.query.distinct)
+        self.assertEqual(list(queryset), [self.customer])
+
+    def test_summary_queryset_is_not_changed_by_filtering(self):
+        summary_queryset = managers.ResourceSummaryQuerySet([models.TestNewInstance])
+        querysets = summary_queryset.querysets
+
+        filtered = structure_models.filter_queryset_for_user(summary_queryset, self.user)
+
+        self.assertIsNot(filtered, summary_queryset)
+        self.assertIs(summary_queryset.querysets, querysets)
+
+
+class SharedServiceConnectionTest(TestCase):
+
+    def setUp(self):
+        self.shared_settings = factories.ServiceSettingsFactory(shared=True)
+
+    def test_new_customer_is_connected_to_shared_settings(self):
+        customer = factories.CustomerFactory()
+
+        service = models.TestService.objects.get(customer=customer, settings=self.shared_settings)
+        self.assertTrue(service.available_for_all)
+        self.assertEqual(customer.quotas.get(name='nc_service_count').usage, 1)
+        self.assertIn(customer, service.get_ancestors())
+
+    def test_post_save_signal_is_sent_for_service_of_new_customer(self):
+        with mock_signal_receiver(post_save, sender=models.TestService) as receiver:
+            customer = factories.CustomerFactory()
+
+        service = models.TestService.objects.get(customer=customer, settings=self.shared_settings)
+        self.assertEqual(receiver.call_count, 1)
+        self.assertEqual(receiver.call_args[1]['instance'], service)
+        self.assertTrue(receiver.call_args[1]['created'])
+
+    def test_post_save_signal_is_sent_for_links_of_new_project(self):
+        customer = factories.CustomerFactory()
+
+        with mock_signal_receiver(post_save, sender=models.TestServiceProjectLink) as receiver:
+            project = factories.ProjectFactory(customer=customer)
+
+        link = models.TestServiceProjectLink.objects.get(project=project)
+        self.assertEqual(receiver.call_count, 1)
+        self.assertEqual(receiver.call_args[1]['instance'], link)
+        self.assertTrue(receiver.call_args[1]['created'])
+
+    def test_new_project_is_connected_to_services_available_for_all(self):
+        customer = factories.CustomerFactory()
+        private_service = factories.TestServiceFactory(customer=customer)
+
+        project = factories.ProjectFactory(customer=customer)
+
+        links = models.TestServiceProjectLink.objects.filter(project=project)
+        self.assertEqual([link.service.settings for link in links], [self.shared_settings])
+        self.assertFalse(links.filter(service=private_service).exists())
+        self.assertEqual(project.quotas.get(name='nc_service_project_link_count').usage, 1)
+        self.assertEqual(links[0].quotas.get(name='vcpu').limit, 20)
@@ -0,0 +1,67 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from waldur_core.structure import managers, models as structure_models
+from waldur_core.structure.tests import factories, models
+
+
+class ResourceSummaryQuerySetTest(TestCase):
+
+    def setUp(self):
+        link = factories.TestServiceProjectLinkFactory()
+        self.instances = [
+            factories.TestNewInstanceFactory(name=name, service_project_link=link)
+            for name in ('a', 'c', 'e')
+        ]
+        self.volumes = [
+            models.TestVolume.objects.create(name=name, service_project_link=link, size=1)
+            for name in ('b', 'd')
+        ]
+
+    def get_queryset(self):
+        return managers.ResourceSummaryQuerySet([models.TestNewInstance, models.TestVolume])
+
+    def test_count_includes_objects_of_all_models(self):
+        self.assertEqual(self.get_queryset().count(), 5)
+        self.assertEqual(self.get_queryset().filter(name__in=['a', 'b']).count(), 2)
+
+    def test_objects_of_different_models_are_ordered_together(self):
+        queryset = self.get_queryset().order_by('-name')
+        self.assertEqual([obj.name for obj in queryset], ['e', 'd', 'c', 'b', 'a'])
+
+    def test_names_are_ordered_ignoring_case(self):
+        models.TestNewInstance.objects.filter(name='c').update(name='C')
+        models.TestVolume.objects.filter(name='b').update(name='B')
+
+        queryset = self.get_queryset().order_by('name')
+        self.assertEqual([obj.name for obj in queryset], ['a', 'B', 'C', 'd', 'e'])
+
+    def test_null_values_go_first_in_ascending_order_and_last_in_descending_order(self):
+        structure_models.ServiceSettings.objects.update(username=None)
+        link = factories.TestServiceProjectLinkFactory(service__settings__username='admin')
+        models.TestNewInstance.objects.update(service_project_link=link)
+        volumes = set(self.volumes)
+        ordering = 'service_project_link__service__settings__username'
+
+        ascending = list(self.get_queryset().order_by(ordering))
+        self.assertEqual(set(ascending[:2]), volumes)
+        self.assertEqual(ascending[2:], self.instances)
+
+        descending = list(self.get_queryset().order_by('-' + ordering))
+        self.assertEqual(descending[:3], self.instances)
+        self.assertEqual(set(descending[3:]), volumes)
+
+    def test_page_is_sliced_by_database(self):
+        queryset = self.get_queryset().order_by('name')
+
+        with CaptureQueriesContext(connection) as context:
+            page = queryset[2:4]
+
+        self.assertEqual(page, [self.instances[1], self.volumes[1]])
+        # One query for union and one query per each model in the page.
+        self.assertEqual(len(context.captured_queries), 3)
+
+    def test_index_outside_of_queryset_raises_error(self):
+        with self.assertRaises(IndexError):
+            self.get_queryset()[10]
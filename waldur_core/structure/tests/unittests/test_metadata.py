@@ -1,7 +1,10 @@
 from django.test import TestCase
 from rest_framework import serializers
+from rest_framework.test import APIRequestFactory
 
+from waldur_core.core import models as core_models
 from waldur_core.structure.metadata import ActionsMetadata
+from waldur_core.structure.tests import factories
 
 
 class ResourceProvisioningMetadataTest(TestCase):
@@ -44,3 +47,76 @@ class ResourceProvisioningMetadataTest(TestCase):
 
         self.assertIn('choices', serializer_info['state'])
         self.assertNotIn('choices', serializer_info['image'])
+
+
+class SshPublicKeySerializer(serializers.Serializer):
+    ssh_public_key = serializers.HyperlinkedRelatedField(
+        view_name='sshpublickey-detail',
+        lookup_field='uuid',
+        queryset=core_models.SshPublicKey.objects.all())
+
+    def get_fields(self):
+        fields = super(SshPublicKeySerializer, self).get_fields()
+        fields['ssh_public_key'].query_params = {'user_uuid': self.context['request'].user.uuid.hex}
+        return fields
+
+
+class SshPublicKeyView(object):
+    serializer_class = serializers.Serializer
+
+    def __init__(self, request):
+        self.request = request
+
+    def get_serializer_class(self):
+        return SshPublicKeySerializer
+
+    def get_serializer(self, *args, **kwargs):
+        return SshPublicKeySerializer(*args, context={'request': self.request}, **kwargs)
+
+
+class DescriptionSerializer(serializers.Serializer):
+    description = serializers.CharField()
+
+
+class DescriptionView(SshPublicKeyView):
+    instantiated = 0
+
+    def get_serializer_class(self):
+        return DescriptionSerializer
+
+    def get_serializer(self, *args, **kwargs):
+        DescriptionView.instantiated += 1
+        return DescriptionSerializer(*args, context={'request': self.request}, **kwargs)
+
+
+class ActionFieldsMetadataTest(TestCase):
+    def setUp(self):
+        ActionsMetadata._fields_cache.clear()
+
+    def get_action_fields(self, user, view_class=SshPublicKeyView):
+        request = APIRequestFactory().options('/')
+        request.user = user
+        options = ActionsMetadata()
+        options.request = request
+        return options.get_action_fields(view_class(request), 'set_key', None)
+
+    def test_serializer_is_not_instantiated_if_fields_do_not_depend_on_request(self):
+        DescriptionView.instantiated = 0
+        user = factories.UserFactory()
+
+        first = self.get_action_fields(user, DescriptionView)
+        second = self.get_action_fields(user, DescriptionView)
+
+        self.assertEqual(first, second)
+        self.assertIn('description', second)
+        self.assertEqual(DescriptionView.instantiated, 1)
+
+    def test_query_params_of_cached_fields_are_computed_for_each_user(self):
+        user1 = factories.UserFactory()
+        user2 = factories.UserFactory()
+
+        url1 = self.get_action_fields(user1)['ssh_public_key']['url']
+        url2 = self.get_action_fields(user2)['ssh_public_key']['url']
+
+        self.assertTrue(url1.endswith('?user_uuid=%s' % user1.uuid.hex))
+        self.assertTrue(url2.endswith('?user_uuid=%s' % user2.uuid.hex))
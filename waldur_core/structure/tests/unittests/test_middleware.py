@@ -0,0 +1,58 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from waldur_core.structure import middleware
+from waldur_core.structure.models import CustomerRole, ProjectRole
+from waldur_core.structure.tests import factories
+
+
+class PermissionCacheTest(TestCase):
+
+    def setUp(self):
+        self.user = factories.UserFactory()
+        self.customer = factories.CustomerFactory()
+        self.project = factories.ProjectFactory(customer=self.customer)
+        self.other_project = factories.ProjectFactory(customer=self.customer)
+        self.customer.add_user(self.user, CustomerRole.OWNER)
+        self.project.add_user(self.user, ProjectRole.ADMINISTRATOR)
+        middleware.enable_permission_cache()
+
+    def tearDown(self):
+        middleware.disable_permission_cache()
+
+    def test_permissions_are_loaded_once_per_permission_model(self):
+        with self.assertNumQueries(2):
+            self.assertTrue(self.customer.has_user(self.user))
+            self.assertTrue(self.customer.has_user(self.user, CustomerRole.OWNER))
+            self.assertFalse(self.customer.has_user(self.user, CustomerRole.SUPPORT))
+            self.assertTrue(self.project.has_user(self.user, ProjectRole.ADMINISTRATOR))
+            self.assertFalse(self.project.has_user(self.user, ProjectRole.MANAGER))
+            self.assertFalse(self.other_project.has_user(self.user))
+
+    def test_expiration_time_is_taken_into_account(self):
+        expiration_time = timezone.now() + timedelta(days=1)
+        self.project.permissions.filter(user=self.user).update(expiration_time=expiration_time)
+
+        self.assertTrue(self.project.has_user(self.user, timestamp=False))
+        self.assertFalse(self.project.has_user(self.user, timestamp=None))
+        self.assertTrue(self.project.has_user(self.user, timestamp=expiration_time - timedelta(hours=1)))
+        self.assertFalse(self.project.has_user(self.user, timestamp=expiration_time + timedelta(hours=1)))
+        self.assertTrue(self.customer.has_user(self.user, timestamp=None))
+
+    def test_cache_is_cleared_when_role_is_granted_or_revoked(self):
+        self.assertFalse(self.other_project.has_user(self.user))
+
+        self.other_project.add_user(self.user, ProjectRole.MANAGER)
+        self.assertTrue(self.other_project.has_user(self.user))
+
+        self.other_project.remove_user(self.user)
+        self.assertFalse(self.other_project.has_user(self.user))
+
+    def test_permissions_are_not_cached_if_cache_is_disabled(self):
+        middleware.disable_permission_cache()
+        self.customer.has_user(self.user)
+
+        with self.assertNumQueries(1):
+            self.customer.has_user(self.user)
@@ -1,6 +1,10 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django_fsm import ConcurrentTransition, TransitionNotAllowed
 
-from waldur_core.structure.tests import factories
+from waldur_core.structure import models as structure_models
+from waldur_core.structure.tests import factories, fixtures, models
 
 
 class ServiceProjectLinkTest(TestCase):
@@ -24,3 +28,110 @@ class ServiceProjectLinkTest(TestCase):
         self.link.service.settings.certifications.add(*certifications)
 
         self.assertEqual(self.link.States.OK, self.link.validation_state)
+
+
+class AtomicTransitionTest(TestCase):
+
+    def setUp(self):
+        self.instance = factories.TestNewInstanceFactory(state=models.TestNewInstance.States.OK)
+
+    def test_state_and_given_fields_are_updated_with_single_query(self):
+        with CaptureQueriesContext(connection) as context:
+            self.instance.atomic_transition('schedule_updating', error_message='Updating.')
+
+        table = models.TestNewInstance._meta.db_table
+        updates = [q['sql'] for q in context.captured_queries if q['sql'].startswith('UPDATE "%s"' % table)]
+        self.assertEqual(len(updates), 1)
+        self.instance.refresh_from_db()
+        self.assertEqual(self.instance.state, models.TestNewInstance.States.UPDATE_SCHEDULED)
+        self.assertEqual(self.instance.error_message, 'Updating.')
+
+    def test_concurrent_field_updates_are_not_lost(self):
+        models.TestNewInstance.objects.filter(pk=self.instance.pk).update(name='Concurrently updated')
+
+        self.instance.atomic_transition('schedule_updating')
+
+        self.instance.refresh_from_db()
+        self.assertEqual(self.instance.name, 'Concurrently updated')
+
+    def test_if_state_has_been_changed_concurrently_exception_is_raised(self):
+        models.TestNewInstance.objects.filter(pk=self.instance.pk).update(state=models.TestNewInstance.States.ERRED)
+
+        with self.assertRaises(ConcurrentTransition):
+            self.instance.atomic_transition('schedule_updating')
+
+        self.instance.refresh_from_db()
+        self.assertEqual(self.instance.state, models.TestNewInstance.States.ERRED)
+
+    def test_if_state_has_been_changed_concurrently_instance_is_restored(self):
+        models.TestNewInstance.objects.filter(pk=self.instance.pk).update(state=models.TestNewInstance.States.ERRED)
+
+        with self.assertRaises(ConcurrentTransition):
+            self.instance.atomic_transition('schedule_updating', error_message='Updating.')
+
+        self.assertEqual(self.instance.state, models.TestNewInstance.States.OK)
+        self.assertEqual(self.instance.error_message, '')
+
+    def test_if_transition_is_not_allowed_exception_is_raised(self):
+        with self.assertRaises(TransitionNotAllowed):
+            self.instance.atomic_transition('begin_creating')
+
+
+class HierarchyPathTest(TestCase):
+
+    def setUp(self):
+        self.fixture = fixtures.ServiceFixture()
+        self.resource = self.fixture.resource
+        self.link = self.fixture.service_project_link
+
+    def test_ancestors_are_ordered_by_depth(self):
+        ancestors = self.resource.get_ancestors()
+
+        self.assertEqual(ancestors[0], self.link)
+        self.assertEqual(set(ancestors[1:3]), {self.fixture.project, self.fixture.service})
+        self.assertEqual(set(ancestors[3:]), {self.fixture.customer, self.fixture.service_settings})
+
+    def test_descendants_of_model_are_fetched_without_traversing_hierarchy(self):
+        volume = self.fixture.volume
+        self.fixture.customer.get_descendants(model=structure_models.ResourceMixin)
+
+        # One query for paths and one query for each resource model.
+        with self.assertNumQueries(3):
+            descendants = self.fixture.customer.get_descendants(model=structure_models.ResourceMixin)
+
+        self.assertEqual(set(descendants), {self.resource, volume})
+
+    def test_paths_are_updated_when_project_is_moved(self):
+        new_customer = factories.CustomerFactory()
+        project = self.fixture.project
+        project.customer = new_customer
+        project.save()
+
+        self.assertIn(new_customer, self.resource.get_ancestors())
+        self.assertNotIn(project, self.fixture.customer.get_descendants())
+        self.assertEqual(set(new_customer.get_descendants()), {project, self.link, self.resource})
+        # Resource is still connected to old customer through service.
+        self.assertIn(self.fixture.customer, self.resource.get_ancestors())
+
+    def test_descendants_are_traversed_if_paths_are_not_stored(self):
+        structure_models.HierarchyPath.objects.all().delete()
+
+        descendants = self.fixture.customer.get_descendants(model=structure_models.ResourceMixin)
+
+        self.assertEqual(descendants, [self.resource])
+
+    def test_parents_of_loaded_node_are_compared_without_query(self):
+        link = models.TestServiceProjectLink.objects.get(pk=self.link.pk)
+
+        with self.assertNumQueries(0):
+            self.assertFalse(structure_models.HierarchyPath.has_parents_changed(link))
+
+        link.project = factories.ProjectFactory()
+        self.assertTrue(structure_models.HierarchyPath.has_parents_changed(link))
+
+    def test_paths_are_deleted_together_with_node(self):
+        self.resource.delete()
+
+        self.assertEqual(self.fixture.customer.get_descendants(model=structure_models.ResourceMixin), [])
+        self.assertFalse(structure_models.HierarchyPath.objects.filter(descendant_id=self.resource.pk).filter(
+            descendant_content_type__model=self.resource._meta.model_name).exists())
@@ -1,8 +1,10 @@
 from django.test import TestCase
+from rest_framework.test import APIRequestFactory
+from six.moves import mock
 
 from waldur_core.structure import SupportedServices, ServiceBackendNotImplemented
 from waldur_core.structure.tests import TestConfig, TestBackend
-from waldur_core.structure.tests.models import TestService, TestNewInstance
+from waldur_core.structure.tests.models import TestService, TestServiceProjectLink, TestNewInstance
 from waldur_core.structure.tests.serializers import ServiceSerializer
 
 
@@ -26,3 +28,51 @@ class ServiceRegistryTest(TestCase):
     def test_model_key(self):
         self.assertEqual(TestConfig.service_name,
                          SupportedServices.get_model_key(TestNewInstance))
+
+    def test_model_key_of_instance(self):
+        self.assertEqual(TestConfig.service_name,
+                         SupportedServices.get_model_key(TestNewInstance()))
+
+    def test_get_related_models(self):
+        for model in (TestService, TestServiceProjectLink, TestNewInstance):
+            related_models = SupportedServices.get_related_models(model)
+            self.assertEqual(TestService, related_models['service'])
+            self.assertIn(TestNewInstance, related_models['resources'])
+
+
+class ServiceRegistryCacheTest(TestCase):
+    def setUp(self):
+        SupportedServices._clear_cache()
+
+    def test_service_models_are_not_shared_between_callers(self):
+        service_models = SupportedServices.get_service_models()
+        service_models[TestConfig.service_name]['resources'].append(TestService)
+        del service_models[TestConfig.service_name]
+
+        service_models = SupportedServices.get_service_models()
+        self.assertEqual(service_models[TestConfig.service_name]['resources'], [TestNewInstance])
+
+    def test_absolute_urls_are_built_for_request(self):
+        request = APIRequestFactory().get('/')
+        path = SupportedServices.get_services()[TestConfig.service_name]
+        url = SupportedServices.get_services(request)[TestConfig.service_name]
+        self.assertEqual(url, 'http://testserver' + path)
+
+    def test_app_config_is_resolved_only_once(self):
+        SupportedServices._get_app_config.cache_clear()
+        with mock.patch('django.apps.apps.get_containing_app_config') as get_app_config:
+            get_app_config.return_value.service_name = TestConfig.service_name
+            for _ in range(3):
+                SupportedServices.get_model_key(TestNewInstance)
+
+        self.assertEqual(get_app_config.call_count, 1)
+        SupportedServices._get_app_config.cache_clear()
+
+    def test_cache_is_cleared_when_registry_is_changed(self):
+        SupportedServices.get_service_models()
+        with mock.patch.dict(SupportedServices._registry):
+            SupportedServices._setdefault('Dummy')
+            SupportedServices._registry['Dummy']['name'] = 'Dummy'
+            self.assertIn('Dummy', dict(SupportedServices.get_choices()))
+        SupportedServices._clear_cache()
+        self.assertNotIn('Dummy', dict(SupportedServices.get_choices()))
@@ -1,9 +1,16 @@
+from django.core.cache import cache
 from django.test import TestCase
+from taggit.models import Tag
+
+from waldur_core.structure.models import ServiceSettings, TagMixin
 
 from .. import factories as structure_factories
 
 
 class TagCacheTask(TestCase):
+    def setUp(self):
+        cache.clear()
+
     def test_cache_populated_when_tag_added(self):
         settings = structure_factories.ServiceSettingsFactory()
         settings.tags.add('IAAS')
@@ -14,3 +21,58 @@ class TagCacheTask(TestCase):
         settings.tags.add('IAAS')
         settings.tags.remove('IAAS')
         self.assertEqual(settings.get_tags(), [])
+
+    def test_cache_of_other_objects_is_not_cleaned_when_tag_added(self):
+        settings, other_settings = structure_factories.ServiceSettingsFactory.create_batch(2)
+        other_settings.tags.add('IAAS')
+        other_settings.get_tags()
+
+        settings.tags.add('IAAS')
+
+        self.assertEqual(cache.get(other_settings._get_tag_cache_key()), ['IAAS'])
+        self.assertIsNone(cache.get(settings._get_tag_cache_key()))
+
+    def test_cache_cleaned_when_tag_renamed(self):
+        settings = structure_factories.ServiceSettingsFactory()
+        settings.tags.add('IAAS')
+        settings.get_tags()
+
+        tag = Tag.objects.get(name='IAAS')
+        tag.name = 'PAAS'
+        tag.save()
+
+        self.assertEqual(settings.get_tags(), ['PAAS'])
+
+
+class TagPrefetchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.settings = structure_factories.ServiceSettingsFactory.create_batch(3)
+        self.settings[0].tags.add('IAAS', 'PAAS')
+        self.settings[1].tags.add('IAAS')
+        self.instance = structure_factories.TestNewInstanceFactory()
+        self.instance.tags.add('VM')
+        cache.clear()
+
+    def test_tags_of_objects_missing_in_cache_are_loaded_with_single_query(self):
+        with self.assertNumQueries(1):
+            TagMixin.prefetch_tags(self.settings + [self.instance])
+
+        self.assertEqual(sorted(self.settings[0].get_tags()), ['IAAS', 'PAAS'])
+        self.assertEqual(self.settings[1].get_tags(), ['IAAS'])
+        self.assertEqual(self.settings[2].get_tags(), [])
+        self.assertEqual(self.instance.get_tags(), ['VM'])
+
+    def test_prefetched_tags_are_stored_in_cache(self):
+        TagMixin.prefetch_tags(self.settings)
+
+        self.assertEqual(cache.get(self.settings[1]._get_tag_cache_key()), ['IAAS'])
+        self.assertEqual(cache.get(self.settings[2]._get_tag_cache_key()), [])
+
+    def test_cached_tags_are_not_loaded_from_database(self):
+        TagMixin.prefetch_tags(self.settings)
+        settings = list(ServiceSettings.objects.filter(pk__in=[s.pk for s in self.settings]).order_by('pk'))
+
+        with self.assertNumQueries(0):
+            TagMixin.prefetch_tags(settings)
+            self.assertEqual(settings[1].get_tags(), ['IAAS'])
@@ -1,14 +1,25 @@
+from datetime import timedelta
+
+from celery.exceptions import Ignore
 from ddt import ddt, data
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+from mock_django import mock_signal_receiver
 from six.moves import mock
 
 from waldur_core.core import utils
-from waldur_core.structure import tasks
-from waldur_core.structure.tests import factories, models
+from waldur_core.core.tests.helpers import override_waldur_core_settings
+from waldur_core.structure import geoip, models as structure_models, signals, tasks, utils as structure_utils, \
+    ServiceBackendError
+from waldur_core.structure.tests import factories, fixtures, models
 
 
 class TestDetectVMCoordinatesTask(TestCase):
 
+    def setUp(self):
+        geoip.get_resolver()._cache.clear()
+
     @mock.patch('requests.get')
     def test_task_sets_coordinates(self, mock_request_get):
         ip_address = "127.0.0.1"
@@ -37,9 +48,74 @@ class TestDetectVMCoordinatesTask(TestCase):
         self.assertIsNone(instance.longitude)
 
 
+class CheckExpiredPermissionsTaskTest(TestCase):
+
+    def setUp(self):
+        self.fixture = fixtures.ProjectFixture()
+        self.customer = self.fixture.customer
+        self.project = self.fixture.project
+        self.user = factories.UserFactory()
+        self.customer.add_user(self.user, structure_models.CustomerRole.OWNER)
+        self.project.add_user(self.user, structure_models.ProjectRole.ADMINISTRATOR)
+        self.project.add_user(self.user, structure_models.ProjectRole.MANAGER)
+
+    def expire(self, permissions):
+        permissions.update(expiration_time=timezone.now() - timedelta(days=1))
+
+    def get_nc_user_count(self):
+        return self.customer.quotas.get(name=structure_models.Customer.Quotas.nc_user_count).usage
+
+    def test_expired_permissions_are_deactivated(self):
+        self.expire(self.project.permissions.filter(role=structure_models.ProjectRole.MANAGER))
+        tasks.check_expired_permissions()
+
+        self.assertTrue(self.customer.has_user(self.user, structure_models.CustomerRole.OWNER))
+        self.assertTrue(self.project.has_user(self.user, structure_models.ProjectRole.ADMINISTRATOR))
+        self.assertFalse(self.project.has_user(self.user, structure_models.ProjectRole.MANAGER))
+        self.assertEqual(self.get_nc_user_count(), 1)
+        self.assertFalse(structure_models.UserScopeAccess.objects.filter(
+            user=self.user, project=self.project, role=structure_models.ProjectRole.MANAGER).exists())
+        self.assertTrue(structure_models.UserScopeAccess.objects.filter(
+            user=self.user, project=self.project, role=structure_models.ProjectRole.ADMINISTRATOR).exists())
+
+    def test_user_stops_being_member_when_all_permissions_are_expired(self):
+        self.expire(self.customer.permissions.all())
+        self.expire(self.project.permissions.all())
+        tasks.check_expired_permissions()
+
+        self.assertEqual(self.get_nc_user_count(), 0)
+        self.assertFalse(structure_models.CustomerMembership.objects.filter(
+            customer=self.customer, user=self.user).exists())
+        self.assertFalse(structure_models.UserScopeAccess.objects.filter(user=self.user).exists())
+
+    def test_one_signal_is_sent_for_all_revoked_roles(self):
+        self.expire(self.project.permissions.all())
+
+        with mock_signal_receiver(signals.structure_role_bulk_revoked) as receiver:
+            tasks.check_expired_permissions()
+
+        self.assertEqual(receiver.call_count, 1)
+        roles = receiver.call_args[1]['roles']
+        self.assertEqual(sorted(role for _, _, role in roles), [
+            structure_models.ProjectRole.ADMINISTRATOR,
+            structure_models.ProjectRole.MANAGER,
+        ])
+        self.assertTrue(all(structure == self.project and user == self.user for structure, user, _ in roles))
+
+    def test_revoked_permissions_are_returned(self):
+        self.expire(self.customer.permissions.all())
+        permissions = structure_models.CustomerPermission.revoke_expired()
+
+        self.assertEqual([permission.user for permission in permissions], [self.user])
+        self.assertEqual(structure_models.CustomerPermission.revoke_expired(), [])
+
+
 @ddt
 class ThrottleProvisionTaskTest(TestCase):
 
+    def setUp(self):
+        cache.clear()
+
     @data(
         dict(size=tasks.ThrottleProvisionTask.DEFAULT_LIMIT + 1, retried=True),
         dict(size=tasks.ThrottleProvisionTask.DEFAULT_LIMIT - 1, retried=False),
@@ -61,3 +137,317 @@ class ThrottleProvisionTaskTest(TestCase):
             'create',
             state_transition='begin_starting').apply()
         self.assertEqual(mocked_retry.called, params['retried'])
+
+    def test_slot_is_released_when_resource_is_created(self):
+        link = factories.TestServiceProjectLinkFactory()
+        vms = factories.TestNewInstanceFactory.create_batch(
+            size=tasks.ThrottleProvisionTask.DEFAULT_LIMIT + 1,
+            state=models.TestNewInstance.States.CREATION_SCHEDULED,
+            service_project_link=link)
+        task = tasks.ThrottleProvisionTask()
+        results = [task.is_available(vm) for vm in vms]
+        self.assertEqual(results.count(False), 1)
+
+        vms[0].begin_creating()
+        vms[0].set_ok()
+
+        self.assertTrue(task.is_available(vms[-1]))
+
+    def test_limit_is_configured_per_service_settings(self):
+        link = factories.TestServiceProjectLinkFactory()
+        link.service.settings.options = {'max_concurrent_provisioning': 1}
+        link.service.settings.save()
+        first_vm, second_vm = factories.TestNewInstanceFactory.create_batch(
+            size=2, state=models.TestNewInstance.States.CREATION_SCHEDULED, service_project_link=link)
+        task = tasks.ThrottleProvisionTask()
+
+        self.assertTrue(task.is_available(first_vm))
+        self.assertFalse(task.is_available(second_vm))
+
+    def test_slot_is_released_when_task_fails(self):
+        link = factories.TestServiceProjectLinkFactory()
+        link.service.settings.options = {'max_concurrent_provisioning': 1}
+        link.service.settings.save()
+        first_vm, second_vm = factories.TestNewInstanceFactory.create_batch(
+            size=2, state=models.TestNewInstance.States.CREATION_SCHEDULED, service_project_link=link)
+        task = tasks.ThrottleProvisionTask()
+        task.is_available(first_vm)
+
+        task.on_failure(Exception(), 'task-id', (utils.serialize_instance(first_vm), 'create'), {}, None)
+
+        self.assertTrue(task.is_available(second_vm))
+
+
+class TestNewInstancePullTask(tasks.BackgroundPullTask):
+    def pull(self, instance):
+        instance.get_backend().pull_instance(instance)
+
+
+class TestNewInstanceListPullTask(tasks.BackgroundListPullTask):
+    model = models.TestNewInstance
+    pull_task = TestNewInstancePullTask
+    batch_size = 2
+
+
+@mock.patch('waldur_core.core.tasks.BackgroundTask.is_previous_task_processing', return_value=False)
+class BatchPullTaskTest(TestCase):
+
+    def setUp(self):
+        self.link = factories.TestServiceProjectLinkFactory()
+        self.instances = factories.TestNewInstanceFactory.create_batch(
+            size=3, state=models.TestNewInstance.States.OK, backend_id='VALID_ID', service_project_link=self.link)
+        self.other_instance = factories.TestNewInstanceFactory(
+            state=models.TestNewInstance.States.OK, backend_id='VALID_ID')
+        self.serialized_pull_task = utils.serialize_class(TestNewInstancePullTask)
+
+    @mock.patch('waldur_core.structure.tasks.BackgroundBatchPullTask.apply_async')
+    def test_list_task_schedules_one_task_per_settings_chunk(self, mocked_apply, _):
+        TestNewInstanceListPullTask().run()
+
+        chunks = [call[1]['args'][1] for call in mocked_apply.call_args_list]
+        serialized = [utils.serialize_instance(instance) for instance in self.instances]
+        self.assertEqual(chunks, [serialized[:2], serialized[2:], [utils.serialize_instance(self.other_instance)]])
+
+    def test_if_backend_implements_pull_many_it_is_called_once(self, _):
+        serialized = [utils.serialize_instance(instance) for instance in self.instances]
+
+        with mock.patch('waldur_core.structure.tests.TestBackend.pull_many', create=True) as pull_many:
+            with mock.patch('waldur_core.structure.tests.TestBackend.pull_instance', create=True) as pull_instance:
+                tasks.BackgroundBatchPullTask().run(self.serialized_pull_task, serialized)
+
+        self.assertEqual(pull_many.call_count, 1)
+        self.assertEqual(set(pull_many.call_args[0][0]), set(self.instances))
+        self.assertEqual(pull_instance.call_count, 0)
+
+    def test_if_backend_does_not_implement_pull_many_each_instance_is_pulled(self, _):
+        serialized = [utils.serialize_instance(instance) for instance in self.instances]
+
+        with mock.patch('waldur_core.structure.tests.TestBackend.pull_instance', create=True) as pull_instance:
+            tasks.BackgroundBatchPullTask().run(self.serialized_pull_task, serialized)
+
+        self.assertEqual(pull_instance.call_count, 3)
+
+    def test_instances_are_marked_as_erred_if_batch_pull_fails(self, _):
+        serialized = [utils.serialize_instance(instance) for instance in self.instances]
+
+        with mock.patch('waldur_core.structure.tests.TestBackend.pull_many', create=True) as pull_many:
+            pull_many.side_effect = ServiceBackendError('Backend is not available.')
+            tasks.BackgroundBatchPullTask().run(self.serialized_pull_task, serialized)
+
+        for instance in self.instances:
+            instance.refresh_from_db()
+            self.assertEqual(instance.state, models.TestNewInstance.States.ERRED)
+
+
+class RuntimeStatePollerTest(TestCase):
+
+    def setUp(self):
+        self.link = factories.TestServiceProjectLinkFactory()
+        self.instances = factories.TestNewInstanceFactory.create_batch(
+            size=2, runtime_state='starting', service_project_link=self.link)
+        for index, instance in enumerate(self.instances):
+            task = tasks.BatchPollRuntimeStateTask()
+            task.push_request(id='task-%s' % index, callbacks=[{'task': 'success'}], errbacks=[{'task': 'failure'}])
+            with self.assertRaises(Ignore):
+                task.run(utils.serialize_instance(instance), 'pull_instance_runtime_state', 'online', 'error')
+            task.pop_request()
+
+    def run_poller(self, backend_method, side_effect):
+        with mock.patch('waldur_core.structure.tests.TestBackend.%s' % backend_method,
+                        create=True, side_effect=side_effect) as mocked_pull:
+            with mock.patch('waldur_core.structure.tasks.signature') as mocked_signature:
+                with mock.patch.object(tasks.RuntimeStatePollerTask, 'app'):
+                    tasks.RuntimeStatePollerTask().run()
+        return mocked_pull, mocked_signature
+
+    def test_instances_are_registered_in_poller(self):
+        polls = structure_models.RuntimeStatePoll.objects.all()
+        self.assertEqual(polls.count(), 2)
+        self.assertEqual(polls[0].service_settings, self.link.service.settings)
+        self.assertEqual(polls[0].callbacks, [{'task': 'success'}])
+
+    def test_instances_of_the_same_settings_are_pulled_with_single_call(self):
+        def pull_many(instances):
+            models.TestNewInstance.objects.filter(pk__in=[i.pk for i in instances]).update(runtime_state='online')
+
+        mocked_pull, mocked_signature = self.run_poller('pull_instance_runtime_state_many', pull_many)
+
+        self.assertEqual(mocked_pull.call_count, 1)
+        self.assertFalse(structure_models.RuntimeStatePoll.objects.exists())
+        mocked_signature.assert_called_with({'task': 'success'}, app=mock.ANY)
+
+    def test_instances_are_pulled_by_registered_method(self):
+        structure_models.RuntimeStatePoll.objects.filter(object_id=self.instances[0].pk).update(
+            backend_pull_method='pull_instance')
+
+        with mock.patch('waldur_core.structure.tests.TestBackend.pull_instance', create=True) as pull_instance:
+            with mock.patch('waldur_core.structure.tests.TestBackend.pull_many', create=True) as pull_many:
+                mocked_pull, _ = self.run_poller('pull_instance_runtime_state_many', None)
+
+        self.assertFalse(pull_many.called)
+        pull_instance.assert_called_once_with(self.instances[0])
+        mocked_pull.assert_called_once_with([self.instances[1]])
+
+    def test_instance_is_polled_again_if_runtime_state_is_not_changed(self):
+        mocked_pull, mocked_signature = self.run_poller('pull_instance_runtime_state', None)
+
+        self.assertEqual(mocked_pull.call_count, 2)
+        self.assertEqual(structure_models.RuntimeStatePoll.objects.count(), 2)
+        self.assertFalse(mocked_signature.called)
+
+    def test_failure_callbacks_are_applied_if_runtime_state_is_erred(self):
+        def pull_instance_runtime_state(instance):
+            instance.runtime_state = 'error'
+            instance.save()
+
+        _, mocked_signature = self.run_poller('pull_instance_runtime_state', pull_instance_runtime_state)
+
+        self.assertFalse(structure_models.RuntimeStatePoll.objects.exists())
+        mocked_signature.assert_called_with({'task': 'failure'}, app=mock.ANY)
+
+    def test_failure_callbacks_are_applied_if_deadline_is_reached(self):
+        structure_models.RuntimeStatePoll.objects.update(deadline=timezone.now() - timedelta(minutes=1))
+
+        _, mocked_signature = self.run_poller('pull_instance_runtime_state', None)
+
+        self.assertFalse(structure_models.RuntimeStatePoll.objects.exists())
+        self.assertEqual(mocked_signature.call_count, 2)
+
+
+class ConnectSharedSettingsTaskTest(TestCase):
+
+    def setUp(self):
+        self.projects = factories.ProjectFactory.create_batch(size=3)
+        self.connected_project = self.projects[0]
+        self.service_settings = factories.ServiceSettingsFactory(shared=True)
+        self.service = factories.TestServiceFactory(
+            customer=self.connected_project.customer, settings=self.service_settings)
+        factories.TestServiceProjectLinkFactory(service=self.service, project=self.connected_project)
+
+    def test_missing_services_and_links_are_created_in_chunks(self):
+        with mock.patch('waldur_core.structure.linking.CHUNK_SIZE', 1):
+            tasks.ConnectSharedSettingsTask().execute(self.service_settings)
+
+        for project in self.projects:
+            self.assertTrue(models.TestServiceProjectLink.objects.filter(
+                project=project, service__settings=self.service_settings).exists())
+        self.assertEqual(models.TestService.objects.filter(settings=self.service_settings).count(), 3)
+        self.assertFalse(models.TestService.objects.get(pk=self.service.pk).available_for_all)
+
+    def test_quotas_and_hierarchy_paths_are_initialized_for_new_links(self):
+        tasks.ConnectSharedSettingsTask().execute(self.service_settings)
+
+        project = self.projects[1]
+        link = models.TestServiceProjectLink.objects.get(project=project)
+        self.assertEqual(link.quotas.count(), len(models.TestServiceProjectLink.get_quotas_names()))
+        self.assertEqual(project.quotas.get(name='nc_service_project_link_count').usage, 1)
+        self.assertEqual(project.customer.quotas.get(name='nc_service_count').usage, 1)
+        self.assertEqual(set(project.customer.get_descendants()), {project, link.service, link})
+
+
+@override_waldur_core_settings(SERVICE_SETTINGS_PULL_CONCURRENCY=2, SERVICE_SETTINGS_PULL_CONCURRENCY_PER_TYPE=2)
+@mock.patch('waldur_core.structure.tasks.ServiceSettingsBackgroundPullTask.apply_async')
+class ServiceSettingsListPullTaskTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.settings = [
+            factories.ServiceSettingsFactory(),
+            factories.ServiceSettingsFactory(pulled_at=now - timedelta(hours=3)),
+            factories.ServiceSettingsFactory(pulled_at=now - timedelta(hours=1)),
+        ]
+
+    def get_scheduled_settings(self, mocked_apply):
+        return [utils.deserialize_instance(call[1]['args'][0]) for call in mocked_apply.call_args_list]
+
+    def pull(self, service_settings, side_effect=None):
+        serialized = utils.serialize_instance(service_settings)
+        with mock.patch('waldur_core.structure.tests.TestBackend.sync', create=True, side_effect=side_effect):
+            tasks.ServiceSettingsBackgroundPullTask().run(serialized)
+        service_settings.refresh_from_db()
+
+    def test_settings_are_scheduled_in_order_of_last_pull_within_concurrency_limit(self, mocked_apply):
+        tasks.ServiceSettingsListPullTask().run()
+
+        self.assertEqual(self.get_scheduled_settings(mocked_apply), self.settings[:2])
+
+    def test_settings_are_scheduled_when_pull_slot_is_released(self, mocked_apply):
+        tasks.ServiceSettingsListPullTask().run()
+        self.pull(self.settings[0])
+        mocked_apply.reset_mock()
+
+        tasks.ServiceSettingsListPullTask().run()
+
+        self.assertEqual(self.get_scheduled_settings(mocked_apply), [self.settings[2]])
+
+    def test_settings_are_not_scheduled_again_until_pull_is_completed(self, mocked_apply):
+        with override_waldur_core_settings(SERVICE_SETTINGS_PULL_CONCURRENCY=10):
+            tasks.ServiceSettingsListPullTask().run()
+            tasks.ServiceSettingsListPullTask().run()
+
+        self.assertEqual(mocked_apply.call_count, 2)
+
+    @override_waldur_core_settings(SERVICE_SETTINGS_PULL_CONCURRENCY_PER_TYPE=1)
+    def test_concurrency_is_limited_per_service_type(self, mocked_apply):
+        structure_models.ServiceSettings.objects.filter(pk=self.settings[2].pk).update(type='Other')
+
+        tasks.ServiceSettingsListPullTask().run()
+
+        self.assertEqual(self.get_scheduled_settings(mocked_apply), [self.settings[0], self.settings[2]])
+
+    @override_waldur_core_settings(SERVICE_SETTINGS_PULL_CONCURRENCY=1, SERVICE_SETTINGS_PULL_CONCURRENCY_PER_TYPE=1)
+    def test_settings_which_did_not_get_global_slot_do_not_block_other_types(self, mocked_apply):
+        structure_models.ServiceSettings.objects.filter(pk=self.settings[1].pk).update(type='Other')
+        global_semaphore = structure_utils.get_service_settings_pull_semaphore()
+        global_semaphore.acquire('foreign')
+        tasks.ServiceSettingsListPullTask().run()
+
+        # Global slot is released, but type of the first settings is busy now.
+        global_semaphore.release('foreign')
+        structure_utils.get_service_settings_pull_semaphore(self.settings[0].type).acquire('foreign')
+        tasks.ServiceSettingsListPullTask().run()
+
+        self.assertEqual(self.get_scheduled_settings(mocked_apply), [self.settings[1]])
+
+    def test_pull_slots_are_released_if_settings_are_deleted(self, mocked_apply):
+        tasks.ServiceSettingsListPullTask().run()
+        scheduled_call = mocked_apply.call_args_list[0][1]
+        self.settings[0].delete()
+
+        with self.assertRaises(structure_models.ServiceSettings.DoesNotExist):
+            tasks.ServiceSettingsBackgroundPullTask().run(*scheduled_call['args'], **scheduled_call['kwargs'])
+        mocked_apply.reset_mock()
+        tasks.ServiceSettingsListPullTask().run()
+
+        self.assertEqual(self.get_scheduled_settings(mocked_apply), [self.settings[2]])
+
+    def test_pull_duration_and_time_are_recorded(self, _):
+        self.pull(self.settings[0])
+
+        self.assertIsNotNone(self.settings[0].pulled_at)
+        self.assertIsNotNone(self.settings[0].pull_duration)
+        self.assertEqual(self.settings[0].pull_failures, 0)
+
+    @override_waldur_core_settings(SERVICE_SETTINGS_PULL_INTERVAL=timedelta(minutes=30))
+    def test_erred_settings_are_pulled_with_exponential_backoff(self, _):
+        service_settings = self.settings[0]
+        error = ServiceBackendError('Backend is not available.')
+
+        self.pull(service_settings, side_effect=error)
+        first_delay = service_settings.next_pull_at - timezone.now()
+        self.pull(service_settings, side_effect=error)
+        second_delay = service_settings.next_pull_at - timezone.now()
+
+        self.assertEqual(service_settings.state, structure_models.ServiceSettings.States.ERRED)
+        self.assertEqual(service_settings.pull_failures, 2)
+        self.assertIsNone(service_settings.pulled_at)
+        self.assertAlmostEqual(first_delay.total_seconds(), 60 * 60, delta=60)
+        self.assertAlmostEqual(second_delay.total_seconds(), 2 * 60 * 60, delta=60)
+
+    def test_erred_settings_are_not_scheduled_until_backoff_is_expired(self, mocked_apply):
+        self.pull(self.settings[0], side_effect=ServiceBackendError('Backend is not available.'))
+
+        tasks.ServiceSettingsListPullTask().run()
+
+        self.assertNotIn(self.settings[0], self.get_scheduled_settings(mocked_apply))
@@ -1,8 +1,11 @@
 import unittest
 
+from django.test import TestCase
 from six.moves import mock
 
-from waldur_core.structure.utils import update_pulled_fields
+from waldur_core.structure.tests import factories, models
+from waldur_core.structure.utils import (handle_resource_not_found, handle_resource_update_success,
+                                         update_pulled_fields)
 
 
 class InstanceMock(object):
@@ -37,3 +40,26 @@ class UpdatePulledFieldsTest(unittest.TestCase):
         vm2 = InstanceMock(error_message='Server does not respond.')
         update_pulled_fields(vm1, vm2, ('name',))
         self.assertEqual(vm1.save.call_count, 1)
+
+
+class HandleResourceStateTest(TestCase):
+    States = models.TestNewInstance.States
+
+    def setUp(self):
+        self.resource = factories.TestNewInstanceFactory(state=self.States.UPDATING)
+        # Resource is deleted concurrently, so its state is changed in database.
+        models.TestNewInstance.objects.filter(pk=self.resource.pk).update(state=self.States.DELETING)
+
+    def test_concurrently_changed_resource_is_not_marked_as_erred(self):
+        handle_resource_not_found(self.resource)
+
+        self.assertEqual(self.resource.state, self.States.UPDATING)
+        self.resource.refresh_from_db()
+        self.assertEqual(self.resource.state, self.States.DELETING)
+
+    def test_concurrently_changed_resource_is_not_marked_as_ok(self):
+        handle_resource_update_success(self.resource)
+
+        self.assertEqual(self.resource.state, self.States.UPDATING)
+        self.resource.refresh_from_db()
+        self.assertEqual(self.resource.state, self.States.DELETING)
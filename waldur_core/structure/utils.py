@@ -1,37 +1,38 @@
 import collections
 import logging
+import time
 
+from django.conf import settings
+from django.core.cache import cache
 from django.db import models
 from django.db.migrations.topological_sort import stable_topological_sort
 from django.utils.lru_cache import lru_cache
-import requests
+from django_fsm import ConcurrentTransition
 
-from . import SupportedServices
+from waldur_core.core import tasks as core_tasks, utils as core_utils
+from waldur_core.core.models import StateMixin
+
+from . import SupportedServices, ServiceBackendNotImplemented
+# Geoip helpers have been moved to geoip module, they are imported here for backward compatibility of plugins.
+from .geoip import Coordinates, GeoIpException, get_coordinates_by_ip  # noqa: F401
 
 logger = logging.getLogger(__name__)
-Coordinates = collections.namedtuple('Coordinates', ('latitude', 'longitude'))
 FieldInfo = collections.namedtuple('FieldInfo', 'fields fields_required extra_fields_required')
 
-
-class GeoIpException(Exception):
-    pass
-
-
-def get_coordinates_by_ip(ip_address):
-    url = 'http://freegeoip.net/json/{}'.format(ip_address)
-
-    try:
-        response = requests.get(url)
-    except requests.exceptions.RequestException as e:
-        raise GeoIpException("Request to geoip API %s failed: %s" % (url, e))
-
-    if response.ok:
-        data = response.json()
-        return Coordinates(latitude=data['latitude'],
-                           longitude=data['longitude'])
-    else:
-        params = (url, response.status_code, response.text)
-        raise GeoIpException("Request to geoip API %s failed: %s %s" % params)
+# Provisioning slot is released automatically if resource stays in "creating" state too long.
+PROVISIONING_SLOT_TTL = 60 * 60 * 3
+# Waiter is removed from queue if it has not tried to acquire slot again during this period.
+PROVISIONING_WAIT_TTL = 60
+# Pull slot is released automatically if pull of service settings has not completed during this period.
+SERVICE_SETTINGS_PULL_SLOT_TTL = 60 * 60
+# Service settings waiting for pull slot are removed from queue if they are not scheduled again during this period.
+SERVICE_SETTINGS_PULL_WAIT_TTL = 60 * 5
+# Stats refresh lock is released automatically if background task has not released it.
+SERVICE_SETTINGS_STATS_LOCK_TTL = 60 * 10
+# Clients are asked to repeat request after this number of seconds if stats have not been pulled yet.
+SERVICE_SETTINGS_STATS_RETRY_AFTER = 10
+# Stale stats are served until they are refreshed, but not longer than this period.
+SERVICE_SETTINGS_STATS_TTL = 60 * 60 * 24
 
 
 @lru_cache(maxsize=1)
@@ -110,19 +111,111 @@ def update_pulled_fields(instance, imported_instance, fields):
         instance.save()
 
 
+def get_provisioning_semaphore(resource, limit=None):
+    """ Return semaphore that limits number of resources of the same model
+        that are provisioned concurrently within the same service settings.
+    """
+    model = resource._meta.model
+    settings_id = resource.service_project_link.service.settings_id
+
+    def get_creating_resources():
+        return model.objects.filter(
+            state=StateMixin.States.CREATING,
+            service_project_link__service__settings_id=settings_id,
+        ).values_list('pk', flat=True)
+
+    return core_utils.CacheSemaphore(
+        key='structure:provisioning:%s:%s' % (model._meta.label_lower, settings_id),
+        limit=limit,
+        ttl=PROVISIONING_SLOT_TTL,
+        wait_ttl=PROVISIONING_WAIT_TTL,
+        get_initial_holders=get_creating_resources,
+    )
+
+
+def get_service_settings_pull_semaphore(service_type=None):
+    """ Return semaphore that limits number of service settings pulled concurrently.
+        If service type is specified, semaphore is shared only by settings of this type.
+    """
+    if service_type is None:
+        key = 'structure:service_settings_pull'
+        limit = settings.WALDUR_CORE['SERVICE_SETTINGS_PULL_CONCURRENCY']
+    else:
+        key = 'structure:service_settings_pull:%s' % service_type
+        limit = settings.WALDUR_CORE['SERVICE_SETTINGS_PULL_CONCURRENCY_PER_TYPE']
+    return core_utils.CacheSemaphore(
+        key=key,
+        limit=limit,
+        ttl=SERVICE_SETTINGS_PULL_SLOT_TTL,
+        wait_ttl=SERVICE_SETTINGS_PULL_WAIT_TTL,
+    )
+
+
+def get_service_settings_pull_delay(failures):
+    """ Return delay of next pull of service settings, it grows exponentially with number of failed pulls. """
+    interval = settings.WALDUR_CORE['SERVICE_SETTINGS_PULL_INTERVAL']
+    if not failures:
+        return interval
+    max_delay = settings.WALDUR_CORE['SERVICE_SETTINGS_PULL_MAX_BACKOFF']
+    # Exponent is bounded in order to avoid overflow of timedelta.
+    return min(interval * 2 ** min(failures, 16), max_delay)
+
+
+def get_service_settings_stats_cache_key(service_settings_uuid):
+    return 'structure:service_settings_stats:%s' % service_settings_uuid
+
+
+def get_service_settings_stats_lock_key(service_settings_uuid):
+    return 'structure:service_settings_stats_lock:%s' % service_settings_uuid
+
+
+def get_service_settings_stats(service_settings):
+    """ Return last known stats of service settings and time when they were pulled from backend.
+        If stats are missing or stale, refresh is scheduled in background and
+        (None, None) is returned for missing stats.
+    """
+    uuid = service_settings.uuid.hex
+    entry = cache.get(get_service_settings_stats_cache_key(uuid))
+    timeout = settings.WALDUR_CORE['SERVICE_SETTINGS_STATS_CACHE_TIMEOUT']
+    if entry is None or entry['timestamp'] + timeout.total_seconds() < time.time():
+        # Lock is acquired atomically, so only one refresh is scheduled for concurrent requests.
+        if cache.add(get_service_settings_stats_lock_key(uuid), True, SERVICE_SETTINGS_STATS_LOCK_TTL):
+            core_tasks.send_task('structure', 'pull_service_settings_stats')(uuid)
+    if entry is None:
+        return None, None
+    return entry['stats'], entry['timestamp']
+
+
+def pull_service_settings_stats(service_settings):
+    """ Fetch stats of service settings from backend and store them in cache """
+    uuid = service_settings.uuid.hex
+    try:
+        stats = service_settings.get_backend().get_stats()
+    except ServiceBackendNotImplemented:
+        stats = {}
+    finally:
+        cache.delete(get_service_settings_stats_lock_key(uuid))
+    entry = {'stats': stats, 'timestamp': time.time()}
+    cache.set(get_service_settings_stats_cache_key(uuid), entry, SERVICE_SETTINGS_STATS_TTL)
+    return stats
+
+
 def handle_resource_not_found(resource):
     """
     Set resource state to ERRED and append/create "not found" error message.
     """
-    resource.set_erred()
-    resource.runtime_state = ''
     message = 'Does not exist at backend.'
-    if message not in resource.error_message:
-        if not resource.error_message:
-            resource.error_message = message
+    error_message = resource.error_message
+    if message not in error_message:
+        if not error_message:
+            error_message = message
         else:
-            resource.error_message += ' (%s)' % message
-    resource.save()
+            error_message += ' (%s)' % message
+    try:
+        resource.atomic_transition('set_erred', runtime_state='', error_message=error_message)
+    except ConcurrentTransition as e:
+        logger.debug(e, exc_info=True)
+        return
     logger.warning('%s %s (PK: %s) does not exist at backend.' % (
         resource.__class__.__name__, resource, resource.pk))
 
@@ -131,20 +224,24 @@ def handle_resource_update_success(resource):
     """
     Recover resource if its state is ERRED and clear error message.
     """
-    update_fields = []
-    if resource.state == resource.States.ERRED:
-        resource.recover()
-        update_fields.append('state')
-
-    if resource.state in (resource.States.UPDATING, resource.States.CREATING):
-        resource.set_ok()
-        update_fields.append('state')
-
+    fields = {}
     if resource.error_message:
-        resource.error_message = ''
-        update_fields.append('error_message')
+        fields['error_message'] = ''
 
-    if update_fields:
-        resource.save(update_fields=update_fields)
+    transition = None
+    if resource.state == resource.States.ERRED:
+        transition = 'recover'
+    elif resource.state in (resource.States.UPDATING, resource.States.CREATING):
+        transition = 'set_ok'
+
+    if transition:
+        try:
+            resource.atomic_transition(transition, **fields)
+        except ConcurrentTransition as e:
+            logger.debug(e, exc_info=True)
+            return
+    elif fields:
+        resource.error_message = ''
+        resource.save(update_fields=['error_message'])
     logger.warning('%s %s (PK: %s) was successfully updated.' % (
         resource.__class__.__name__, resource, resource.pk))
@@ -1,16 +1,25 @@
 from __future__ import unicode_literals
 
+import bisect
+import collections
+from collections import defaultdict
+from datetime import timedelta
+from functools import partial, reduce
 import logging
+import operator
 import time
-from collections import defaultdict
-from functools import partial
+from uuid import UUID
 
 from django.conf import settings as django_settings
 from django.contrib import auth
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.db import transaction, IntegrityError
-from django.db.models import Q
+from django.db.models import Min, Q
 from django.http import Http404
+from django.utils import timezone
 from django.utils.functional import cached_property
+from django.utils.http import http_date
 from django.utils.translation import ugettext_lazy as _
 from django.views.static import serve
 from django_filters.rest_framework import DjangoFilterBackend
@@ -21,7 +30,6 @@ from rest_framework import serializers as rf_serializers
 from rest_framework.decorators import detail_route, list_route
 from rest_framework.exceptions import PermissionDenied, MethodNotAllowed, NotFound, APIException, ValidationError
 from rest_framework.response import Response
-from reversion.models import Version
 import six
 
 from waldur_core.core import managers as core_managers
@@ -34,10 +42,10 @@ from waldur_core.core import views as core_views
 from waldur_core.core.utils import datetime_to_timestamp, sort_dict
 from waldur_core.logging import models as logging_models
 from waldur_core.logging.loggers import expand_alert_groups
-from waldur_core.quotas.models import QuotaModelMixin, Quota
+from waldur_core.quotas.models import QuotaModelMixin
 from waldur_core.structure import (
     SupportedServices, ServiceBackendError, ServiceBackendNotImplemented,
-    filters, managers, models, permissions, serializers)
+    filters, managers, models, permissions, serializers, utils)
 from waldur_core.structure.managers import filter_queryset_for_user
 from waldur_core.structure.metadata import ActionsMetadata
 from waldur_core.structure.signals import resource_imported, structure_role_updated
@@ -939,17 +947,22 @@ class ServiceSettingsViewSet(core_mixins.EagerLoadMixin,
             'storage_quota': 7000,
             'storage_usage': 5000
         }
+
+        Stats are pulled from backend in background and last known value is returned immediately.
+        Time when stats were pulled is reported in Last-Modified header.
+        If stats have not been pulled yet, HTTP 202 is returned with Retry-After header.
         """
 
         service_settings = self.get_object()
-        backend = service_settings.get_backend()
+        stats, timestamp = utils.get_service_settings_stats(service_settings)
+        if timestamp is None:
+            response = Response({'detail': _('Stats are being pulled from backend.')}, status=status.HTTP_202_ACCEPTED)
+            response['Retry-After'] = utils.SERVICE_SETTINGS_STATS_RETRY_AFTER
+            return response
 
-        try:
-            stats = backend.get_stats()
-        except ServiceBackendNotImplemented:
-            stats = {}
-
-        return Response(stats, status=status.HTTP_200_OK)
+        response = Response(stats, status=status.HTTP_200_OK)
+        response['Last-Modified'] = http_date(timestamp)
+        return response
 
     @detail_route(methods=['post'])
     def update_certifications(self, request, uuid=None):
@@ -1147,6 +1160,67 @@ class ResourceSummaryViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
         return Response({SupportedServices.get_name_for_model(qs.model): qs.count()
                          for qs in queryset.querysets})
 
+    @list_route()
+    def search(self, request):
+        """
+        Search resources of all types by prefix of name, backend ID or IP address or by full tag name.
+        Only search index is queried, so resource-specific filters are not supported. Example:
+
+          /api/resources/search/?query=web
+
+        Resource type and category filters are supported, for example:
+
+          /api/resources/search/?query=web&resource_category=vms
+
+        Until index is built by "reindex_resources" command, resources are searched directly
+        by prefix of name, backend ID or by full tag name.
+        """
+        query = request.query_params.get('query', '').strip()
+        if not query:
+            raise ValidationError({'query': _('This query parameter is required.')})
+
+        resource_models = {k: v for k, v in SupportedServices.get_resource_models().items()}
+        resource_models = self._filter_by_category(resource_models)
+        resource_models = self._filter_by_types(resource_models)
+        resource_models = self._filter_resources(resource_models)
+
+        if not models.ResourceIndex.objects.exists():
+            queryset = managers.ResourceSummaryQuerySet(resource_models.values()).filter(
+                Q(name__istartswith=query) | Q(backend_id__startswith=query) | Q(tags__name__iexact=query)
+            ).distinct()
+            queryset = filter_queryset_for_user(queryset, request.user).order_by('name')
+            queryset = serializers.SummaryResourceSerializer.eager_load(queryset)
+            page = self.paginate_queryset(queryset)
+            resources = page if page is not None else list(queryset)
+        else:
+            content_types = ContentType.objects.get_for_models(*resource_models.values()).values()
+            queryset = models.ResourceIndex.search(query).filter(content_type__in=content_types)
+            queryset = filter_queryset_for_user(queryset, request.user).order_by('name', 'pk')
+            page = self.paginate_queryset(queryset)
+            resources = self._get_indexed_resources(page if page is not None else queryset)
+
+        serializer = self.get_serializer(resources, many=True)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
+    def _get_indexed_resources(self, index_rows):
+        """ Fetch resources for index rows using one query per resource type, keep order of rows """
+        object_ids = defaultdict(list)
+        for row in index_rows:
+            object_ids[row.content_type_id].append(row.object_id)
+
+        resources = {}
+        for content_type_id, ids in object_ids.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            serializer_class = SupportedServices.get_resource_serializer(model)
+            queryset = serializer_class.eager_load(model.objects.filter(pk__in=ids))
+            for resource in queryset:
+                resources[(content_type_id, resource.pk)] = resource
+
+        return [resources[(row.content_type_id, row.object_id)] for row in index_rows
+                if (row.content_type_id, row.object_id) in resources]
+
 
 class ServicesViewSet(mixins.ListModelMixin,
                       viewsets.GenericViewSet):
@@ -1185,10 +1259,23 @@ class BaseCounterView(viewsets.GenericViewSet):
     # Fix for schema generation
     queryset = []
     extra_counters = {}
+    # Names of counters which values are cached for each user.
+    cacheable_counters = set()
+    # Maps names of counters to names of quotas of the object that store their values.
+    quota_counters = {}
 
     @classmethod
-    def register_counter(cls, name, func):
+    def register_counter(cls, name, func, cacheable=False):
+        """
+        Register extra counter. Value of cacheable counter is cached for each user
+        for COUNTERS_CACHE_TIMEOUT, so it should be used only for counters that can be stale.
+        """
         cls.extra_counters[name] = func
+        # Set is copied, so that counters of other views sharing it are not changed.
+        if cacheable:
+            cls.cacheable_counters = cls.cacheable_counters | {name}
+        else:
+            cls.cacheable_counters = cls.cacheable_counters - {name}
 
     def get_counters(self):
         counters = self.get_fields()
@@ -1196,16 +1283,55 @@ class BaseCounterView(viewsets.GenericViewSet):
             counters[name] = partial(func, self.object)
         return counters
 
+    def get_quota_counters(self):
+        return self.quota_counters
+
     def list(self, request, uuid=None):
-        result = {}
         counters = self.get_counters()
         fields = request.query_params.getlist('fields') or counters.keys()
-        for field, func in counters.items():
-            if field in fields:
-                result[field] = func()
+        fields = [field for field in counters if field in fields]
+
+        quota_counters = {field: quota for field, quota in self.get_quota_counters().items() if field in fields}
+        result = self._get_quota_usages(quota_counters)
+
+        cacheable_fields = [field for field in fields if field not in result and field in self.cacheable_counters]
+        result.update(self._get_cached_counters(cacheable_fields, counters))
+
+        for field in fields:
+            if field not in result:
+                result[field] = counters[field]()
 
         return Response(result)
 
+    def _get_quota_usages(self, quota_counters):
+        """ Read usages of all quotas of the object in single query """
+        if not quota_counters:
+            return {}
+        usages = dict(self.object.quotas.filter(name__in=quota_counters.values()).values_list('name', 'usage'))
+        return {field: int(usages[quota]) for field, quota in quota_counters.items() if quota in usages}
+
+    def _get_cache_key(self, field):
+        return 'structure:counters:%s:%s:%s:%s:%s' % (
+            self.__class__.__name__,
+            self.kwargs.get('uuid'),
+            self.request.user.uuid.hex,
+            field,
+            ','.join(sorted(self.request.query_params.getlist('exclude_features'))),
+        )
+
+    def _get_cached_counters(self, fields, counters):
+        if not fields:
+            return {}
+        keys = {self._get_cache_key(field): field for field in fields}
+        result = {keys[key]: value for key, value in cache.get_many(keys.keys()).items()}
+        missing = {key: field for key, field in keys.items() if field not in result}
+        if missing:
+            values = {key: counters[field]() for key, field in missing.items()}
+            timeout = django_settings.WALDUR_CORE['COUNTERS_CACHE_TIMEOUT'].total_seconds()
+            cache.set_many(values, timeout)
+            result.update({missing[key]: value for key, value in values.items()})
+        return result
+
     def get_fields(self):
         raise NotImplementedError()
 
@@ -1238,10 +1364,21 @@ class CustomerCountersView(BaseCounterView):
     """
     lookup_field = 'uuid'
     extra_counters = {}
+    cacheable_counters = {'alerts', 'projects', 'services'}
 
     def get_queryset(self):
         return filter_queryset_for_user(models.Customer.objects.all().only('pk', 'uuid'), self.request.user)
 
+    def get_quota_counters(self):
+        counters = {'users': models.Customer.Quotas.nc_user_count.name}
+        # Quotas count all customer projects and services,
+        # so they could be used only if user is not restricted to some projects.
+        user = self.request.user
+        if user.is_staff or user.is_support or self.object.has_user(user):
+            counters['projects'] = models.Customer.Quotas.nc_project_count.name
+            counters['services'] = models.Customer.Quotas.nc_service_count.name
+        return counters
+
     def get_fields(self):
         return {
             'alerts': self.get_alerts,
@@ -1289,6 +1426,13 @@ class ProjectCountersView(BaseCounterView):
     """
     lookup_field = 'uuid'
     extra_counters = {}
+    cacheable_counters = {'alerts', 'users'}
+    quota_counters = {
+        'vms': models.Project.Quotas.nc_vm_count.name,
+        'apps': models.Project.Quotas.nc_app_count.name,
+        'private_clouds': models.Project.Quotas.nc_private_cloud_count.name,
+        'storages': models.Project.Quotas.nc_storage_count.name,
+    }
 
     def get_queryset(self):
         return filter_queryset_for_user(models.Project.objects.all().only('pk', 'uuid'), self.request.user)
@@ -1631,6 +1775,8 @@ class QuotaTimelineStatsView(views.APIView):
 
     Answer will be list of dictionaries with fields, determining time frame. It's size is equal to interval parameter.
     Values within each bucket are averaged for each project and then all projects metrics are summarized.
+    Past values are read from hourly quotas snapshots, values of the current hour are computed from current quotas.
+    Values before the first snapshot are restored from quotas history.
 
     Value fields include:
 
@@ -1643,60 +1789,109 @@ class QuotaTimelineStatsView(views.APIView):
     """
 
     def get(self, request, format=None):
-        scopes = self.get_quota_scopes(request)
-        ranges = self.get_ranges(request)
+        aggregate_serializer = serializers.AggregateSerializer(data=request.query_params)
+        aggregate_serializer.is_valid(raise_exception=True)
+        timeline_serializer = self.get_timeline_serializer(request)
+        interval = timeline_serializer.validated_data['interval']
+        ranges = self.get_ranges(timeline_serializer)
         items = request.query_params.getlist('item') or self.get_all_spls_quotas()
 
+        projects = aggregate_serializer.get_projects(request.user)
+        scopes = self.get_rollup_scopes(aggregate_serializer, projects)
+        # Quotas could be changed after the last snapshot, so the trailing ranges are computed from current quotas.
+        live_start = timezone.now().replace(minute=0, second=0, microsecond=0)
+        # Ranges that precede the first snapshot are computed from quotas history,
+        # so timeline is not empty until snapshots are backfilled.
+        rollup_start = models.QuotaTimelineRollup.objects.aggregate(first=Min('date'))['first'] or timezone.now()
+        past_ranges = [r for r in ranges if r[0] <= live_start]
+        snapshots = self.get_snapshots(scopes, items, interval, [r for r in past_ranges if r[0] >= rollup_start])
+        history_quotas = self.get_history_quotas(projects, items, [r for r in past_ranges if r[0] < rollup_start])
+        live_quotas = None
+
         collector = QuotaTimelineCollector()
-        for item in items:
-            for scope in scopes:
-                values = self.get_stats_for_scope(item, scope, ranges)
-                for (end, start), (limit, usage) in zip(ranges, values):
+        for end, start in ranges:
+            if end > live_start or end in history_quotas:
+                if end in history_quotas:
+                    quotas = history_quotas[end]
+                else:
+                    if live_quotas is None:
+                        live_quotas = models.QuotaTimelineRollup.aggregate_quotas(projects, items)
+                    quotas = live_quotas
+                for (model, object_id, item), (limit, usage) in quotas.items():
+                    if model == models.Project:
+                        collector.add_quota(start, end, item, limit, usage)
+                continue
+            for (content_type_id, object_id, item), dates, values in snapshots:
+                index = bisect.bisect_right(dates, end)
+                if index:
+                    limit, usage = values[index - 1]
                     collector.add_quota(start, end, item, limit, usage)
 
         stats = list(map(sort_dict, collector.to_dict()))[::-1]
         return Response(stats, status=status.HTTP_200_OK)
 
-    def get_quota_scopes(self, request):
-        serializer = serializers.AggregateSerializer(data=request.query_params)
-        serializer.is_valid(raise_exception=True)
-        scopes = sum([list(qs) for qs in serializer.get_service_project_links(request.user)], [])
-        # XXX: quick and dirty hack for OpenStack: use tenants instead of SPLs as quotas scope.
-        new_scopes = []
-        for index, scope in enumerate(scopes):
-            if scope.service.settings.type == 'OpenStack':
-                new_scopes += list(scope.tenants.all())
-            else:
-                new_scopes.append(scope)
-        return new_scopes
+    def get_rollup_scopes(self, serializer, projects):
+        """ Return list of (content type ID, object IDs) tuples of rollup scopes.
+            Customer snapshots are used only if all customer projects are visible to user.
+        """
+        content_types = ContentType.objects.get_for_models(models.Project, models.Customer)
+        visible_projects = dict(projects.values_list('pk', 'customer_id'))
+        if serializer.data['aggregate'] == 'project':
+            return [(content_types[models.Project].id, list(visible_projects.keys()))]
+
+        customer_projects = defaultdict(set)
+        for project_id, customer_id in models.Project.objects.filter(
+                customer_id__in=set(visible_projects.values())).values_list('pk', 'customer_id'):
+            customer_projects[customer_id].add(project_id)
+        customer_ids = [customer_id for customer_id, project_ids in customer_projects.items()
+                        if project_ids <= set(visible_projects.keys())]
+        project_ids = [project_id for project_id, customer_id in visible_projects.items()
+                       if customer_id not in customer_ids]
+        return [(content_types[models.Customer].id, customer_ids), (content_types[models.Project].id, project_ids)]
+
+    def get_history_quotas(self, projects, items, ranges):
+        """ Return dictionary that maps end of range to quotas aggregated from quotas history """
+        if not ranges:
+            return {}
+        dates = sorted(end for end, start in ranges)
+        return {date: models.QuotaTimelineRollup.aggregate_quotas(projects, items, values=values)
+                for date, values in models.QuotaTimelineRollup.iterate_history_values(dates, items)}
+
+    def get_snapshots(self, scopes, items, interval, ranges):
+        """ Fetch snapshots of scopes using single query.
+            Return list of (key, dates, values) tuples, where dates are sorted for each scope and item.
+        """
+        if not ranges or not any(object_ids for _, object_ids in scopes):
+            return []
+        Intervals = models.QuotaTimelineRollup.Intervals
+        if interval == Intervals.HOUR:
+            margin = timedelta(hours=1)
+            intervals = [Intervals.HOUR, Intervals.DAY, Intervals.WEEK, Intervals.MONTH]
+        else:
+            margin = timedelta(days=1)
+            intervals = [Intervals.DAY, Intervals.WEEK, Intervals.MONTH]
+
+        query = reduce(operator.or_, [Q(content_type_id=content_type_id, object_id__in=object_ids)
+                                      for content_type_id, object_ids in scopes if object_ids])
+        rows = models.QuotaTimelineRollup.objects.filter(query).filter(
+            name__in=items,
+            interval__in=intervals,
+            date__gte=ranges[-1][0] - margin,
+            date__lte=ranges[0][0],
+        ).order_by('date').values_list('content_type_id', 'object_id', 'name', 'date', 'limit', 'usage')
+
+        snapshots = collections.OrderedDict()
+        for content_type_id, object_id, name, date, limit, usage in rows:
+            dates, values = snapshots.setdefault((content_type_id, object_id, name), ([], []))
+            dates.append(date)
+            values.append((limit, usage))
+        return [(key, dates, values) for key, (dates, values) in snapshots.items()]
 
     def get_all_spls_quotas(self):
-        # XXX: quick and dirty hack for OpenStack: use tenants instead of SPLs as quotas scope.
-        spl_models = [m if m.__name__ != 'OpenStackServiceProjectLink' else m.tenants.field.model
-                      for m in models.ServiceProjectLink.get_all_models()]
-        return sum([spl_model.get_quotas_names() for spl_model in spl_models], [])
+        scope_models = models.QuotaTimelineRollup.get_quota_scope_models()
+        return sum([model.get_quotas_names() for model, project_path in scope_models], [])
 
-    def get_stats_for_scope(self, quota_name, scope, dates):
-        stats_data = []
-        try:
-            quota = scope.quotas.get(name=quota_name)
-        except Quota.DoesNotExist:
-            return stats_data
-        versions = Version.objects.get_for_object(quota).select_related('revision').filter(
-            revision__date_created__lte=dates[0][0]).iterator()
-        version = None
-        for end, start in dates:
-            try:
-                while version is None or version.revision.date_created > end:
-                    version = next(versions)
-                stats_data.append((version._object_version.object.limit,
-                                   version._object_version.object.usage))
-            except StopIteration:
-                break
-
-        return stats_data
-
-    def get_ranges(self, request):
+    def get_timeline_serializer(self, request):
         mapped = {
             'start_time': request.query_params.get('from'),
             'end_time': request.query_params.get('to'),
@@ -1706,7 +1901,9 @@ class QuotaTimelineStatsView(views.APIView):
 
         serializer = core_serializers.TimelineSerializer(data=data)
         serializer.is_valid(raise_exception=True)
+        return serializer
 
+    def get_ranges(self, serializer):
         date_points = serializer.get_date_points()
         reversed_dates = date_points[::-1]
         ranges = list(zip(reversed_dates[:-1], reversed_dates[1:]))
@@ -1781,6 +1978,31 @@ class ResourceViewSet(core_mixins.ExecutorMixin, core_views.ActionsViewSet):
     pull_executor = NotImplemented
     pull_validators = [core_validators.StateValidator(models.NewResource.States.OK, models.NewResource.States.ERRED)]
 
+    @list_route()
+    def actions(self, request):
+        """
+        Return availability of actions for several resources at once.
+        Resources are specified by uuid query parameter, for example:
+
+        /api/<resource_endpoint>/actions/?uuid=<first_uuid>&uuid=<second_uuid>
+
+        Response maps UUID of each resource to its actions:
+
+        {
+            "7b9de8e5b26e4c4e8b6e2a8d1b4a3c52": {
+                "destroy": {"enabled": false, "reason": "Valid states for operation: OK, ERRED."},
+                "pull": {"enabled": true, "reason": null}
+            }
+        }
+        """
+        try:
+            uuids = [UUID(value).hex for value in request.query_params.getlist('uuid')]
+        except ValueError:
+            raise ValidationError({'uuid': _('Invalid UUID.')})
+        resources = self.filter_queryset(self.get_queryset()).filter(uuid__in=uuids)
+        metadata = self.metadata_class()
+        return Response(metadata.get_actions_availability(request, self, resources), status=status.HTTP_200_OK)
+
 
 class BaseResourceViewSet(six.with_metaclass(ResourceViewMetaclass, ResourceViewSet)):
     pass